@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPEG 解码耗时对比
+对每个可用的解码后端（opencv，安装了 PyTurboJPEG 时还有 turbojpeg），
+在不同分辨率下测量完整解码、1/2、1/4、1/8 缩小解码以及彩色/灰度的耗时，
+并对比同一帧多个使用方各自解码与共享 DecodedFrame 的耗时
+
+用法:
+    python scripts/bench_decoder.py
+    python scripts/bench_decoder.py --sizes 640x480 1920x1080 --repeat 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from jpeg_decoder import (  # noqa: E402
+    COLOR_BGR, COLOR_GRAY, DECODER_OPENCV, DECODER_TURBOJPEG, SCALES,
+    DecodedFrame, create_decoder, turbojpeg_available
+)
+
+
+def make_frame(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    return cv2.imencode('.jpg', np.clip(image, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def measure(func, repeat):
+    """返回每次调用的平均耗时（毫秒）"""
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_shared(decoder, jpeg, repeat):
+    """保存需要原图、显示需要 1/4 彩色、相似帧检测需要 1/8 灰度"""
+    requests = ((1, COLOR_BGR), (4, COLOR_BGR), (8, COLOR_GRAY))
+
+    def separate():
+        for scale, color in requests:
+            decoder.decode(jpeg, scale, color)
+
+    def shared():
+        decoded = DecodedFrame(jpeg, decoder)
+        for scale, color in requests:
+            decoded.get(scale, color)
+
+    return measure(separate, repeat), measure(shared, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEG 解码耗时对比")
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1920x1080'], help="图像尺寸")
+    parser.add_argument('--repeat', type=int, default=30, help="每项测量的解码次数")
+    args = parser.parse_args()
+
+    backends = [create_decoder(DECODER_OPENCV)[0]]
+    if turbojpeg_available():
+        backends.append(create_decoder(DECODER_TURBOJPEG)[0])
+    else:
+        print("未安装 PyTurboJPEG（或找不到 libjpeg-turbo），只测试 opencv")
+
+    for size in args.sizes:
+        width, height = (int(value) for value in size.lower().split('x'))
+        jpeg = make_frame(width, height)
+        print(f"\n图像: {size} ({len(jpeg) / 1024:.0f} KB)")
+        print(f"{'后端':<12}{'缩小':>6}{'彩色(ms)':>12}{'灰度(ms)':>12}{'相对原图':>10}")
+        print("-" * 52)
+        for decoder in backends:
+            full = None
+            for scale in SCALES:
+                bgr = measure(lambda: decoder.decode(jpeg, scale, COLOR_BGR), args.repeat)
+                gray = measure(lambda: decoder.decode(jpeg, scale, COLOR_GRAY), args.repeat)
+                full = full or bgr
+                print(f"{decoder.name:<12}{'1/' + str(scale):>6}{bgr:>12.2f}{gray:>12.2f}{full / bgr:>9.1f}x")
+            separate, shared = bench_shared(decoder, jpeg, args.repeat)
+            print(f"{decoder.name:<12}  原图+1/4彩色+1/8灰度: 各自解码 {separate:.2f}ms, "
+                  f"共享 DecodedFrame {shared:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备注册表内存和心跳处理开销对比（默认65535台设备）
+旧实现：普通对象 + 两个 datetime，每次心跳分配新的 datetime
+新实现：__slots__ + 单调时钟时间戳，查询状态时才换算本地时间
+
+用法:
+    python scripts/bench_device_registry.py
+    python scripts/bench_device_registry.py --devices 10000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from server import DeviceInfo, clock_reference  # noqa: E402
+
+
+class LegacyDeviceInfo:
+    """旧的设备信息类（用于对比）"""
+    def __init__(self, device_id, device_name, location, address):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.location = location
+        self.address = address
+        self.last_heartbeat = datetime.now()
+        self.connected = True
+        self.image_count = 0
+        self.register_time = datetime.now()
+
+    def update_heartbeat(self):
+        self.last_heartbeat = datetime.now()
+        self.connected = True
+
+    def get_status(self):
+        elapsed = (datetime.now() - self.last_heartbeat).total_seconds()
+        return {
+            'device_id': self.device_id,
+            'device_name': self.device_name,
+            'location': self.location,
+            'address': self.address,
+            'connected': self.connected,
+            'last_heartbeat': self.last_heartbeat.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed_seconds': int(elapsed),
+            'image_count': self.image_count,
+            'register_time': self.register_time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+def build(cls, count, names, address):
+    return {device_id: cls(device_id, names[device_id], "bench", address)
+            for device_id in range(1, count + 1)}
+
+
+def measure_memory(cls, count, names, address):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    registry = build(cls, count, names, address)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / count, registry
+
+
+def measure_heartbeat(registry, rounds):
+    devices = list(registry.values())
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for device in devices:
+            device.update_heartbeat()
+    return (time.perf_counter() - start) / (rounds * len(devices))
+
+
+def measure_status(registry):
+    devices = list(registry.values())
+    # 与 print_device_status 一致：新实现批量查询时共享一次时钟换算
+    reference = clock_reference()
+    start = time.perf_counter()
+    for device in devices:
+        if isinstance(device, DeviceInfo):
+            device.get_status(reference)
+        else:
+            device.get_status()
+    return (time.perf_counter() - start) / len(devices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="设备注册表对比")
+    parser.add_argument('--devices', type=int, default=65535)
+    parser.add_argument('--rounds', type=int, default=5, help="心跳轮数")
+    args = parser.parse_args()
+
+    # 名称和地址在两种实现间共享，只统计设备对象本身的内存
+    names = {device_id: f"dev-{device_id}" for device_id in range(1, args.devices + 1)}
+    address = ('127.0.0.1', 50000)
+
+    print(f"设备数: {args.devices}")
+    print(f"{'实现':<10}{'内存/设备(B)':>14}{'心跳(ns)':>12}{'状态查询(us)':>14}")
+    print("-" * 50)
+    for name, cls in (('旧实现', LegacyDeviceInfo), ('新实现', DeviceInfo)):
+        memory, registry = measure_memory(cls, args.devices, names, address)
+        heartbeat = measure_heartbeat(registry, args.rounds)
+        status = measure_status(registry)
+        print(f"{name:<10}{memory:>14.0f}{heartbeat * 1e9:>12.0f}{status * 1e6:>14.2f}")
+        del registry
+
+
+if __name__ == '__main__':
+    main()
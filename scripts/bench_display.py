@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像显示对接收处理速度的影响
+- 逐帧显示（旧方式）：处理线程对每一帧完整解码并调用显示函数
+- 信箱 + 拼接显示：处理线程只把JPEG放入设备信箱，显示线程按刷新率缩小解码并拼接
+
+显示函数用 sleep 模拟（无需图形界面），--show-ms 模拟显示一次的耗时
+
+用法:
+    python scripts/bench_display.py
+    python scripts/bench_display.py --devices 8 --frames 400 --size 1920x1080 --show-ms 30
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from display import MosaicDisplay  # noqa: E402
+
+
+def make_frame(width, height):
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    return cv2.imencode('.jpg', np.clip(image, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def run_producers(devices, frames, handle):
+    """每个设备一个处理线程，返回每秒处理的帧数"""
+    def producer(device_id):
+        for _ in range(frames):
+            handle(device_id)
+
+    threads = [threading.Thread(target=producer, args=(device_id,)) for device_id in range(devices)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return devices * frames / (time.perf_counter() - start)
+
+
+def bench_inline(jpeg, devices, frames, show_seconds):
+    # HighGUI 不是线程安全的，旧方式实际上需要串行化显示调用
+    lock = threading.Lock()
+
+    def handle(device_id):
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        with lock:
+            time.sleep(show_seconds)
+        return frame
+
+    return run_producers(devices, frames, handle), devices * frames
+
+
+def bench_mosaic(jpeg, devices, frames, show_seconds, fps):
+    display = MosaicDisplay(max_fps=fps, show=lambda mosaic, wait_ms: time.sleep(
+        show_seconds + max(wait_ms, 0) / 1000))
+    display.start()
+    rate = run_producers(devices, frames, lambda device_id: display.post_jpeg(device_id, jpeg, 'bench'))
+    time.sleep(2.0 / fps if fps > 0 else 0.1)
+    display.stop()
+    return rate, display.rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图像显示对接收处理速度的影响")
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=200, help="每个设备的帧数")
+    parser.add_argument('--size', default='1920x1080', help="图像尺寸")
+    parser.add_argument('--show-ms', type=float, default=20, help="模拟一次显示的耗时(毫秒)")
+    parser.add_argument('--fps', type=float, default=10, help="拼接显示的最高刷新率")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    jpeg = make_frame(width, height)
+    show_seconds = args.show_ms / 1000
+    print(f"设备: {args.devices}, 每设备 {args.frames} 帧, 图像: {args.size} ({len(jpeg) / 1024:.0f} KB), "
+          f"模拟显示耗时: {args.show_ms}ms")
+    print(f"{'方式':<16}{'处理帧/秒':>12}{'显示次数':>10}")
+    print("-" * 38)
+    for name, (rate, shown) in (
+        ("逐帧显示", bench_inline(jpeg, args.devices, args.frames, show_seconds)),
+        ("信箱+拼接", bench_mosaic(jpeg, args.devices, args.frames, show_seconds, args.fps)),
+    ):
+        print(f"{name:<16}{rate:>12.1f}{shown:>10}")
+
+
+if __name__ == '__main__':
+    main()
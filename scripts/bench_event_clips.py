@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运动事件视频片段的存储大小和接收开销
+合成若干个运动事件（物体在带噪声的背景上移动），按设备帧率的时间戳送入 EventClipBuilder：
+
+- 视频片段总大小与逐帧保存JPEG的总大小对比
+- 接收线程调用 add() 的耗时（平均/最大），编码在后台进行，不应随编码速度变化
+- 事件索引中的事件数和帧数与发送的一致
+
+用法:
+    python scripts/bench_event_clips.py
+    python scripts/bench_event_clips.py --events 5 --seconds 30 --fps 15 --size 1280x720 --codec MJPG
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from event_clips import CODEC_EXTENSIONS, DEFAULT_CODEC, EventClipBuilder, read_event_index  # noqa: E402
+
+DEVICE_ID = 1
+
+
+def make_event_frames(width, height, count, seed):
+    """一个事件的JPEG帧：物体从左向右移动"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    scene = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    size = height // 3
+    frames = []
+    for index in range(count):
+        frame = scene + rng.normal(0, 4, scene.shape)
+        left = int(index * (width - size) / max(count - 1, 1))
+        cv2.rectangle(frame, (left, height // 3), (left + size, height // 3 + size), (30, 30, 180), -1)
+        frames.append(cv2.imencode('.jpg', np.clip(frame, 0, 255).astype(np.uint8),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="运动事件视频片段的存储大小和接收开销")
+    parser.add_argument('--events', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=10, help="每个事件的时长")
+    parser.add_argument('--fps', type=float, default=15, help="设备发送帧率")
+    parser.add_argument('--size', default='640x480', help="图像尺寸")
+    parser.add_argument('--codec', default=DEFAULT_CODEC, choices=sorted(CODEC_EXTENSIONS))
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    count = int(args.seconds * args.fps)
+    # 所有事件使用同一组帧，只生成一次
+    frames = make_event_frames(width, height, count, 0)
+    jpeg_bytes = sum(len(jpeg) for jpeg in frames) * args.events
+    gap = 2.0
+
+    tmp_dir = tempfile.mkdtemp(prefix='clips_')
+    try:
+        builder = EventClipBuilder(tmp_dir, gap=gap, codec=args.codec, workers=args.workers,
+                                   max_pending_frames=count * args.events)
+        builder.start()
+        # 时间戳从当前时间开始，按设备帧率递增，事件之间间隔 gap 的两倍
+        timestamp = time.time()
+        add_times = []
+        start = time.perf_counter()
+        for _ in range(args.events):
+            for jpeg in frames:
+                started = time.perf_counter()
+                builder.add(DEVICE_ID, jpeg, timestamp)
+                add_times.append(time.perf_counter() - started)
+                timestamp += 1 / args.fps
+            timestamp += gap * 2
+        ingest_seconds = time.perf_counter() - start
+        builder.stop()
+        total_seconds = time.perf_counter() - start
+
+        device_dir = builder.device_dir(DEVICE_ID)
+        index = read_event_index(device_dir)
+        clip_bytes = int(index['bytes'].sum())
+        keyframes = [name for name in os.listdir(device_dir) if name.endswith('.jpg')]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    total_frames = count * args.events
+    print(f"{args.events}个事件 x {args.seconds:.0f}秒 @ {args.fps:.0f}fps, 图像 {args.size}, 编码器 {args.codec}")
+    print(f"逐帧JPEG: {total_frames}个文件, {jpeg_bytes / 1024 / 1024:.1f} MB")
+    print(f"视频片段: {len(index)}个文件, {clip_bytes / 1024 / 1024:.1f} MB "
+          f"({clip_bytes / jpeg_bytes:.1%})")
+    print(f"add() 耗时: 平均 {np.mean(add_times) * 1e6:.0f}µs, 最大 {np.max(add_times) * 1e6:.0f}µs; "
+          f"送入 {total_frames / ingest_seconds:.0f} 帧/秒, 含编码完成共 {total_seconds:.2f}秒")
+
+    checks = [
+        ("事件数与发送的一致", len(index) == args.events),
+        ("索引中的帧数与发送的一致", int(index['frames'].sum()) == total_frames),
+        ("每个事件都有代表帧", len(keyframes) == args.events),
+        ("接收速度快于编码速度（编码在后台进行）", ingest_seconds < total_seconds / 2),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时间范围查询性能测试
+生成一个包含大量帧（默认100万帧）的合成分段存档，
+测量不同结果规模下 count / frames / seek 的耗时，
+验证查询开销与结果大小相关，与存档总量无关
+
+用法:
+    python scripts/bench_frame_query.py
+    python scripts/bench_frame_query.py --frames 200000 --frame-size 64
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from frame_query import FrameQuery  # noqa: E402
+from segment_store import INDEX_DTYPE, SegmentStore  # noqa: E402
+
+FPS = 15
+DEVICE_ID = 1
+
+
+def build_archive(root_dir, frames, frame_size, segment_seconds):
+    """直接批量写入段文件和索引，快速生成大存档"""
+    device_dir = os.path.join(root_dir, f"device_{DEVICE_ID}")
+    os.makedirs(device_dir, exist_ok=True)
+
+    start_us = 1_700_000_000 * 1_000_000
+    interval_us = 1_000_000 // FPS
+    per_segment = segment_seconds * FPS
+    payload = os.urandom(frame_size)
+
+    for first in range(0, frames, per_segment):
+        count = min(per_segment, frames - first)
+        segment_start = start_us + first * interval_us
+        index = np.zeros(count, dtype=INDEX_DTYPE)
+        index['timestamp'] = segment_start + np.arange(count, dtype=np.int64) * interval_us
+        index['offset'] = np.arange(count, dtype=np.uint64) * frame_size
+        index['length'] = frame_size
+        with open(os.path.join(device_dir, f"segment_{segment_start}.dat"), 'wb') as f:
+            f.write(payload * count)
+        index.tofile(os.path.join(device_dir, f"segment_{segment_start}.idx"))
+
+    return start_us / 1_000_000, frames / FPS
+
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分段存储时间范围查询性能测试")
+    parser.add_argument('--frames', type=int, default=1_000_000, help="存档总帧数")
+    parser.add_argument('--frame-size', type=int, default=64, help="合成帧大小(字节)，只影响磁盘占用")
+    parser.add_argument('--segment-seconds', type=int, default=3600, help="每个段文件的时间跨度")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        start = time.perf_counter()
+        archive_start, duration = build_archive(root_dir, args.frames, args.frame_size, args.segment_seconds)
+        print(f"生成存档: {args.frames} 帧, {duration / 3600:.1f} 小时, "
+              f"耗时 {time.perf_counter() - start:.1f}s")
+
+        query = FrameQuery(SegmentStore(root_dir))
+        # 预热：首次访问扫描设备目录并映射索引
+        query.count(DEVICE_ID)
+
+        random.seed(0)
+        print(f"{'窗口':<10}{'结果帧数':>10}{'count(ms)':>12}{'读取(ms)':>12}{'每隔15帧(ms)':>16}{'seek(ms)':>12}")
+        print("-" * 72)
+        for window in (1, 60, 3600, duration):
+            window_start = archive_start + random.uniform(0, max(duration - window, 0))
+            window_end = window_start + window
+
+            count_time, count = timed(lambda: query.count(DEVICE_ID, window_start, window_end), args.repeat)
+            read_time, _ = timed(
+                lambda: sum(1 for _ in query.frames(DEVICE_ID, window_start, window_end)),
+                1 if count > 100_000 else args.repeat
+            )
+            sample_time, _ = timed(
+                lambda: sum(1 for _ in query.frames(DEVICE_ID, window_start, window_end, step=15)),
+                1 if count > 100_000 else args.repeat
+            )
+            seek_time, _ = timed(lambda: query.seek(DEVICE_ID, window_start), args.repeat)
+
+            label = f"{int(window)}s"
+            print(f"{label:<10}{count:>10}{count_time * 1000:>12.3f}{read_time * 1000:>12.3f}"
+                  f"{sample_time * 1000:>16.3f}{seek_time * 1000:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+心跳超时检测扩展性测试（默认5万台设备）
+对比旧的"每 check_interval 秒全量扫描 is_alive()"与截止时间堆：
+- 每轮检测持有锁的时间
+- 心跳更新开销
+- 离线检测相对真实截止时间的延迟
+
+用法:
+    python scripts/bench_heartbeat_monitor.py
+    python scripts/bench_heartbeat_monitor.py --devices 50000 --check-interval 1
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from deadline_index import DeadlineIndex  # noqa: E402
+from server import DeviceInfo  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def make_devices(count):
+    return {device_id: DeviceInfo(device_id, f"dev-{device_id}", "bench", ('127.0.0.1', 0))
+            for device_id in range(1, count + 1)}
+
+
+def bench_full_scan(devices, timeout):
+    """旧实现：持锁遍历所有设备"""
+    lock = threading.Lock()
+    start = time.perf_counter()
+    with lock:
+        offline = [device_id for device_id, device in devices.items()
+                   if not device.is_alive(timeout) and device.connected]
+    return time.perf_counter() - start, len(offline)
+
+
+def bench_index_idle(index):
+    """新实现：没有设备过期时的一次检测"""
+    start = time.perf_counter()
+    expired = index.pop_expired()
+    return time.perf_counter() - start, len(expired)
+
+
+def bench_touch(index, count):
+    start = time.perf_counter()
+    for device_id in range(1, count + 1):
+        index.touch(device_id)
+    return (time.perf_counter() - start) / count
+
+
+def bench_expire_fraction(count, fraction, timeout):
+    """count 台设备中 fraction 比例过期时，一次检测的耗时"""
+    index = DeadlineIndex(timeout)
+    now = time.monotonic()
+    expired_count = int(count * fraction)
+    for device_id in range(1, count + 1):
+        # 前 expired_count 台设备的最后心跳早于超时时间
+        last_seen = now - timeout - 1 if device_id <= expired_count else now
+        index.touch(device_id, last_seen)
+    start = time.perf_counter()
+    expired = index.pop_expired(now)
+    return time.perf_counter() - start, len(expired)
+
+
+def lateness_scan(count, timeout, check_interval, spread):
+    """模拟旧的定时扫描：设备截止时间均匀分布在 spread 秒内"""
+    start = time.monotonic()
+    deadlines = [start + timeout + spread * i / count for i in range(count)]
+    delays = []
+    pending = list(range(count))
+    tick = start
+    while pending:
+        tick += check_interval
+        remaining = []
+        for i in pending:
+            if deadlines[i] <= tick:
+                delays.append(tick - deadlines[i])
+            else:
+                remaining.append(i)
+        pending = remaining
+    return delays
+
+
+def lateness_index(count, timeout, check_interval, spread):
+    """真实运行截止时间堆，测量检测时间与截止时间的差"""
+    index = DeadlineIndex(timeout)
+    start = time.monotonic()
+    deadlines = {}
+    for i in range(count):
+        device_id = i + 1
+        last_seen = start + spread * i / count
+        index.touch(device_id, last_seen)
+        deadlines[device_id] = last_seen + timeout
+
+    delays = []
+    while len(delays) < count:
+        for device_id, _ in index.wait_expired(check_interval):
+            delays.append(time.monotonic() - deadlines[device_id])
+    return delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description="心跳超时检测扩展性测试")
+    parser.add_argument('--devices', type=int, default=50000)
+    parser.add_argument('--timeout', type=float, default=1.0, help="延迟测试使用的心跳超时(秒)")
+    parser.add_argument('--check-interval', type=float, default=1.0, help="旧实现的扫描间隔(秒)")
+    parser.add_argument('--spread', type=float, default=2.0, help="设备截止时间分布的时间跨度(秒)")
+    args = parser.parse_args()
+
+    count = args.devices
+    print(f"设备数: {count}")
+    print("-" * 60)
+
+    devices = make_devices(count)
+    scan_time, _ = bench_full_scan(devices, 90)
+    print(f"旧实现 每轮全量扫描持锁时间:       {scan_time * 1000:10.3f} ms")
+
+    index = DeadlineIndex(90)
+    touch_cost = bench_touch(index, count)
+    idle_time, _ = bench_index_idle(index)
+    print(f"截止时间堆 无过期时一次检测:       {idle_time * 1000:10.3f} ms")
+    print(f"截止时间堆 单次心跳更新:           {touch_cost * 1e6:10.3f} us")
+
+    for fraction in (0.001, 0.01, 0.1):
+        expire_time, expired = bench_expire_fraction(count, fraction, 90)
+        print(f"截止时间堆 {expired:>6}台过期时一次检测: {expire_time * 1000:10.3f} ms")
+
+    print("-" * 60)
+    print(f"离线检测延迟（超时{args.timeout}s，截止时间分布在{args.spread}s内）")
+    scan_delays = lateness_scan(count, args.timeout, args.check_interval, args.spread)
+    index_delays = lateness_index(count, args.timeout, args.check_interval, args.spread)
+    for name, delays in ((f"旧实现(间隔{args.check_interval}s)", scan_delays), ("截止时间堆", index_delays)):
+        print(f"  {name:<18} p50 {percentile(delays, 50) * 1000:8.2f} ms  "
+              f"p99 {percentile(delays, 99) * 1000:8.2f} ms  max {max(delays) * 1000:8.2f} ms")
+
+    if len(index_delays) != count:
+        print("[ERROR] 截止时间堆漏报了离线设备")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
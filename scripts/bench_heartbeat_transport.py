@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+心跳传输方式基准测试（TCP vs UDP）
+本机模拟设备群：所有设备先通过 TCP 注册，然后依次：
+
+- TCP 阶段：每台设备在自己的连接上发送心跳并等待响应（与 v1 设备相同）
+- UDP 阶段：不再发送 TCP 心跳，改为向 udp_heartbeat_port 发送心跳数据报，
+  持续时间超过心跳超时，设备应全部保持在线
+
+负载由多个进程尽快发送，从 /proc 读取服务器进程在每个阶段消耗的 CPU 时间，
+以"每 CPU 秒处理的心跳数"作为单核处理能力（与负载进程的速度无关）。
+最后发送未注册设备的数据报，核对被拒绝；再停止发送心跳直到设备超时离线（TCP 连接保持），
+核对恢复 UDP 心跳后设备重新上线。仅支持 Linux（读取 /proc/<pid>/stat）。
+
+用法:
+    python scripts/bench_heartbeat_transport.py
+    python scripts/bench_heartbeat_transport.py --devices 500 --duration 10 --server-mode asyncio
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import MSG_HEARTBEAT, pack_header, pack_heartbeat_datagram, pack_register  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+FIRST_DEVICE = 1
+HEARTBEAT_TIMEOUT = 3
+UNKNOWN_DEVICE = 65000
+UNKNOWN_DATAGRAMS = 100
+
+
+def find_free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, udp_port, metrics_port, devices, server_mode):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write(f"udp_heartbeat_port = {udp_port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        f.write(f"server_mode = {server_mode}\n")
+        f.write(f"max_clients = {devices + 10}\n")
+        f.write(f"heartbeat_timeout = {HEARTBEAT_TIMEOUT}\n")
+        f.write("check_interval = 1\n")
+        f.write(f"metrics_port = {metrics_port}\n")
+        f.write("log_level = error\n")
+
+
+def read_metrics(metrics_port):
+    """返回 {'名称{标签}': 值}"""
+    text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode('utf-8')
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def total_heartbeats(values):
+    return sum(value for name, value in values.items() if name.startswith('motion_server_device_heartbeats_total{'))
+
+
+def cpu_seconds(pid):
+    """进程（含所有线程）已消耗的用户态 + 内核态 CPU 时间"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(')')[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def generator(port, udp_port, device_ids, commands, results):
+    """负载进程：注册一组设备，按命令执行 TCP / UDP 阶段，返回发送的心跳数"""
+    sockets = []
+    for device_id in device_ids:
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(pack_register(device_id, f"Bench-{device_id}", "bench"))
+        sock.recv(8)
+        sockets.append((device_id, sock))
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    results.put(('ready', len(sockets)))
+
+    seq = 0
+    while True:
+        command, duration = commands.get()
+        if command == 'close':
+            break
+        sent = 0
+        stop_at = time.monotonic() + duration
+        if command == 'idle':
+            time.sleep(duration)
+        elif command == 'tcp':
+            messages = [(sock, pack_header(MSG_HEARTBEAT, device_id)) for device_id, sock in sockets]
+            while time.monotonic() < stop_at:
+                # 每台设备发送一次心跳，再逐个等待响应
+                for sock, message in messages:
+                    sock.sendall(message)
+                for sock, _ in messages:
+                    received = 0
+                    while received < 8:
+                        received += len(sock.recv(8 - received))
+                sent += len(messages)
+        else:
+            address = ('127.0.0.1', udp_port)
+            while time.monotonic() < stop_at:
+                seq += 1
+                for device_id, _ in sockets:
+                    udp.sendto(pack_heartbeat_datagram(device_id, seq), address)
+                sent += len(sockets)
+        results.put((command, sent))
+
+    for _, sock in sockets:
+        sock.close()
+    udp.close()
+
+
+class Fleet:
+    """多个负载进程组成的设备群"""
+
+    def __init__(self, port, udp_port, devices, processes):
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.commands = []
+        self.processes = []
+        device_ids = list(range(FIRST_DEVICE, FIRST_DEVICE + devices))
+        for index in range(processes):
+            commands = context.Queue()
+            process = context.Process(target=generator, args=(port, udp_port, device_ids[index::processes],
+                                                              commands, self.results))
+            process.start()
+            self.commands.append(commands)
+            self.processes.append(process)
+        self.registered = sum(self.results.get(timeout=60)[1] for _ in self.processes)
+
+    def run(self, command, duration):
+        for commands in self.commands:
+            commands.put((command, duration))
+        return sum(self.results.get(timeout=duration + 60)[1] for _ in self.processes)
+
+    def close(self):
+        for commands in self.commands:
+            commands.put(('close', 0))
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+def measure_phase(fleet, command, duration, server_pid, metrics_port):
+    """返回 (发送数, 服务器处理数, 服务器 CPU 秒, 墙钟秒, 阶段结束时的指标)"""
+    before = total_heartbeats(read_metrics(metrics_port))
+    cpu_before = cpu_seconds(server_pid)
+    start = time.perf_counter()
+    sent = fleet.run(command, duration)
+    # 等待服务器处理完已到达的数据报
+    time.sleep(0.3)
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(server_pid) - cpu_before
+    values = read_metrics(metrics_port)
+    return sent, total_heartbeats(values) - before, cpu, elapsed, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="心跳传输方式基准测试（TCP vs UDP）")
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=5.0, help="每个阶段的时长(秒)，应大于心跳超时")
+    parser.add_argument('--processes', type=int, default=2, help="负载进程数")
+    parser.add_argument('--server-mode', default='threaded', choices=('threaded', 'asyncio'))
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/stat'):
+        print("需要 /proc 文件系统（Linux）")
+        return 1
+
+    port, metrics_port = find_free_port(), find_free_port()
+    udp_port = find_free_port(socket.SOCK_DGRAM)
+    results = {}
+    checks = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'bench_server.ini')
+        write_config(config_path, port, udp_port, metrics_port, args.devices, args.server_mode)
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, config_path], cwd=tmp_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        fleet = None
+        try:
+            deadline = time.time() + 15
+            while True:
+                try:
+                    read_metrics(metrics_port)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise RuntimeError("服务器启动失败")
+                    time.sleep(0.2)
+
+            fleet = Fleet(port, udp_port, args.devices, args.processes)
+            for command in ('tcp', 'udp'):
+                results[command] = measure_phase(fleet, command, args.duration, server.pid, metrics_port)
+            udp_values = results['udp'][4]
+
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+                for seq in range(UNKNOWN_DATAGRAMS):
+                    udp.sendto(pack_heartbeat_datagram(UNKNOWN_DEVICE, seq), ('127.0.0.1', udp_port))
+            time.sleep(0.5)
+            final_values = read_metrics(metrics_port)
+
+            # 停止发送心跳直到设备超时离线，TCP 连接保持打开，再恢复 UDP 心跳
+            fleet.run('idle', HEARTBEAT_TIMEOUT + 2)
+            timed_out = read_metrics(metrics_port)
+            fleet.run('udp', 1.0)
+            time.sleep(0.3)
+            recovered = read_metrics(metrics_port)
+        finally:
+            if fleet is not None:
+                fleet.close()
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    print(f"设备: {fleet.registered}台, 每阶段 {args.duration:.0f}秒, 服务器模式: {args.server_mode}")
+    print(f"{'传输':<6} {'发送':>10} {'处理':>10} {'处理/秒':>10} {'服务器CPU':>10} {'每CPU秒处理':>12}")
+    per_cpu = {}
+    for command, (sent, processed, cpu, elapsed, _) in results.items():
+        per_cpu[command] = processed / cpu if cpu > 0 else 0.0
+        print(f"{command.upper():<6} {sent:>10} {processed:>10.0f} {processed / elapsed:>10.0f} "
+              f"{cpu:>9.2f}s {per_cpu[command]:>12.0f}")
+    accepted = udp_values.get('motion_server_udp_heartbeat_datagrams_total{result="accepted"}', 0)
+    lost = udp_values.get('motion_server_udp_heartbeats_lost_total', 0)
+    batches = udp_values.get('motion_server_udp_heartbeat_batches_total', 0)
+    print(f"UDP: 平均每批 {accepted / batches if batches else 0:.1f} 个数据报, 按序号统计丢失 {lost:.0f} 个 "
+          f"(发送速度超过处理能力时由内核丢弃)")
+    print(f"单核处理能力: UDP 为 TCP 的 {per_cpu['udp'] / per_cpu['tcp'] if per_cpu['tcp'] else 0:.1f} 倍")
+
+    rejected = (final_values.get('motion_server_udp_heartbeat_datagrams_total{result="rejected"}', 0)
+                - udp_values.get('motion_server_udp_heartbeat_datagrams_total{result="rejected"}', 0))
+    checks += [
+        ("所有设备注册成功", fleet.registered == args.devices),
+        ("UDP 心跳每 CPU 秒处理量高于 TCP", per_cpu['udp'] > per_cpu['tcp']),
+        ("UDP 心跳全部计入设备心跳计数", results['udp'][1] == accepted),
+        (f"只发送 UDP 心跳 {args.duration:.0f}秒（超过心跳超时 {HEARTBEAT_TIMEOUT}秒）后设备全部在线",
+         udp_values.get('motion_server_devices{state="offline"}', 0) == 0
+         and udp_values.get('motion_server_devices{state="online"}', 0) == args.devices),
+        ("未注册设备的 UDP 心跳被拒绝", rejected == UNKNOWN_DATAGRAMS),
+        ("停止心跳超过超时时间后设备离线",
+         timed_out.get('motion_server_devices{state="offline"}', 0) == args.devices),
+        ("TCP 连接未断开时恢复 UDP 心跳后设备重新上线",
+         recovered.get('motion_server_devices{state="online"}', 0) == args.devices),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
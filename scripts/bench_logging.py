@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志开销对比
+多个线程模拟处理线程，每帧输出"成功接收图像"和"图像已保存"两条日志：
+- print：旧实现，调用线程同步写入输出流
+- 逐帧：EventLog 逐帧输出（log_summary_interval = 0），I/O 在后台线程
+- 汇总：EventLog 默认的逐帧汇总
+
+输出写入临时文件，统计调用线程每帧花在日志上的时间。
+--write-delay-us 给每次 write 调用加上固定延迟，模拟较慢的终端或 journal
+
+用法:
+    python scripts/bench_logging.py
+    python scripts/bench_logging.py --threads 16 --frames 20000 --write-delay-us 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from event_log import EventLog  # noqa: E402
+
+SHAPE = (480, 640, 3)
+DATA_LENGTH = 38912
+
+
+class SlowStream:
+    """每次写入前等待固定时间的输出流"""
+
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def print_frame(stream, device_id, filename):
+    print(f"[设备{device_id}] 成功接收图像: {SHAPE}, 大小: {DATA_LENGTH} 字节", file=stream, flush=True)
+    print(f"[设备{device_id}] 图像已保存: {filename}", file=stream, flush=True)
+
+
+def run_threads(threads, frames, log_frame):
+    """每个线程代表一个设备，返回调用线程每帧日志耗时(秒)"""
+    durations = [0.0] * threads
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        device_id = index + 1
+        filename = f"received_images/device_{device_id}/motion_20240101_000000_000000.jpg"
+        barrier.wait()
+        start = time.perf_counter()
+        for _ in range(frames):
+            log_frame(device_id, filename)
+        durations[index] = time.perf_counter() - start
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(durations) / (threads * frames)
+
+
+def bench(name, threads, frames, tmp_dir, delay):
+    path = os.path.join(tmp_dir, f"{name}.log")
+    with open(path, 'w', encoding='utf-8') as output:
+        stream = SlowStream(output, delay)
+        if name == 'print':
+            per_frame = run_threads(threads, frames, lambda device_id, filename:
+                                    print_frame(stream, device_id, filename))
+            drain = 0.0
+        else:
+            log = EventLog(stream=stream, queue_size=100000, device_rate=0,
+                           summary_interval=0 if name == '逐帧' else 10)
+            log.start()
+            per_frame = run_threads(threads, frames, lambda device_id, filename:
+                                    log.frame(device_id, SHAPE, DATA_LENGTH, filename))
+            start = time.perf_counter()
+            log.stop()
+            drain = time.perf_counter() - start
+            if log.dropped:
+                print(f"  ({name} 丢弃 {log.dropped} 条)")
+    size = os.path.getsize(path)
+    return per_frame, drain, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日志开销对比")
+    parser.add_argument('--threads', type=int, default=8, help="并发线程数")
+    parser.add_argument('--frames', type=int, default=10000, help="每个线程的帧数")
+    parser.add_argument('--write-delay-us', type=float, default=0, help="每次写入的模拟延迟(微秒)")
+    args = parser.parse_args()
+
+    print(f"线程数: {args.threads}, 每线程帧数: {args.frames}, 写入延迟: {args.write_delay_us}us")
+    print(f"{'实现':<8}{'每帧耗时(us)':>14}{'停止时写出(ms)':>16}{'输出大小(KB)':>14}")
+    print("-" * 54)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in ('print', '逐帧', '汇总'):
+            per_frame, drain, size = bench(name, args.threads, args.frames, tmp_dir,
+                                           args.write_delay_us / 1e6)
+            print(f"{name:<8}{per_frame * 1e6:>14.2f}{drain * 1000:>16.1f}{size / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
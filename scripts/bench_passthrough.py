@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像保存方式性能对比
+reencode：cv2.imdecode + cv2.imwrite（旧的保存路径）
+passthrough：SOI/EOI 校验 + 直接写入接收到的字节
+统计每帧消耗的CPU时间
+
+用法:
+    python scripts/bench_passthrough.py
+    python scripts/bench_passthrough.py --frames 100
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from jpeg_utils import is_valid_jpeg, read_jpeg_shape  # noqa: E402
+
+
+def make_jpeg(width, height, quality=80):
+    """生成带渐变和噪声的测试图像，压缩后大小接近真实摄像头画面"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    noise = np.random.default_rng(0).normal(0, 12, (height, width, 3))
+    image = np.clip(base[..., None] + noise, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def save_reencode(data, filename):
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    cv2.imwrite(filename, frame)
+
+
+def save_passthrough(data, filename):
+    if not is_valid_jpeg(data):
+        raise ValueError("invalid jpeg")
+    read_jpeg_shape(data)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+
+def measure(save, data, frames, out_dir):
+    start_cpu = time.process_time()
+    start_wall = time.perf_counter()
+    for index in range(frames):
+        save(data, os.path.join(out_dir, f"frame_{index % 16}.jpg"))
+    cpu = (time.process_time() - start_cpu) / frames
+    wall = (time.perf_counter() - start_wall) / frames
+    return cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="reencode vs passthrough 保存方式对比")
+    parser.add_argument('--frames', type=int, default=200, help="每种组合保存的帧数")
+    args = parser.parse_args()
+
+    # 单线程测量CPU时间，避免OpenCV内部线程把多核时间计入
+    cv2.setNumThreads(1)
+
+    print(f"{'分辨率':<12}{'JPEG(KB)':>10}{'方式':>14}{'CPU/帧(ms)':>14}{'耗时/帧(ms)':>14}")
+    print("-" * 64)
+    with tempfile.TemporaryDirectory() as out_dir:
+        for width, height in ((640, 480), (1920, 1080)):
+            data = make_jpeg(width, height)
+            results = {}
+            for name, save in (('reencode', save_reencode), ('passthrough', save_passthrough)):
+                cpu, wall = measure(save, data, args.frames, out_dir)
+                results[name] = cpu
+                print(f"{width}x{height:<7}{len(data) / 1024:>10.1f}{name:>14}"
+                      f"{cpu * 1000:>14.3f}{wall * 1000:>14.3f}")
+            saving = 1 - results['passthrough'] / results['reencode']
+            print(f"{'':<12}{'':>10}{'CPU节省':>14}{saving * 100:>13.1f}%")
+
+
+if __name__ == '__main__':
+    main()
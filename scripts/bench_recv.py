@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像接收路径微基准测试
+在 socket.socketpair() 上对比三种接收方式的吞吐量和内存分配情况：
+- "data += packet" 拼接接收（最初的实现）
+- recv_into + 可复用缓冲区，每条消息先收消息头再收数据
+- MessageParser：每次读取尽量多的数据，大消息直接接收到独立缓冲区（服务器当前实现）
+
+用法:
+    python scripts/bench_recv.py
+    python scripts/bench_recv.py --frame-size 300000 --frames 2000
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import HEADER_SIZE, MessageParser  # noqa: E402
+
+
+class ReceiveBuffer:
+    """连接级可复用接收缓冲区，按需扩容且不缩小"""
+
+    def __init__(self, initial_size=64 * 1024):
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+
+    def reserve(self, size):
+        if size > len(self.buffer):
+            self.buffer = bytearray(max(size, len(self.buffer) * 2))
+            self.view = memoryview(self.buffer)
+        return self.view[:size]
+
+
+def recv_into_exact(sock, view):
+    """将数据接收到 view 中直到填满，连接关闭时返回 False"""
+    received = 0
+    size = len(view)
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            return False
+        received += count
+    return True
+
+
+def recv_all_concat(sock, size):
+    """旧实现：逐块 recv 并拼接 bytes"""
+    data = b''
+    while len(data) < size:
+        packet = sock.recv(size - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+
+def sender(sock, frame, count):
+    message = struct.pack('!BBHI', 0x03, 0, 1, len(frame)) + frame
+    for _ in range(count):
+        sock.sendall(message)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def receive_concat(sock, count, stats):
+    for _ in range(count):
+        header = recv_all_concat(sock, HEADER_SIZE)
+        _, _, _, length = struct.unpack('!BBHI', header)
+        payload = recv_all_concat(sock, length)
+        stats['bytes'] += len(payload)
+
+
+def receive_into(sock, count, stats):
+    header_buffer = ReceiveBuffer(HEADER_SIZE)
+    recv_buffer = ReceiveBuffer()
+    for _ in range(count):
+        header = header_buffer.reserve(HEADER_SIZE)
+        recv_into_exact(sock, header)
+        _, _, _, length = struct.unpack_from('!BBHI', header)
+        payload = recv_buffer.reserve(length)
+        recv_into_exact(sock, payload)
+        stats['bytes'] += len(payload)
+
+
+def receive_parser(sock, count, stats):
+    # 与流水线的缓冲池一样，处理完的缓冲区被复用
+    buffers = []
+
+    def allocate(size):
+        return buffers.pop() if buffers and len(buffers[-1]) >= size else bytearray(size)
+
+    parser = MessageParser(max_payload=64 * 1024 * 1024, allocate=allocate)
+    received = 0
+    while received < count:
+        read = sock.recv_into(parser.get_buffer())
+        if not read:
+            break
+        for message in parser.buffer_updated(read):
+            stats['bytes'] += message.length
+            buffers.append(message.buffer)
+            received += 1
+
+
+def run(receiver, frame, count, trace):
+    left, right = socket.socketpair()
+    stats = {'bytes': 0}
+    thread = threading.Thread(target=sender, args=(right, frame, count), daemon=True)
+
+    if trace:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    thread.start()
+    start = time.perf_counter()
+    receiver(left, count, stats)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    thread.join()
+    left.close()
+    right.close()
+    return stats['bytes'] / elapsed, peak
+
+
+class CountingSocket:
+    """包装 socket，统计 recv/recv_into 调用次数"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def recv(self, size):
+        self.calls += 1
+        return self.sock.recv(size)
+
+    def recv_into(self, view, size=0):
+        self.calls += 1
+        return self.sock.recv_into(view, size)
+
+
+def count_recv_calls(receiver, frame, count):
+    left, right = socket.socketpair()
+    counting = CountingSocket(left)
+    thread = threading.Thread(target=sender, args=(right, frame, count), daemon=True)
+    thread.start()
+    receiver(counting, count, {'bytes': 0})
+    thread.join()
+    left.close()
+    right.close()
+    return counting.calls / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recv 拼接 vs recv_into 接收路径对比")
+    parser.add_argument('--frame-size', type=int, default=200 * 1024, help="单帧JPEG大小(字节)")
+    parser.add_argument('--frames', type=int, default=1000, help="发送帧数")
+    args = parser.parse_args()
+
+    frame = os.urandom(args.frame_size)
+    print(f"帧大小: {args.frame_size} 字节, 帧数: {args.frames}")
+    print(f"{'实现':<14}{'吞吐(MB/s)':>12}{'recv次数/帧':>14}{'分配次数/帧':>14}{'峰值内存(KB)':>14}")
+    print("-" * 70)
+
+    # 旧实现每次 recv 分配一个 bytes 块，拼接时再分配一次完整副本；
+    # recv_into 写入已有缓冲区，容量足够后每帧不再分配数据块
+    allocations_per_call = {'data += packet': 2, 'recv_into': 0, 'MessageParser': 0}
+    sample = max(args.frames // 10, 1)
+
+    for name, receiver in (('data += packet', receive_concat), ('recv_into', receive_into),
+                           ('MessageParser', receive_parser)):
+        throughput, _ = run(receiver, frame, args.frames, trace=False)
+        _, peak = run(receiver, frame, sample, trace=True)
+        calls = count_recv_calls(receiver, frame, sample)
+        allocations = calls * allocations_per_call[name]
+        print(f"{name:<14}{throughput / 1024 / 1024:>12.1f}{calls:>14.1f}"
+              f"{allocations:>14.1f}{peak / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器运行模式性能对比
+分别以 threaded 和 asyncio 模式启动服务器，模拟大量设备连接，
+统计每秒建立连接(含注册)的数量以及心跳往返时延(RTT)
+
+用法:
+    python scripts/bench_server_modes.py
+    python scripts/bench_server_modes.py --devices 100 1000 --modes asyncio
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+MSG_HEARTBEAT = 0x01
+MSG_HEARTBEAT_ACK = 0x02
+MSG_REGISTER = 0x04
+MSG_REGISTER_ACK = 0x05
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, mode):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        # 压测时需要足够大的监听队列，否则大量SYN会被丢弃重传
+        f.write("max_clients = 4096\n")
+        f.write("heartbeat_timeout = 600\n")
+        f.write("check_interval = 60\n")
+        f.write("metrics_port = 0\n")
+        f.write(f"server_mode = {mode}\n")
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+async def read_ack(reader, expected_type):
+    ack = await reader.readexactly(8)
+    msg_type, _, _, _ = struct.unpack('!BBHI', ack)
+    return msg_type == expected_type
+
+
+async def open_device(port, device_id, semaphore):
+    """连接并注册一个模拟设备，返回(reader, writer)"""
+    async with semaphore:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        name = f"Bench-{device_id}".encode('utf-8')[:32].ljust(32, b'\x00')
+        location = b"bench".ljust(64, b'\x00')
+        payload = name + location
+        writer.write(struct.pack('!BBHI', MSG_REGISTER, 0, device_id, len(payload)) + payload)
+        await writer.drain()
+        if not await read_ack(reader, MSG_REGISTER_ACK):
+            raise RuntimeError(f"设备{device_id}注册响应无效")
+        return reader, writer
+
+
+async def heartbeat_rtt(reader, writer, device_id, semaphore):
+    async with semaphore:
+        start = time.perf_counter()
+        writer.write(struct.pack('!BBHI', MSG_HEARTBEAT, 0, device_id, 0))
+        await writer.drain()
+        if not await read_ack(reader, MSG_HEARTBEAT_ACK):
+            raise RuntimeError(f"设备{device_id}心跳响应无效")
+        return time.perf_counter() - start
+
+
+async def run_fleet(port, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    start = time.perf_counter()
+    connections = await asyncio.gather(
+        *[open_device(port, device_id, semaphore) for device_id in range(1, count + 1)]
+    )
+    connect_elapsed = time.perf_counter() - start
+
+    rtts = await asyncio.gather(
+        *[heartbeat_rtt(reader, writer, device_id, semaphore)
+          for device_id, (reader, writer) in enumerate(connections, start=1)]
+    )
+
+    for _, writer in connections:
+        writer.close()
+    await asyncio.gather(*[writer.wait_closed() for _, writer in connections],
+                         return_exceptions=True)
+
+    return count / connect_elapsed, rtts
+
+
+def bench_mode(mode, count, concurrency):
+    port = find_free_port()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'bench_server.ini')
+        write_config(config_path, port, mode)
+        server_process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, config_path],
+            cwd=tmp_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            if not wait_for_port(port):
+                raise RuntimeError(f"{mode} 模式服务器启动失败")
+            return asyncio.run(run_fleet(port, count, concurrency))
+        finally:
+            server_process.terminate()
+            try:
+                server_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server_process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="threaded / asyncio 服务器模式对比")
+    parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 5000],
+                        help="模拟设备数量")
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asyncio'],
+                        help="要测试的服务器模式")
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help="客户端同时进行中的连接/心跳数量")
+    args = parser.parse_args()
+
+    print(f"{'模式':<10}{'设备数':>8}{'连接/秒':>12}{'RTT p50(ms)':>14}{'RTT p99(ms)':>14}")
+    print("-" * 58)
+    for count in args.devices:
+        for mode in args.modes:
+            try:
+                rate, rtts = bench_mode(mode, count, args.concurrency)
+            except Exception as e:
+                print(f"{mode:<10}{count:>8}  失败: {e}")
+                continue
+            print(f"{mode:<10}{count:>8}{rate:>12.0f}"
+                  f"{percentile(rtts, 50) * 1000:>14.2f}{percentile(rtts, 99) * 1000:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动时间基准测试（冷启动 / 热重启 / 崩溃后重启）
+生成不同大小的合成存档，启动服务器（开启保留策略但不删除任何数据），测量：
+
+- 从启动进程到设备注册得到响应的时间
+- 从启动进程到存储占用统计加载完成（/metrics 中 retention_index_ready = 1）的时间
+
+依次测试三种情况：
+- 冷启动：没有状态快照，逐个扫描存档文件
+- 热重启：上次正常退出（SIGINT），直接从快照加载
+- 崩溃后重启：上次被 SIGKILL 终止，且之后又写入了快照中没有的文件，从快照加载后核对目录
+
+并核对三次启动统计的存储占用与磁盘上的实际大小一致、注册过的设备从快照恢复
+
+用法:
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --sizes 10000 100000 --devices 50 --server-mode asyncio
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import pack_register  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+ARCHIVE_DAYS = 30
+REGISTER_DEVICE = 1
+
+# 崩溃后重启前额外写入的文件数（快照中没有）
+EXTRA_FILES = 100
+
+# 快照间隔（秒），崩溃前等待至少一次快照写入
+SNAPSHOT_INTERVAL = 1
+
+TIMEOUT = 300
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def build_archive(save_dir, frames, devices):
+    """生成 frames 个小JPEG文件，修改时间均匀分布在最近 ARCHIVE_DAYS 天内，返回总字节数"""
+    now = time.time()
+    step = ARCHIVE_DAYS * 86400 / frames
+    payload = os.urandom(1200)
+    total = 0
+    for device_id in range(1, devices + 1):
+        os.makedirs(os.path.join(save_dir, f"device_{device_id}"), exist_ok=True)
+    for index in range(frames):
+        device_id = index % devices + 1
+        timestamp = now - ARCHIVE_DAYS * 86400 + index * step
+        size = 200 + index % 1000
+        path = os.path.join(save_dir, f"device_{device_id}", f"motion_{index:08d}.jpg")
+        with open(path, 'wb') as f:
+            f.write(payload[:size])
+        os.utime(path, (timestamp, timestamp))
+        total += size
+    return total
+
+
+def add_files(save_dir, devices, count):
+    """模拟快照之后写入的文件，返回总字节数"""
+    total = 0
+    for index in range(count):
+        path = os.path.join(save_dir, f"device_{index % devices + 1}", f"motion_extra_{index:08d}.jpg")
+        with open(path, 'wb') as f:
+            f.write(b'\xff\xd8' + b'\0' * 300 + b'\xff\xd9')
+        total += 304
+    return total
+
+
+def write_config(path, save_dir, state_file, port, metrics_port, server_mode):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write(f"save_dir = {save_dir}\n")
+        f.write("display_images = false\n")
+        f.write(f"server_mode = {server_mode}\n")
+        # 开启保留策略（需要占用统计），但存档都在保存期限内，不删除
+        f.write("retention_max_days = 3650\n")
+        f.write(f"state_file = {state_file}\n")
+        f.write(f"state_snapshot_interval = {SNAPSHOT_INTERVAL}\n")
+        f.write(f"metrics_port = {metrics_port}\n")
+        f.write("log_level = error\n")
+
+
+def read_metrics(metrics_port):
+    """返回 {'名称{标签}': 值}"""
+    text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode('utf-8')
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def register(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(pack_register(REGISTER_DEVICE, "Startup", "bench"))
+        return len(sock.recv(8)) == 8
+
+
+class Run:
+    """一次服务器启动的测量结果"""
+
+    def __init__(self, config_path, port, metrics_port, cwd):
+        self.port = port
+        self.metrics_port = metrics_port
+        self.started = time.perf_counter()
+        self.process = subprocess.Popen([sys.executable, SERVER_SCRIPT, config_path], cwd=cwd,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.register_seconds = None
+        self.ready_seconds = None
+        self.restored_devices = None
+        self.storage_bytes = None
+
+    def measure(self):
+        deadline = self.started + TIMEOUT
+        # 注册之前读取一次指标：从快照恢复的设备为离线状态
+        while self.restored_devices is None:
+            try:
+                self.restored_devices = read_metrics(self.metrics_port).get(
+                    'motion_server_devices{state="offline"}', 0)
+            except OSError:
+                self.check(deadline)
+                time.sleep(0.01)
+        while self.register_seconds is None:
+            try:
+                if register(self.port):
+                    self.register_seconds = time.perf_counter() - self.started
+            except OSError:
+                self.check(deadline)
+                time.sleep(0.01)
+        while True:
+            values = read_metrics(self.metrics_port)
+            if values.get('motion_server_retention_index_ready', 0) == 1:
+                break
+            self.check(deadline)
+            time.sleep(0.01)
+        self.ready_seconds = time.perf_counter() - self.started
+        self.storage_bytes = sum(value for name, value in values.items()
+                                 if name.startswith('motion_server_storage_bytes{'))
+
+    def check(self, deadline):
+        if self.process.poll() is not None:
+            raise RuntimeError("服务器已退出")
+        if time.perf_counter() > deadline:
+            raise RuntimeError("等待超时")
+
+    def stop(self, sig):
+        self.process.send_signal(sig)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def bench(frames, devices, server_mode):
+    """返回 ({情况: Run}, 存档字节数, 额外写入的字节数)"""
+    tmp_dir = tempfile.mkdtemp(prefix='startup_')
+    try:
+        save_dir = os.path.join(tmp_dir, 'archive')
+        archive_bytes = build_archive(save_dir, frames, devices)
+        config_path = os.path.join(tmp_dir, 'startup_server.ini')
+        port, metrics_port = find_free_port(), find_free_port()
+        write_config(config_path, save_dir, os.path.join(tmp_dir, 'state.db'), port, metrics_port, server_mode)
+        runs = {}
+
+        runs['cold'] = run = Run(config_path, port, metrics_port, tmp_dir)
+        run.measure()
+        time.sleep(SNAPSHOT_INTERVAL * 2)
+        run.stop(signal.SIGINT)
+
+        runs['warm'] = run = Run(config_path, port, metrics_port, tmp_dir)
+        run.measure()
+        time.sleep(SNAPSHOT_INTERVAL * 2)
+        run.stop(signal.SIGKILL)
+
+        extra_bytes = add_files(save_dir, devices, EXTRA_FILES)
+        runs['crash'] = run = Run(config_path, port, metrics_port, tmp_dir)
+        run.measure()
+        run.stop(signal.SIGINT)
+        return runs, archive_bytes, extra_bytes
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动时间基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000], help="存档文件数")
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--server-mode', default='threaded', choices=('threaded', 'asyncio'))
+    args = parser.parse_args()
+
+    checks = []
+    print(f"{'文件数':>8} {'情况':<6} {'注册响应':>10} {'统计就绪':>10} {'占用(MB)':>10}")
+    for frames in args.sizes:
+        runs, archive_bytes, extra_bytes = bench(frames, args.devices, args.server_mode)
+        for case, run in runs.items():
+            print(f"{frames:>8} {case:<6} {run.register_seconds * 1000:>8.0f}ms {run.ready_seconds * 1000:>8.0f}ms "
+                  f"{run.storage_bytes / 1024 / 1024:>10.2f}")
+        checks += [
+            (f"{frames}个文件: 冷启动统计的占用与存档大小一致", runs['cold'].storage_bytes == archive_bytes),
+            (f"{frames}个文件: 热重启统计的占用与冷启动一致", runs['warm'].storage_bytes == archive_bytes),
+            (f"{frames}个文件: 崩溃后重启补上快照之后写入的文件",
+             runs['crash'].storage_bytes == archive_bytes + extra_bytes),
+            (f"{frames}个文件: 重启后从快照恢复注册过的设备",
+             runs['cold'].restored_devices == 0 and runs['warm'].restored_devices == 1
+             and runs['crash'].restored_devices == 1),
+        ]
+        if frames == max(args.sizes):
+            # 存档较小时进程启动时间占主要部分，只比较最大的存档
+            checks.append((f"{frames}个文件: 热重启统计就绪快于冷启动",
+                           runs['warm'].ready_seconds < runs['cold'].ready_seconds))
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程工作模式扩展性测试
+以 server_workers = 1/2/4/8 启动服务器（reencode 模式，每帧都要解码），
+本地负载生成器以多个设备连接持续发送图像，
+从各工作进程的 /metrics 读取解码帧数，计算每秒处理帧数
+
+负载生成器和服务器运行在同一台机器上，会占用一部分CPU，
+扩展性上限受机器核数限制
+
+用法:
+    python scripts/bench_workers.py
+    python scripts/bench_workers.py --workers 1 2 4 --devices 32 --duration 10 --size 1920x1080
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+MSG_IMAGE_DATA = 0x03
+MSG_REGISTER = 0x04
+MSG_REGISTER_ACK = 0x05
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+DECODE_COUNT = re.compile(r'^motion_server_stage_seconds_count\{stage="decode"\} (\d+)', re.M)
+
+
+def find_free_port(count=1):
+    """返回一个端口 p，保证 p 到 p + count - 1 当前都未被占用"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        if port + count > 65535:
+            continue
+        try:
+            for offset in range(1, count):
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.bind(('127.0.0.1', port + offset))
+            return port
+        except OSError:
+            continue
+
+
+def write_config(path, port, metrics_port, workers):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        f.write("save_mode = reencode\n")
+        # 在连接线程中直接解码，处理不过来时通过TCP反压限制发送速度
+        f.write("pipeline_workers = 0\n")
+        f.write("max_clients = 1024\n")
+        f.write("heartbeat_timeout = 600\n")
+        f.write(f"metrics_port = {metrics_port}\n")
+        f.write(f"server_workers = {workers}\n")
+
+
+def make_frame(width, height):
+    """生成接近真实画面压缩率的JPEG（渐变背景 + 少量噪声）"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    image += np.random.default_rng(0).normal(0, 8, image.shape)
+    ok, encoded = cv2.imencode('.jpg', np.clip(image, 0, 255).astype(np.uint8),
+                               [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return encoded.tobytes()
+
+
+def decoded_frames(metrics_port, workers):
+    total = 0
+    for index in range(workers):
+        url = f"http://127.0.0.1:{metrics_port + index}/metrics"
+        text = urllib.request.urlopen(url, timeout=5).read().decode('utf-8')
+        match = DECODE_COUNT.search(text)
+        total += int(match.group(1)) if match else 0
+    return total
+
+
+def wait_for_metrics(metrics_port, workers, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            decoded_frames(metrics_port, workers)
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+async def device_loop(port, device_id, frame, stop_time):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = f"Bench-{device_id}".encode('utf-8').ljust(32, b'\x00') + b"bench".ljust(64, b'\x00')
+    writer.write(struct.pack('!BBHI', MSG_REGISTER, 0, device_id, len(payload)) + payload)
+    await writer.drain()
+    await reader.readexactly(8)
+
+    message = struct.pack('!BBHI', MSG_IMAGE_DATA, 0, device_id, len(frame)) + frame
+    while time.monotonic() < stop_time:
+        writer.write(message)
+        await writer.drain()
+    writer.close()
+
+
+async def run_load(port, devices, frame, duration):
+    stop_time = time.monotonic() + duration
+    await asyncio.gather(*[device_loop(port, device_id, frame, stop_time)
+                           for device_id in range(1, devices + 1)])
+
+
+def bench_workers(workers, devices, frame, duration, warmup):
+    port = find_free_port()
+    metrics_port = find_free_port(workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'bench_server.ini')
+        write_config(config_path, port, metrics_port, workers)
+        server_process = subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT, config_path],
+            cwd=tmp_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            if not wait_for_metrics(metrics_port, workers):
+                raise RuntimeError("服务器启动失败")
+            asyncio.run(run_load(port, devices, frame, warmup))
+            before = decoded_frames(metrics_port, workers)
+            start = time.perf_counter()
+            asyncio.run(run_load(port, devices, frame, duration))
+            elapsed = time.perf_counter() - start
+            return (decoded_frames(metrics_port, workers) - before) / elapsed
+        finally:
+            server_process.terminate()
+            try:
+                server_process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server_process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程工作模式扩展性测试")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--devices', type=int, default=16, help="模拟设备数量")
+    parser.add_argument('--duration', type=float, default=5.0, help="每轮测量时间(秒)")
+    parser.add_argument('--warmup', type=float, default=1.0, help="测量前的预热时间(秒)")
+    parser.add_argument('--size', default='1280x720', help="图像尺寸，如 640x480")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    frame = make_frame(width, height)
+    print(f"CPU核数: {os.cpu_count()}, 设备数: {args.devices}, 图像: {args.size} ({len(frame) / 1024:.0f} KB)")
+    print(f"{'工作进程':<10}{'帧/秒':>10}{'加速比':>10}")
+    print("-" * 30)
+    baseline = None
+    for workers in args.workers:
+        try:
+            rate = bench_workers(workers, args.devices, frame, args.duration, args.warmup)
+        except Exception as e:
+            print(f"{workers:<10}  失败: {e}")
+            continue
+        baseline = baseline or rate
+        print(f"{workers:<10}{rate:>10.1f}{rate / baseline:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+将旧的"每帧一个JPEG文件"目录结构转换为分段存储
+
+旧结构:  <save_dir>/device_<id>/motion_<YYYYmmdd_HHMMSS_ffffff>.jpg
+新结构:  <save_dir>/device_<id>/segment_<起始时间>.dat / .idx
+
+用法:
+    python scripts/convert_to_segments.py received_images
+    python scripts/convert_to_segments.py received_images --output segments --delete
+"""
+
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from segment_store import DEVICE_DIR_PATTERN, SegmentStore  # noqa: E402
+
+IMAGE_PATTERN = re.compile(r'^motion_(\d{8}_\d{6}_\d{6})\.jpg$')
+
+
+def parse_timestamp(filename):
+    """从文件名解析保存时间（服务器本地时间），无法识别时返回 None"""
+    match = IMAGE_PATTERN.match(filename)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S_%f").timestamp()
+
+
+def convert_device(store, device_id, device_dir, delete):
+    frames = []
+    for name in os.listdir(device_dir):
+        timestamp = parse_timestamp(name)
+        if timestamp is not None:
+            frames.append((timestamp, name))
+    frames.sort()
+
+    total_bytes = 0
+    for timestamp, name in frames:
+        path = os.path.join(device_dir, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        store.append(device_id, data, timestamp)
+        total_bytes += len(data)
+
+    # 全部写入后再删除源文件，转换中断时不会丢失数据
+    if delete:
+        store.close()
+        for _, name in frames:
+            os.remove(os.path.join(device_dir, name))
+
+    return len(frames), total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换图像目录为分段存储")
+    parser.add_argument('source', help="旧的图像保存目录 (save_dir)")
+    parser.add_argument('--output', help="分段存储目录，默认与源目录相同")
+    parser.add_argument('--segment-mb', type=int, default=256, help="单个段文件大小上限(MB)")
+    parser.add_argument('--segment-seconds', type=int, default=3600, help="单个段文件时间跨度上限(秒)")
+    parser.add_argument('--delete', action='store_true', help="转换成功后删除原JPEG文件")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"[ERROR] 目录不存在: {args.source}")
+        return 1
+
+    store = SegmentStore(
+        args.output or args.source,
+        max_segment_bytes=args.segment_mb * 1024 * 1024,
+        max_segment_seconds=args.segment_seconds
+    )
+
+    try:
+        for name in sorted(os.listdir(args.source)):
+            match = DEVICE_DIR_PATTERN.match(name)
+            device_dir = os.path.join(args.source, name)
+            if not match or not os.path.isdir(device_dir):
+                continue
+            device_id = int(match.group(1))
+            count, total_bytes = convert_device(store, device_id, device_dir, args.delete)
+            print(f"[OK] 设备{device_id}: 转换 {count} 帧, {total_bytes / 1024 / 1024:.1f} MB")
+    finally:
+        store.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,21 +3,40 @@
 """
 模拟客户端 - 用于测试心跳机制
 无需编译C++代码，直接使用Python模拟设备
+
+单设备模式（默认）:
+    python scripts/mock_client.py
+
+设备群压测模式（单进程 asyncio 模拟N台设备，发送心跳和运动图像）:
+    python scripts/mock_client.py --devices 500 --duration 60
+    python scripts/mock_client.py --devices 100 --image-sizes 50000 200000 --burst-fps 15
+
+协议 v2（帧序号、采集时间戳、累计确认，心跳不等待响应）:
+    python scripts/mock_client.py --devices 100 --image-sizes 50000 --protocol 2 --drop-rate 0.05
+
+UDP 心跳（服务器设置了 udp_heartbeat_port，TCP 连接只传输图像）:
+    python scripts/mock_client.py --devices 500 --udp-heartbeat-port 8890
 """
 
+import argparse
+import asyncio
+import os
+import random
 import socket
 import struct
 import time
 import sys
 import signal
 import threading
+from collections import deque
 
-# 消息类型定义
-MSG_HEARTBEAT = 0x01
-MSG_HEARTBEAT_ACK = 0x02
-MSG_IMAGE_DATA = 0x03
-MSG_REGISTER = 0x04
-MSG_REGISTER_ACK = 0x05
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import (  # noqa: E402
+    CLIENT_MESSAGE_TYPES, MessageParser, ProtocolError, pack_extended_header, pack_header,
+    pack_heartbeat_datagram, pack_register, parse_ack,
+    MSG_HEARTBEAT, MSG_HEARTBEAT_ACK, MSG_IMAGE_DATA, MSG_REGISTER_ACK, PROTOCOL_V1, PROTOCOL_V2
+)
 
 class MockClient:
     def __init__(self, device_id, device_name, location, server_ip='127.0.0.1', server_port=8888):
@@ -27,6 +46,7 @@ class MockClient:
         self.server_ip = server_ip
         self.server_port = server_port
         self.socket = None
+        self.parser = MessageParser(CLIENT_MESSAGE_TYPES)
         self.running = False
         self.heartbeat_interval = 10  # 10秒心跳间隔（用于测试）
 
@@ -41,34 +61,35 @@ class MockClient:
             print(f"[ERROR] 连接失败: {e}")
             return False
 
+    def receive_message(self):
+        """接收一条服务器消息，连接关闭时返回 None"""
+        messages = []
+        while not messages:
+            count = self.socket.recv_into(self.parser.get_buffer())
+            if not count:
+                return None
+            messages = self.parser.buffer_updated(count)
+        # 服务器每个请求只回复一条响应，同步收发时不会一次收到多条
+        return messages[0]
+
     def register(self):
         """注册设备"""
         try:
-            # 构造注册消息
-            device_name_bytes = self.device_name.encode('utf-8')[:32].ljust(32, b'\x00')
-            location_bytes = self.location.encode('utf-8')[:64].ljust(64, b'\x00')
-
-            data = device_name_bytes + location_bytes
-            data_length = len(data)
-
-            # 发送消息头
-            header = struct.pack('!BBHI', MSG_REGISTER, 0, self.device_id, data_length)
-            self.socket.send(header)
-
-            # 发送数据
-            self.socket.send(data)
+            self.socket.sendall(pack_register(self.device_id, self.device_name, self.location))
 
             # 接收响应
-            ack_header = self.socket.recv(8)
-            if len(ack_header) == 8:
-                msg_type, _, _, _ = struct.unpack('!BBHI', ack_header)
-                if msg_type == MSG_REGISTER_ACK:
-                    print(f"[OK] 设备注册成功 [ID: {self.device_id}, 名称: {self.device_name}]")
-                    return True
+            message = self.receive_message()
+            if message is not None and message.msg_type == MSG_REGISTER_ACK:
+                print(f"[OK] 设备注册成功 [ID: {self.device_id}, 名称: {self.device_name}]")
+                return True
 
             print("[ERROR] 注册响应无效")
             return False
 
+        except ProtocolError as e:
+            print(f"[ERROR] 注册响应无效: {e}")
+            return False
+
         except Exception as e:
             print(f"[ERROR] 注册失败: {e}")
             return False
@@ -77,21 +98,20 @@ class MockClient:
         """发送心跳"""
         try:
             # 发送心跳消息
-            header = struct.pack('!BBHI', MSG_HEARTBEAT, 0, self.device_id, 0)
-            self.socket.send(header)
+            self.socket.sendall(pack_header(MSG_HEARTBEAT, self.device_id))
 
             # 接收响应
             self.socket.settimeout(5)
-            ack_header = self.socket.recv(8)
-
-            if len(ack_header) == 8:
-                msg_type, _, _, _ = struct.unpack('!BBHI', ack_header)
-                if msg_type == MSG_HEARTBEAT_ACK:
-                    return True
+            message = self.receive_message()
+            if message is not None and message.msg_type == MSG_HEARTBEAT_ACK:
+                return True
 
             print("[WARNING] 心跳响应无效")
             return False
 
+        except ProtocolError as e:
+            print(f"[WARNING] 心跳响应无效: {e}")
+            return False
         except socket.timeout:
             print("[ERROR] 心跳响应超时")
             return False
@@ -143,7 +163,295 @@ class MockClient:
             self.socket.close()
         print("[OK] 客户端已停止")
 
-def main():
+def now_us():
+    """当前时间（微秒，Unix时间），用作 v2 消息的时间戳"""
+    return time.time_ns() // 1000
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def make_synthetic_jpeg(size):
+    """生成大小恰好为 size 字节的合法JPEG
+
+    先编码一张小图，再在SOI之后插入COM注释段补足长度，
+    服务器的SOI/EOI校验和解码都能正常通过。
+    一个COM段至少4字节：差值为1~3字节或小图已超过 size 时，改用更小的尺寸或更低的质量重新编码；
+    size 小于能编码出的最小JPEG（约700字节）时返回该最小JPEG
+    """
+    import cv2
+    import numpy as np
+
+    image = np.random.default_rng(size).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    base = None
+    for scale in (1, 2, 4, 8):
+        for quality in (50, 30, 10):
+            base = cv2.imencode('.jpg', image[::scale, ::scale], [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            padding = size - len(base)
+            if padding == 0 or padding >= 4:
+                break
+        else:
+            continue
+        break
+    if padding < 4:
+        return base
+
+    segments = []
+    while padding >= 4:
+        # 每个COM段: FFFE + 2字节长度(含自身) + 内容，内容最多65533字节
+        body = min(padding - 4, 65533)
+        if 0 < padding - 4 - body < 4:
+            # 避免剩余长度不足以组成下一个段
+            body -= 4
+        segments.append(b'\xff\xfe' + struct.pack('!H', body + 2) + b'\x00' * body)
+        padding -= body + 4
+    return base[:2] + b''.join(segments) + base[2:]
+
+class FleetStats:
+    """设备群压测统计"""
+
+    def __init__(self):
+        self.connected = 0
+        self.registered = 0
+        self.heartbeats = 0
+        self.frames = 0
+        self.frame_bytes = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.register_latency = []
+        self.heartbeat_latency = []
+        # v2
+        self.v2_devices = 0
+        self.acks = 0
+        self.frames_dropped = 0   # 模拟设备本地丢弃的帧（占用序号但不发送）
+        self.unacked_frames = 0   # 结束时仍未被确认的帧
+
+    def summary(self, elapsed, title):
+        lines = [
+            f"{title} ({elapsed:.1f}s)",
+            f"  已连接/已注册: {self.connected}/{self.registered}, 断开: {self.disconnects}, 错误: {self.errors}",
+            f"  图像: {self.frames}帧 ({self.frames / elapsed:.1f} 帧/秒, "
+            f"{self.frame_bytes / elapsed / 1024 / 1024:.2f} MB/s)",
+            f"  心跳: {self.heartbeats}次 ({self.heartbeats / elapsed:.1f} 次/秒)",
+        ]
+        if self.v2_devices:
+            lines.append(f"  v2: {self.v2_devices}台, 确认{self.acks}次, 本地丢弃{self.frames_dropped}帧, "
+                         f"未确认{self.unacked_frames}帧")
+        for name, values in (("注册响应", self.register_latency), ("心跳响应", self.heartbeat_latency)):
+            if values:
+                lines.append(f"  {name}延迟(ms): p50 {percentile(values, 50) * 1000:.2f}  "
+                             f"p99 {percentile(values, 99) * 1000:.2f}  "
+                             f"p999 {percentile(values, 99.9) * 1000:.2f}  "
+                             f"max {max(values) * 1000:.2f}")
+        return "\n".join(lines)
+
+class FleetDevice:
+    """asyncio 模拟的一台设备：注册、定时心跳、随机运动图像突发"""
+
+    def __init__(self, device_id, args, stats, payloads, udp=None):
+        self.device_id = device_id
+        self.args = args
+        self.stats = stats
+        self.payloads = payloads
+        self.udp = udp               # UDP 心跳套接字（所有设备共用），None 时通过 TCP 发送心跳
+        self.heartbeat_seq = 0
+        self.pending_heartbeats = deque()  # 已发送、等待响应的心跳发送时间
+        self.parser = MessageParser(CLIENT_MESSAGE_TYPES)
+        self.version = PROTOCOL_V1
+        self.seq = 0                 # v2: 最近一帧的序号
+        self.unacked = deque()       # v2: 已发送、尚未确认的帧序号
+        self.reader = None
+        self.writer = None
+
+    async def run(self, stop_at):
+        args = self.args
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(args.server, args.port), timeout=args.timeout)
+            self.stats.connected += 1
+
+            start = time.perf_counter()
+            offered = args.protocol if args.protocol >= PROTOCOL_V2 else 0
+            self.writer.write(pack_register(self.device_id, f"{args.name_prefix}-{self.device_id}", "load-test",
+                                            offered))
+            await self.writer.drain()
+            messages = []
+            while not messages:
+                data = await asyncio.wait_for(self.reader.read(4096), timeout=args.timeout)
+                if not data:
+                    raise ConnectionError("连接已关闭")
+                messages = self.parser.feed(data)
+            if messages[0].msg_type != MSG_REGISTER_ACK:
+                raise RuntimeError("注册响应无效")
+            self.stats.register_latency.append(time.perf_counter() - start)
+            self.stats.registered += 1
+            # 服务器在注册响应中回复协商的版本，旧服务器回复 0
+            if messages[0].reserved == PROTOCOL_V2:
+                self.version = PROTOCOL_V2
+                self.stats.v2_devices += 1
+
+            tasks = [asyncio.ensure_future(self.read_acks()),
+                     asyncio.ensure_future(self.heartbeat_loop(stop_at))]
+            if self.payloads:
+                tasks.append(asyncio.ensure_future(self.motion_loop(stop_at)))
+            try:
+                # 服务器处理过慢导致发送阻塞时，超过结束时间 timeout 秒后放弃
+                remaining = max(stop_at - time.monotonic(), 0)
+                await asyncio.wait_for(asyncio.gather(*tasks[1:]), timeout=remaining + args.timeout)
+                if self.version == PROTOCOL_V2:
+                    # 再发一次心跳，取得最后几帧的确认
+                    await self.send_heartbeat()
+                # 等待最后的心跳响应
+                deadline = time.monotonic() + args.timeout
+                while self.pending_heartbeats and time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.stats.unacked_frames += len(self.unacked)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.stats.disconnects += 1
+        except asyncio.TimeoutError:
+            self.stats.errors += 1
+        except Exception:
+            self.stats.errors += 1
+        finally:
+            if self.writer:
+                self.writer.close()
+
+    async def read_acks(self):
+        while True:
+            data = await self.reader.read(4096)
+            if not data:
+                return
+            # 多个心跳响应可能在一次读取中到达
+            for message in self.parser.feed(data):
+                if message.msg_type != MSG_HEARTBEAT_ACK:
+                    self.stats.errors += 1
+                elif self.version == PROTOCOL_V2:
+                    self.handle_ack(message)
+                elif self.pending_heartbeats:
+                    self.stats.heartbeat_latency.append(time.perf_counter() - self.pending_heartbeats.popleft())
+                    self.stats.heartbeats += 1
+                else:
+                    self.stats.errors += 1
+
+    def handle_ack(self, message):
+        """v2 累计确认：释放已确认的帧，回显时间戳之前发送的心跳都已被处理"""
+        ack_seq, echo = parse_ack(message.payload)
+        self.stats.acks += 1
+        while self.unacked and self.unacked[0] <= ack_seq:
+            self.unacked.popleft()
+        now = now_us()
+        while self.pending_heartbeats and self.pending_heartbeats[0] <= echo:
+            self.stats.heartbeat_latency.append((now - self.pending_heartbeats.popleft()) / 1e6)
+            self.stats.heartbeats += 1
+
+    async def send_heartbeat(self):
+        if self.version == PROTOCOL_V2:
+            # 不等待确认；pending_heartbeats 保存时间戳，由累计确认的回显时间戳匹配
+            timestamp = now_us()
+            self.pending_heartbeats.append(timestamp)
+            self.writer.write(pack_extended_header(MSG_HEARTBEAT, self.device_id, self.seq, timestamp))
+        else:
+            self.pending_heartbeats.append(time.perf_counter())
+            self.writer.write(pack_header(MSG_HEARTBEAT, self.device_id))
+        await self.writer.drain()
+
+    def send_datagram(self):
+        """UDP 心跳：服务器不回复，发送即计数"""
+        self.heartbeat_seq += 1
+        try:
+            self.udp.sendto(pack_heartbeat_datagram(self.device_id, self.heartbeat_seq),
+                            (self.args.server, self.args.udp_heartbeat_port))
+        except OSError:
+            self.stats.errors += 1
+            return
+        self.stats.heartbeats += 1
+
+    async def sleep_until(self, delay, stop_at):
+        """休眠 delay 秒，但不超过结束时间"""
+        await asyncio.sleep(max(min(delay, stop_at - time.monotonic()), 0))
+
+    async def heartbeat_loop(self, stop_at):
+        interval = self.args.heartbeat_interval
+        # 随机错开各设备的心跳相位
+        await self.sleep_until(random.uniform(0, interval), stop_at)
+        while time.monotonic() < stop_at:
+            if self.udp is not None:
+                self.send_datagram()
+            else:
+                await self.send_heartbeat()
+            await self.sleep_until(interval, stop_at)
+
+    async def motion_loop(self, stop_at):
+        args = self.args
+        frame_interval = 1.0 / args.burst_fps
+        while time.monotonic() < stop_at:
+            if args.burst_interval > 0:
+                await self.sleep_until(random.expovariate(1.0 / args.burst_interval), stop_at)
+            burst_end = min(time.monotonic() + args.burst_duration, stop_at)
+            while time.monotonic() < burst_end:
+                payload = random.choice(self.payloads)
+                if self.version == PROTOCOL_V2:
+                    self.seq += 1
+                    if random.random() < args.drop_rate:
+                        # 模拟设备发送队列满时丢弃的帧：占用序号但不发送
+                        self.stats.frames_dropped += 1
+                        await self.sleep_until(frame_interval, burst_end)
+                        continue
+                    self.writer.write(pack_extended_header(MSG_IMAGE_DATA, self.device_id, self.seq, now_us(),
+                                                           len(payload)))
+                    self.unacked.append(self.seq)
+                else:
+                    self.writer.write(pack_header(MSG_IMAGE_DATA, self.device_id, len(payload)))
+                self.writer.write(payload)
+                await self.writer.drain()
+                self.stats.frames += 1
+                self.stats.frame_bytes += len(payload)
+                await self.sleep_until(frame_interval, burst_end)
+
+async def run_fleet(args):
+    stats = FleetStats()
+    payloads = [make_synthetic_jpeg(size) for size in args.image_sizes] if args.image_sizes else []
+
+    start = time.monotonic()
+    stop_at = start + args.duration
+    udp = None
+    if args.udp_heartbeat_port:
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.setblocking(False)
+    devices = [FleetDevice(args.start_id + index, args, stats, payloads, udp) for index in range(args.devices)]
+
+    async def launch(index, device):
+        # 在 ramp 秒内均匀建立连接
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp * index / len(devices))
+        await device.run(stop_at)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(args.report_interval)
+            print(stats.summary(time.monotonic() - start, "[进度]"))
+
+    report_task = asyncio.ensure_future(reporter()) if args.report_interval > 0 else None
+    await asyncio.gather(*[launch(index, device) for index, device in enumerate(devices)])
+    if report_task:
+        report_task.cancel()
+    if udp is not None:
+        udp.close()
+
+    # 吞吐按实际发送时长计算，不包括结束后等待响应的时间
+    print("=" * 60)
+    print(stats.summary(min(time.monotonic(), stop_at) - start, "压测结果"))
+    print("=" * 60)
+    return stats
+
+def run_single(server_ip='127.0.0.1', server_port=8888):
+    """单设备模式（原有行为）"""
     print("=" * 60)
     print("模拟客户端 - 心跳机制测试")
     print("=" * 60)
@@ -154,8 +462,8 @@ def main():
         device_id=101,
         device_name="TestDevice-001",
         location="Test-Location-1",
-        server_ip="127.0.0.1",
-        server_port=8888
+        server_ip=server_ip,
+        server_port=server_port
     )
 
     print(f"设备信息:")
@@ -169,5 +477,38 @@ def main():
     # 启动客户端
     client.start()
 
+def main():
+    parser = argparse.ArgumentParser(description="模拟设备客户端 / 设备群压测工具")
+    parser.add_argument('--devices', type=int, help="模拟设备数量，指定后进入设备群压测模式")
+    parser.add_argument('--server', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--start-id', type=int, default=1000, help="第一个设备ID")
+    parser.add_argument('--name-prefix', default='LoadDevice')
+    parser.add_argument('--duration', type=float, default=30, help="压测时长(秒)")
+    parser.add_argument('--ramp', type=float, default=0, help="在多少秒内逐步建立所有连接")
+    parser.add_argument('--heartbeat-interval', type=float, default=10, help="心跳间隔(秒)")
+    parser.add_argument('--image-sizes', type=int, nargs='*', default=[],
+                        help="合成JPEG大小(字节)，可指定多个，为空时不发送图像")
+    parser.add_argument('--burst-fps', type=float, default=15, help="运动突发期间的帧率")
+    parser.add_argument('--burst-duration', type=float, default=2, help="每次运动突发持续时间(秒)")
+    parser.add_argument('--burst-interval', type=float, default=10,
+                        help="两次运动突发之间的平均间隔(秒，指数分布)")
+    parser.add_argument('--timeout', type=float, default=10, help="连接和响应超时(秒)")
+    parser.add_argument('--report-interval', type=float, default=10, help="进度输出间隔(秒)，0为不输出")
+    parser.add_argument('--protocol', type=int, choices=(PROTOCOL_V1, PROTOCOL_V2), default=PROTOCOL_V1,
+                        help="设备协议版本，2 为带帧序号和累计确认的 v2")
+    parser.add_argument('--drop-rate', type=float, default=0,
+                        help="v2: 模拟设备本地丢帧的比例，服务器应按序号统计出丢帧")
+    parser.add_argument('--udp-heartbeat-port', type=int, default=0,
+                        help="通过 UDP 向该端口发送心跳（服务器的 udp_heartbeat_port），0 为通过 TCP 发送")
+    args = parser.parse_args()
+
+    if args.devices is None:
+        run_single(args.server, args.port)
+        return 0
+
+    stats = asyncio.run(run_fleet(args))
+    return 1 if stats.errors else 0
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+接收准入控制测试（本地洪泛）
+启动服务器（设置 max_clients 和 admission_* 限制），模拟以下客户端并从 /metrics 核对结果：
+
+- 连接数：占满 max_clients 个连接后，新连接被立即关闭
+- 帧率：一个设备以最快速度发送小图像，接收的帧数不超过 限速 x 时长 + 突发量，其余被丢弃；
+  同时一个正常设备按低帧率发送，不丢帧，心跳响应不受洪泛影响
+- 数据量：一个设备发送大图像，帧率未超限但字节数超限，按数据量丢弃
+- 在途内存：多个连接同时发送大图像的前半部分，只有预算内的帧被接收；
+  全部发送完后在途内存归零（没有泄漏）
+
+用法:
+    python scripts/test_admission.py
+    python scripts/test_admission.py --duration 5 --fps 20 --server-mode asyncio
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import MSG_HEARTBEAT, MSG_IMAGE_DATA, pack_header, pack_register  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+MAX_CLIENTS = 8
+BURST_SECONDS = 1
+MAX_KB_PER_SECOND = 2048
+MAX_INFLIGHT_MB = 4
+
+FLOOD_DEVICE = 1
+NORMAL_DEVICE = 2
+BIG_DEVICE = 3
+MEMORY_DEVICES = range(10, 14)
+
+SMALL_FRAME = 20 * 1024
+BIG_FRAME = 400 * 1024
+HUGE_FRAME = 3 * 1024 * 1024
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, metrics_port, fps, server_mode):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        f.write(f"server_mode = {server_mode}\n")
+        f.write(f"max_clients = {MAX_CLIENTS}\n")
+        f.write(f"admission_max_fps = {fps}\n")
+        f.write(f"admission_max_kb_per_second = {MAX_KB_PER_SECOND}\n")
+        f.write(f"admission_burst_seconds = {BURST_SECONDS}\n")
+        f.write(f"admission_max_inflight_mb = {MAX_INFLIGHT_MB}\n")
+        f.write(f"metrics_port = {metrics_port}\n")
+        f.write("log_level = error\n")
+
+
+def read_metrics(metrics_port):
+    """返回 {'名称{标签}': 值}"""
+    text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode('utf-8')
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def metric(values, name, **labels):
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return values.get(f"motion_server_{name}{{{label_text}}}" if labels else f"motion_server_{name}", 0)
+
+
+def connect(port, device_id):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(pack_register(device_id, f"Admission-{device_id}", "test"))
+    sock.recv(8)
+    return sock
+
+
+def image_message(device_id, size):
+    return pack_header(MSG_IMAGE_DATA, device_id, size) + b'\xff\xd8' + b'\0' * (size - 4) + b'\xff\xd9'
+
+
+def test_connections(port):
+    """占满连接数后，新连接应被服务器立即关闭"""
+    sockets = [socket.create_connection(('127.0.0.1', port)) for _ in range(MAX_CLIENTS)]
+    time.sleep(0.3)
+    extra = socket.create_connection(('127.0.0.1', port))
+    extra.settimeout(3)
+    try:
+        closed = extra.recv(1) == b''
+    except ConnectionResetError:
+        closed = True
+    except socket.timeout:
+        closed = False
+    extra.close()
+    for sock in sockets:
+        sock.close()
+    time.sleep(0.3)
+    return closed
+
+
+class Sender:
+    """按指定帧率（0 表示尽快）发送图像"""
+
+    def __init__(self, port, device_id, size, fps, duration):
+        self.port = port
+        self.device_id = device_id
+        self.size = size
+        self.fps = fps
+        self.duration = duration
+        self.sent = 0
+        self.heartbeat_latencies = []
+
+    def run(self):
+        message = image_message(self.device_id, self.size)
+        with connect(self.port, self.device_id) as sock:
+            start = time.monotonic()
+            while time.monotonic() - start < self.duration:
+                sock.sendall(message)
+                self.sent += 1
+                if self.fps:
+                    # 正常设备：每帧后发送一次心跳并等待响应
+                    started = time.perf_counter()
+                    sock.sendall(pack_header(MSG_HEARTBEAT, self.device_id))
+                    sock.recv(8)
+                    self.heartbeat_latencies.append(time.perf_counter() - started)
+                    time.sleep(max(0.0, start + self.sent / self.fps - time.monotonic()))
+
+
+def test_memory(port, metrics_port):
+    """多个连接同时发送大图像的前半部分，返回 (发送中途的在途内存, 发送完成后的在途内存)"""
+    sockets = [connect(port, device_id) for device_id in MEMORY_DEVICES]
+    messages = [image_message(device_id, HUGE_FRAME) for device_id in MEMORY_DEVICES]
+    half = len(messages[0]) // 2
+    for sock, message in zip(sockets, messages):
+        sock.sendall(message[:half])
+    time.sleep(0.5)
+    during = metric(read_metrics(metrics_port), 'inflight_bytes')
+    for sock, message in zip(sockets, messages):
+        sock.sendall(message[half:])
+        # 心跳响应说明图像已被读完
+        sock.sendall(pack_header(MSG_HEARTBEAT, 0))
+    for sock in sockets:
+        sock.recv(8)
+        sock.close()
+    time.sleep(0.5)
+    return during, metric(read_metrics(metrics_port), 'inflight_bytes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接收准入控制测试")
+    parser.add_argument('--duration', type=float, default=3.0, help="洪泛时长(秒)")
+    parser.add_argument('--fps', type=float, default=10, help="每个设备的帧率上限")
+    parser.add_argument('--server-mode', default='threaded', choices=('threaded', 'asyncio'))
+    args = parser.parse_args()
+
+    port, metrics_port = find_free_port(), find_free_port()
+    checks = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'admission_server.ini')
+        write_config(config_path, port, metrics_port, args.fps, args.server_mode)
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, config_path], cwd=tmp_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 15
+            while True:
+                try:
+                    read_metrics(metrics_port)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise RuntimeError("服务器启动失败")
+                    time.sleep(0.2)
+
+            checks.append(("超过 max_clients 的连接被立即关闭", test_connections(port)))
+            values = read_metrics(metrics_port)
+            checks.append(("拒绝的连接已计数", metric(values, 'connections_rejected_total') >= 1))
+
+            senders = [Sender(port, FLOOD_DEVICE, SMALL_FRAME, 0, args.duration),
+                       Sender(port, NORMAL_DEVICE, SMALL_FRAME, args.fps / 2, args.duration),
+                       Sender(port, BIG_DEVICE, BIG_FRAME, args.fps * 0.8, args.duration)]
+            threads = [threading.Thread(target=sender.run) for sender in senders]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            time.sleep(0.5)
+            values = read_metrics(metrics_port)
+
+            during, after = test_memory(port, metrics_port)
+            memory_values = read_metrics(metrics_port)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    flood, normal, big = senders
+    received = {device_id: metric(values, 'device_frames_total', device=device_id)
+                for device_id in (FLOOD_DEVICE, NORMAL_DEVICE, BIG_DEVICE)}
+    flood_limit = args.fps * (elapsed + BURST_SECONDS) + 1
+    big_limit = MAX_KB_PER_SECOND * 1024 * (elapsed + BURST_SECONDS) + BIG_FRAME
+    latencies = sorted(normal.heartbeat_latencies)
+    print(f"洪泛设备: 发送{flood.sent}帧 ({flood.sent / elapsed:.0f} 帧/秒), 接收{received[FLOOD_DEVICE]:.0f}帧 "
+          f"(上限 {flood_limit:.0f}), 按帧率丢弃"
+          f"{metric(values, 'admission_dropped_total', device=FLOOD_DEVICE, reason='rate'):.0f}帧")
+    print(f"正常设备: 发送{normal.sent}帧, 接收{received[NORMAL_DEVICE]:.0f}帧, "
+          f"心跳响应 p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+    print(f"大图像设备: 发送{big.sent}帧, 接收{received[BIG_DEVICE]:.0f}帧 "
+          f"({received[BIG_DEVICE] * BIG_FRAME / 1024 / elapsed:.0f} KB/秒), 按数据量丢弃"
+          f"{metric(values, 'admission_dropped_total', device=BIG_DEVICE, reason='bandwidth'):.0f}帧")
+    memory_dropped = sum(metric(memory_values, 'admission_dropped_total', device=device_id, reason='memory')
+                         for device_id in MEMORY_DEVICES)
+    print(f"在途内存: 发送中途 {during / 1024 / 1024:.1f} MB (预算 {MAX_INFLIGHT_MB} MB), "
+          f"按内存丢弃{memory_dropped:.0f}帧, 完成后 {after / 1024 / 1024:.1f} MB")
+
+    checks += [
+        ("洪泛设备的帧被丢弃", flood.sent > received[FLOOD_DEVICE]),
+        ("洪泛设备接收的帧数不超过限速", received[FLOOD_DEVICE] <= flood_limit),
+        ("接收与丢弃的帧数之和等于发送的帧数",
+         received[FLOOD_DEVICE] + metric(values, 'admission_dropped_total', device=FLOOD_DEVICE, reason='rate')
+         + metric(values, 'admission_dropped_total', device=FLOOD_DEVICE, reason='bandwidth') == flood.sent),
+        ("正常设备不丢帧", received[NORMAL_DEVICE] == normal.sent),
+        ("洪泛期间正常设备的心跳响应 p99 < 20ms", latencies[int(len(latencies) * 0.99)] < 0.02),
+        ("大图像设备按数据量丢弃",
+         metric(values, 'admission_dropped_total', device=BIG_DEVICE, reason='bandwidth') > 0),
+        ("大图像设备接收的字节数不超过限速", received[BIG_DEVICE] * BIG_FRAME <= big_limit),
+        ("在途内存不超过预算", 0 < during <= MAX_INFLIGHT_MB * 1024 * 1024),
+        ("超出内存预算的帧被丢弃", memory_dropped == len(MEMORY_DEVICES) - MAX_INFLIGHT_MB * 1024 * 1024 // HUGE_FRAME),
+        ("处理完成后在途内存归零", after == 0),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相似帧检测测试
+用合成画面检验 FrameDeduplicator 的去重效果：
+
+- 静止画面（只有传感器噪声和JPEG压缩误差）：绝大多数帧不保存
+- 有物体从画面一侧移动到另一侧：移动过程中的多个位置被保存
+- 静止画面超过 keep_interval 后仍强制保存一帧
+- 画面突变后立即保存
+并输出每帧哈希计算（含 1/8 灰度解码）的耗时
+
+用法:
+    python scripts/test_dedup.py
+    python scripts/test_dedup.py --size 1920x1080 --frames 200 --threshold 2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from frame_dedup import DEDUP_DECODE_COLOR, DEDUP_DECODE_SCALE, FrameDeduplicator, dhash  # noqa: E402
+from jpeg_decoder import DECODER_OPENCV, DecodedFrame, get_decoder  # noqa: E402
+
+DEVICE_ID = 1
+
+MOVING_FRAMES = 20
+
+
+def make_scene(width, height, seed):
+    """带渐变和纹理的背景"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    scene = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    for _ in range(20):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        color = [int(c) for c in rng.integers(0, 255, 3)]
+        cv2.circle(scene, (int(cx), int(cy)), int(rng.integers(10, height // 4)), color, -1)
+    return scene
+
+
+def encode(scene, rng, box=None):
+    """加入噪声（和可选的移动方块）后编码为JPEG"""
+    frame = scene + rng.normal(0, 4, scene.shape)
+    if box is not None:
+        x, y, size = box
+        cv2.rectangle(frame, (x, y), (x + size, y + size), (20, 20, 200), -1)
+    return cv2.imencode('.jpg', np.clip(frame, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def run(deduplicator, frames, interval=0.1):
+    """按 interval 秒的间隔送入各帧，返回每帧是否保留"""
+    decoder = get_decoder(DECODER_OPENCV)
+    kept = []
+    for index, jpeg in enumerate(frames):
+        gray = DecodedFrame(jpeg, decoder).get(DEDUP_DECODE_SCALE, DEDUP_DECODE_COLOR)
+        kept.append(deduplicator.check(DEVICE_ID, gray, len(jpeg), now=index * interval))
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="相似帧检测测试")
+    parser.add_argument('--size', default='640x480', help="图像尺寸")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--threshold', type=int, default=2)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    rng = np.random.default_rng(1)
+    scene = make_scene(width, height, 0)
+    static = [encode(scene, rng) for _ in range(args.frames)]
+    # 半高的物体在 MOVING_FRAMES 帧内从左侧移动到右侧
+    size = height // 2
+    step = (width - size) // MOVING_FRAMES
+    moving = [encode(scene, rng, (index * step, height // 4, size)) for index in range(MOVING_FRAMES)]
+    changed = encode(make_scene(width, height, 7), rng)
+
+    checks = []
+
+    deduplicator = FrameDeduplicator(threshold=args.threshold, keep_interval=0)
+    kept = run(deduplicator, static)
+    stats = deduplicator.get_stats()[DEVICE_ID]
+    print(f"静止画面: {args.frames}帧中保存{sum(kept)}帧, 节省 {stats['dedup_bytes_saved'] / 1024:.0f} KB")
+    checks.append(("静止画面只保存少数帧", sum(kept) <= max(1, args.frames // 10)))
+    checks.append(("节省的字节数与未保存的帧一致",
+                   stats['dedup_bytes_saved'] == sum(len(jpeg) for jpeg, keep in zip(static, kept) if not keep)))
+
+    kept_after_change = run(deduplicator, [changed])
+    checks.append(("画面突变后立即保存", kept_after_change == [True]))
+
+    deduplicator = FrameDeduplicator(threshold=args.threshold, keep_interval=0)
+    kept = run(deduplicator, moving)
+    print(f"移动画面: {MOVING_FRAMES}帧中保存{sum(kept)}帧")
+    checks.append(("移动画面保存多个位置", sum(kept) >= MOVING_FRAMES // 4))
+
+    deduplicator = FrameDeduplicator(threshold=args.threshold, keep_interval=2.0)
+    kept = run(deduplicator, static, interval=0.1)
+    expected = args.frames * 0.1 / 2.0
+    print(f"静止画面 (keep_interval=2秒, {args.frames * 0.1:.0f}秒): 保存{sum(kept)}帧")
+    checks.append(("静止画面按 keep_interval 定期保存", expected <= sum(kept) <= expected + 2))
+
+    decoder = get_decoder(DECODER_OPENCV)
+    start = time.perf_counter()
+    for jpeg in static:
+        dhash(DecodedFrame(jpeg, decoder).get(DEDUP_DECODE_SCALE, DEDUP_DECODE_COLOR))
+    per_frame = (time.perf_counter() - start) / len(static) * 1000
+    full = time.perf_counter()
+    for jpeg in static:
+        decoder.decode(jpeg)
+    full_per_frame = (time.perf_counter() - full) / len(static) * 1000
+    print(f"哈希耗时: {per_frame:.2f}ms/帧（完整解码 {full_per_frame:.2f}ms/帧）")
+
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运动事件视频片段的帧顺序测试
+多个设备同时产生事件，每帧用左右两半的亮度记录帧序号，用多个编码线程、
+解码耗时随机的解码器送入 EventClipBuilder（让同一事件的批次有机会乱序执行），
+编码完成后读回视频：
+
+- 每个视频片段的帧数与发送的一致（收尾在所有批次编码完成之后）
+- 读回的帧序号依次递增（批次按加入的顺序写入）
+
+用法:
+    python scripts/test_event_clips.py
+    python scripts/test_event_clips.py --devices 1 --frames 320 --workers 8 --rounds 5
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from event_clips import EventClipBuilder, read_event_index  # noqa: E402
+from jpeg_decoder import DECODER_OPENCV, get_decoder  # noqa: E402
+
+WIDTH = 64
+HEIGHT = 48
+CODEC = 'MJPG'  # 每帧独立编码，读回的亮度与原图接近
+FPS = 15.0
+
+# 帧序号 = 高位 * DIGITS + 低位，左半边亮度表示高位，右半边表示低位
+DIGITS = 16
+LEVEL_BASE = 8
+LEVEL_STEP = 12
+MAX_FRAMES = DIGITS * 20
+
+
+class SlowDecoder:
+    """解码前随机等待，放大线程调度的不确定性"""
+
+    def __init__(self):
+        self.decoder = get_decoder(DECODER_OPENCV)
+
+    def decode(self, data, *args):
+        time.sleep(random.uniform(0, 0.003))
+        return self.decoder.decode(data, *args)
+
+
+def make_frames(count):
+    """左右两半的亮度表示帧序号的JPEG"""
+    frames = []
+    for index in range(count):
+        image = np.empty((HEIGHT, WIDTH, 3), np.uint8)
+        image[:, :WIDTH // 2] = LEVEL_BASE + index // DIGITS * LEVEL_STEP
+        image[:, WIDTH // 2:] = LEVEL_BASE + index % DIGITS * LEVEL_STEP
+        frames.append(cv2.imencode('.jpg', image)[1].tobytes())
+    return frames
+
+
+def read_indices(path):
+    """读回视频中每一帧的帧序号（取两半中间区域的平均亮度，避开边界处的压缩误差）"""
+    capture = cv2.VideoCapture(path)
+    indices = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        high, low = (round((float(frame[8:-8, left + 8:left + WIDTH // 2 - 8].mean()) - LEVEL_BASE) / LEVEL_STEP)
+                     for left in (0, WIDTH // 2))
+        indices.append(high * DIGITS + low)
+    capture.release()
+    return indices
+
+
+def run_round(root_dir, devices, frames, workers):
+    """每个设备一个事件，返回 {device_id: (索引中的帧数, 读回的帧序号)}"""
+    builder = EventClipBuilder(root_dir, gap=60, codec=CODEC, workers=workers,
+                               max_pending_frames=devices * len(frames), decoder=SlowDecoder())
+    builder.start()
+    timestamp = time.time()
+    for jpeg in frames:
+        for device_id in range(1, devices + 1):
+            builder.add(device_id, jpeg, timestamp)
+        timestamp += 1 / FPS
+    builder.stop()
+
+    results = {}
+    for device_id in range(1, devices + 1):
+        device_dir = builder.device_dir(device_id)
+        index = read_event_index(device_dir)
+        clips = [name for name in os.listdir(device_dir) if name.endswith('.avi')]
+        indices = read_indices(os.path.join(device_dir, clips[0])) if len(clips) == 1 else []
+        results[device_id] = (int(index['frames'].sum()), indices)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="运动事件视频片段的帧顺序测试")
+    parser.add_argument('--devices', type=int, default=2)
+    parser.add_argument('--frames', type=int, default=300, help=f"每个事件的帧数（不超过{MAX_FRAMES}）")
+    parser.add_argument('--workers', type=int, default=4, help="编码线程数")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    if not 0 < args.frames <= MAX_FRAMES:
+        parser.error(f"--frames 应在 1 到 {MAX_FRAMES} 之间")
+
+    frames = make_frames(args.frames)
+    counts_ok = True
+    ordered = True
+    for round_index in range(args.rounds):
+        tmp_dir = tempfile.mkdtemp(prefix='clips_')
+        try:
+            results = run_round(tmp_dir, args.devices, frames, args.workers)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        for device_id, (indexed, indices) in sorted(results.items()):
+            in_order = indices == list(range(len(indices)))
+            print(f"第{round_index + 1}轮 设备{device_id}: 索引 {indexed}帧, 读回 {len(indices)}帧, "
+                  f"{'顺序正确' if in_order else '顺序错误'}")
+            counts_ok = counts_ok and indexed == len(indices) == args.frames
+            ordered = ordered and in_order
+
+    checks = [
+        ("视频片段包含全部帧（收尾在所有批次之后）", counts_ok),
+        ("视频片段中的帧按发送顺序排列", ordered),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
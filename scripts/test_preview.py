@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时预览测试
+启动服务器（开启 preview_port），若干设备以最快速度发送图像，
+同时有 100 个本地观看者（其中一部分读取很慢）连接 /stream/<设备ID>：
+
+- 每个观看者都收到了画面，且收到的数据与设备发送的某一帧逐字节相同（未解码/重新编码）
+- 慢的观看者跳过中间帧，而不是拖慢接收：对比无观看者和有观看者时的接收速度
+- 设备名称在设备列表页面中被转义，未注册的设备ID返回 404
+
+用法:
+    python scripts/test_preview.py
+    python scripts/test_preview.py --viewers 100 --slow 20 --devices 4 --duration 3
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import MSG_IMAGE_DATA, pack_header, pack_register  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+FIRST_DEVICE_ID = 1
+NAMED_DEVICE_ID = 900
+UNKNOWN_DEVICE_ID = 901
+DEVICE_NAME = '<script>alert(1)</script>'
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, preview_port):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        f.write("max_clients = 256\n")
+        f.write("metrics_port = 0\n")
+        f.write(f"preview_port = {preview_port}\n")
+        f.write("log_level = warning\n")
+
+
+def make_payload(device_id, index, size):
+    """内容各不相同、能通过SOI/EOI校验的数据，用于核对观看者收到的字节"""
+    head = b'\xff\xd8' + f"{device_id}:{index}:".encode('ascii')
+    return head + os.urandom(size - len(head) - 2) + b'\xff\xd9'
+
+
+def send_frames(port, device_id, size, duration, sent):
+    """以最快速度发送图像，返回发送的帧数"""
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(pack_register(device_id, f"Preview-{device_id}", "test"))
+        sock.recv(8)
+        index = 0
+        stop_at = time.monotonic() + duration
+        while time.monotonic() < stop_at:
+            payload = make_payload(device_id, index, size)
+            sent[payload[:24]] = payload
+            sock.sendall(pack_header(MSG_IMAGE_DATA, device_id, len(payload)) + payload)
+            index += 1
+        return index
+
+
+def run_senders(port, devices, size, duration, sent):
+    counts = [0] * devices
+
+    def sender(offset):
+        counts[offset] = send_frames(port, FIRST_DEVICE_ID + offset, size, duration, sent)
+
+    threads = [threading.Thread(target=sender, args=(offset,)) for offset in range(devices)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+class Viewer:
+    """读取 multipart/x-mixed-replace 流的观看者"""
+
+    def __init__(self, port, device_id, slow):
+        self.port = port
+        self.device_id = device_id
+        self.slow = slow
+        self.frames = []
+        self.error = None
+        self.sock = None
+        self.running = True
+
+    def run(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if self.slow:
+                # 小接收缓冲区 + 每帧后休眠，服务器端很快就会写阻塞
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            self.sock.connect(('127.0.0.1', self.port))
+            self.sock.sendall(f"GET /stream/{self.device_id} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('ascii'))
+            stream = self.sock.makefile('rb')
+            status = stream.readline()
+            if b' 200 ' not in status:
+                raise RuntimeError(f"响应错误: {status!r}")
+            while stream.readline() not in (b'\r\n', b''):
+                pass
+            while self.running:
+                if not stream.readline().startswith(b'--'):
+                    break
+                length = None
+                while True:
+                    line = stream.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('ascii').partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                body = stream.read(length)
+                stream.readline()
+                self.frames.append(body)
+                if self.slow:
+                    time.sleep(0.2)
+        except OSError:
+            pass
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+def http_status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def check_index(port, preview_port):
+    """注册名称含HTML的设备，返回 (首页是否转义名称, 未注册设备的 stream/snapshot 状态码)"""
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(pack_register(NAMED_DEVICE_ID, DEVICE_NAME, "test"))
+        sock.recv(8)
+        page = urllib.request.urlopen(f"http://127.0.0.1:{preview_port}/", timeout=5).read().decode('utf-8')
+    escaped = DEVICE_NAME not in page and '&lt;script&gt;' in page
+    statuses = [http_status(f"http://127.0.0.1:{preview_port}/{kind}/{UNKNOWN_DEVICE_ID}")
+                for kind in ('stream', 'snapshot')]
+    return escaped, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="实时预览测试")
+    parser.add_argument('--viewers', type=int, default=100)
+    parser.add_argument('--slow', type=int, default=20, help="其中读取很慢的观看者数")
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--size', type=int, default=100 * 1024, help="每帧字节数")
+    parser.add_argument('--duration', type=float, default=3.0, help="每轮发送时间(秒)")
+    args = parser.parse_args()
+
+    port, preview_port = find_free_port(), find_free_port()
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'preview_server.ini')
+        write_config(config_path, port, preview_port)
+        server = subprocess.Popen([sys.executable, SERVER_SCRIPT, config_path], cwd=tmp_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 15
+            while True:
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{preview_port}/", timeout=1).read()
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise RuntimeError("服务器启动失败")
+                    time.sleep(0.2)
+
+            sent = {}
+            baseline = run_senders(port, args.devices, args.size, args.duration, sent)
+            print(f"无观看者: {baseline:.1f} 帧/秒")
+
+            viewers = [Viewer(preview_port, FIRST_DEVICE_ID + index % args.devices, index < args.slow)
+                       for index in range(args.viewers)]
+            threads = [threading.Thread(target=viewer.run, daemon=True) for viewer in viewers]
+            for thread in threads:
+                thread.start()
+            time.sleep(1.0)
+
+            rate = run_senders(port, args.devices, args.size, args.duration, sent)
+            print(f"{args.viewers}个观看者（{args.slow}个慢速）: {rate:.1f} 帧/秒 ({rate / baseline:.0%})")
+            time.sleep(0.5)
+            for viewer in viewers:
+                viewer.close()
+            for thread in threads:
+                thread.join(timeout=5)
+            escaped, unknown_statuses = check_index(port, preview_port)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    fast = [viewer for viewer in viewers if not viewer.slow]
+    slow = [viewer for viewer in viewers if viewer.slow]
+    fast_frames = sum(len(viewer.frames) for viewer in fast) / max(len(fast), 1)
+    slow_frames = sum(len(viewer.frames) for viewer in slow) / max(len(slow), 1)
+    print(f"每个观看者平均收到: 正常 {fast_frames:.1f} 帧, 慢速 {slow_frames:.1f} 帧")
+
+    checks = [
+        ("所有观看者都收到画面", all(viewer.frames for viewer in viewers)),
+        ("观看者没有出错", not any(viewer.error for viewer in viewers)),
+        ("收到的数据与发送的帧逐字节相同",
+         all(sent.get(frame[:24]) == frame for viewer in viewers for frame in viewer.frames)),
+        ("观看者收到的是所观看设备的画面",
+         all(frame[2:].startswith(f"{viewer.device_id}:".encode('ascii'))
+             for viewer in viewers for frame in viewer.frames)),
+        ("设备列表页面转义设备名称", escaped),
+        ("未注册设备的画面返回 404", unknown_statuses == [404, 404]),
+    ]
+    if slow:
+        checks.append(("慢速观看者跳帧而不是拖慢接收", slow_frames < fast_frames))
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+协议解析器测试
+- 随机拆分：随机生成合法消息流，按随机大小切块送入解析器，结果必须与原消息完全一致
+- 随机数据：送入随机字节和随机篡改的消息流，解析器只能返回合法消息或抛出 ProtocolError
+- 截断：连接在消息中途关闭时 pending 为 True
+- v2：扩展头解析、版本协商和累计确认的合并
+- 准入：被拒绝的图像只返回消息头信息，不分配缓冲区，每条图像消息只询问一次
+- UDP 心跳：数据报格式校验，按设备合并、重复/迟到的数据报不计入、按序号统计丢失
+- 吞吐：小消息（心跳）每秒解析条数、大消息（图像）每秒解析和丢弃的字节数
+
+用法:
+    python scripts/test_protocol.py
+    python scripts/test_protocol.py --iterations 2000 --seed 42
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import (  # noqa: E402
+    AckTracker, MessageParser, ProtocolError, negotiate_version, pack_ack, pack_extended_header,
+    pack_header, pack_heartbeat_datagram, pack_message, pack_register, parse_ack, parse_heartbeat_datagram,
+    parse_register,
+    ACK_EVERY_FRAMES, CLIENT_MESSAGE_TYPES, EXTENSION_SIZE, HEADER_SIZE, MSG_HEARTBEAT, MSG_HEARTBEAT_ACK,
+    MSG_IMAGE_DATA, MSG_REGISTER, PROTOCOL_V2, READ_CHUNK_SIZE, SERVER_MESSAGE_TYPES
+)
+from udp_heartbeat import UdpHeartbeatListener  # noqa: E402
+
+MAX_PAYLOAD = 1024 * 1024
+
+# 覆盖暂存区边界附近的长度
+BOUNDARY_SIZES = [0, 1, READ_CHUNK_SIZE - HEADER_SIZE - 1, READ_CHUNK_SIZE - HEADER_SIZE,
+                  READ_CHUNK_SIZE - HEADER_SIZE + 1, READ_CHUNK_SIZE, READ_CHUNK_SIZE + 1, 200000]
+
+
+def random_message(rng):
+    """返回 (编码后的字节, (类型, 设备ID, 数据, 序号, 时间戳))，v1 和 v2 消息随机混合"""
+    device_id = rng.randrange(65536)
+    seq, timestamp = rng.randrange(1 << 32), rng.randrange(1 << 64)
+    v2 = rng.random() < 0.5
+    kind = rng.random()
+    if kind < 0.4:
+        if v2:
+            return (pack_extended_header(MSG_HEARTBEAT, device_id, seq, timestamp),
+                    (MSG_HEARTBEAT, device_id, b'', seq, timestamp))
+        return pack_header(MSG_HEARTBEAT, device_id), (MSG_HEARTBEAT, device_id, b'', None, None)
+    if kind < 0.5:
+        data = pack_register(device_id, f"dev-{device_id}", f"loc-{rng.random():.6f}", rng.randrange(256))
+        return data, (MSG_REGISTER, device_id, data[HEADER_SIZE:], None, None)
+    size = rng.choice(BOUNDARY_SIZES) if rng.random() < 0.3 else rng.randrange(1, 100000)
+    payload = rng.randbytes(size)
+    if v2:
+        return (pack_extended_header(MSG_IMAGE_DATA, device_id, seq, timestamp, size) + payload,
+                (MSG_IMAGE_DATA, device_id, payload, seq, timestamp))
+    return pack_message(MSG_IMAGE_DATA, device_id, payload), (MSG_IMAGE_DATA, device_id, payload, None, None)
+
+
+def split_randomly(rng, data):
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = rng.choice((1, 2, 7, 8, 9, rng.randrange(1, 4096), rng.randrange(1, 300000)))
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+
+def parse_with_feed(chunks, parser=None):
+    parser = parser or MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+    messages = []
+    for chunk in chunks:
+        messages.extend(parser.feed(chunk))
+    return parser, messages
+
+
+def parse_with_recv_into(rng, data, parser=None):
+    """模拟 recv_into：每次写入 get_buffer() 视图的随机长度前缀"""
+    parser = parser or MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+    messages = []
+    position = 0
+    while position < len(data):
+        view = parser.get_buffer()
+        count = min(len(view), len(data) - position, rng.choice((1, 8, rng.randrange(1, 100000))))
+        view[:count] = data[position:position + count]
+        position += count
+        messages.extend(parser.buffer_updated(count))
+    return parser, messages
+
+
+def as_tuples(messages):
+    return [(message.msg_type, message.device_id, bytes(message.payload), message.seq, message.timestamp)
+            for message in messages]
+
+
+def test_round_trip(rng, iterations):
+    for iteration in range(iterations):
+        encoded, expected = zip(*[random_message(rng) for _ in range(rng.randrange(1, 20))])
+        stream = b''.join(encoded)
+
+        parser, messages = parse_with_feed(split_randomly(rng, stream))
+        if as_tuples(messages) != list(expected) or parser.pending:
+            return f"第{iteration}轮 feed() 解析结果不一致"
+
+        parser, messages = parse_with_recv_into(rng, stream)
+        if as_tuples(messages) != list(expected) or parser.pending:
+            return f"第{iteration}轮 recv_into 解析结果不一致"
+
+        for message, (msg_type, _, payload, _, _) in zip(messages, expected):
+            if msg_type == MSG_REGISTER:
+                name, location = parse_register(message.payload)
+                if not name.startswith('dev-') or not location.startswith('loc-'):
+                    return f"第{iteration}轮 注册信息解析错误: {name!r}, {location!r}"
+    return None
+
+
+def check_garbage(data, chunks):
+    parser = MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+    try:
+        for chunk in chunks:
+            for message in parser.feed(chunk):
+                if message.msg_type not in SERVER_MESSAGE_TYPES or message.length > MAX_PAYLOAD:
+                    return "返回了非法消息"
+    except ProtocolError:
+        pass
+    except Exception as e:
+        return f"抛出了意外的异常 {type(e).__name__}: {e}"
+    return None
+
+
+def test_garbage(rng, iterations):
+    for iteration in range(iterations):
+        data = rng.randbytes(rng.randrange(1, 2000))
+        error = check_garbage(data, split_randomly(rng, data))
+        if error:
+            return f"第{iteration}轮 随机数据: {error}"
+
+        # 在合法消息流中随机篡改若干字节
+        stream = bytearray(b''.join(random_message(rng)[0] for _ in range(rng.randrange(1, 10))))
+        for _ in range(rng.randrange(1, 5)):
+            stream[rng.randrange(len(stream))] = rng.randrange(256)
+        error = check_garbage(bytes(stream), split_randomly(rng, bytes(stream)))
+        if error:
+            return f"第{iteration}轮 篡改数据: {error}"
+    return None
+
+
+def test_validation():
+    cases = [
+        (pack_header(0x09, 1), "未知类型"),
+        (pack_header(MSG_HEARTBEAT, 1, 4) + b'\x00' * 4, "心跳带数据"),
+        (pack_header(MSG_REGISTER, 1, 10) + b'\x00' * 10, "注册数据长度错误"),
+        (pack_header(MSG_IMAGE_DATA, 1, MAX_PAYLOAD + 1), "超过长度上限"),
+        (pack_header(MSG_HEARTBEAT, 1, reserved=7), "不支持的协议版本"),
+        (pack_header(MSG_IMAGE_DATA, 1, EXTENSION_SIZE - 1, PROTOCOL_V2) + b'\x00' * 11, "v2 缺少扩展头"),
+        (pack_header(MSG_HEARTBEAT, 1, 0, PROTOCOL_V2), "v2 心跳长度错误"),
+    ]
+    for data, name in cases:
+        parser = MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+        try:
+            parser.feed(data)
+        except ProtocolError:
+            continue
+        return f"{name}的消息没有被拒绝"
+    return None
+
+
+def test_truncated(rng):
+    encoded, _ = random_message(rng)
+    stream = pack_message(MSG_IMAGE_DATA, 1, b'x' * 100000)
+    for data in (stream[:5], stream[:HEADER_SIZE + 10], stream[:-1], encoded + stream[:3]):
+        parser, _ = parse_with_feed([data])
+        if not parser.pending:
+            return f"截断的数据（{len(data)}字节）未被识别"
+    return None
+
+
+def test_v2():
+    if negotiate_version(0) != 0 or negotiate_version(1) != 1 or negotiate_version(9) != PROTOCOL_V2:
+        return "版本协商结果错误"
+
+    # 一批消息只确认一次，确认序号为收到的最大帧序号，回显最后一条消息的时间戳
+    parser = MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+    acks = AckTracker()
+    stream = (pack_extended_header(MSG_IMAGE_DATA, 5, 10, 1000, 3) + b'abc' +
+              pack_extended_header(MSG_IMAGE_DATA, 5, 11, 2000, 3) + b'def' +
+              pack_extended_header(MSG_HEARTBEAT, 5, 11, 3000) +
+              pack_extended_header(MSG_HEARTBEAT, 5, 11, 4000))
+    for message in parser.feed(stream):
+        acks.received(message)
+    ack = acks.take()
+    if acks.take() is not None:
+        return "同一批消息确认了多次"
+    client = MessageParser(CLIENT_MESSAGE_TYPES)
+    messages = client.feed(ack)
+    if ack != pack_ack(5, 11, 4000) or len(messages) != 1 or messages[0].msg_type != MSG_HEARTBEAT_ACK:
+        return f"确认消息错误: {ack!r}"
+    if parse_ack(messages[0].payload) != (11, 4000):
+        return "确认数据解析错误"
+
+    # 没有心跳时每 ACK_EVERY_FRAMES 帧确认一次
+    for seq in range(12, 12 + ACK_EVERY_FRAMES - 1):
+        for message in parser.feed(pack_extended_header(MSG_IMAGE_DATA, 5, seq, seq, 1) + b'x'):
+            acks.received(message)
+        if acks.take() is not None:
+            return "图像未达到确认间隔就发送了确认"
+    for message in parser.feed(pack_extended_header(MSG_IMAGE_DATA, 5, 99, 99, 1) + b'x'):
+        acks.received(message)
+    if acks.take() != pack_ack(5, 99, 99):
+        return "达到确认间隔后没有发送确认"
+    return None
+
+
+def test_udp_heartbeat():
+    if parse_heartbeat_datagram(pack_heartbeat_datagram(7, (1 << 32) + 3)) != (7, 3):
+        return "数据报解析结果错误"
+    if (parse_heartbeat_datagram(pack_heartbeat_datagram(7, 1) + b'x') is not None
+            or parse_heartbeat_datagram(pack_header(MSG_HEARTBEAT, 7)) is not None):
+        return "长度或类型错误的数据报未被拒绝"
+
+    # 设备7: 1, 2, 2(重复), 5(丢失3、4), 4(迟到); 设备8: 100, 然后重启从 1 开始; 一个格式错误的数据报
+    datagrams = [pack_heartbeat_datagram(7, seq) for seq in (1, 2, 2, 5, 4)]
+    datagrams += [pack_heartbeat_datagram(8, 100), b'bad', pack_heartbeat_datagram(8, 1)]
+    listener = UdpHeartbeatListener('127.0.0.1', 0, on_batch=None)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(('127.0.0.1', 0))
+        receiver.setblocking(False)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for datagram in datagrams:
+                sender.sendto(datagram, receiver.getsockname())
+        time.sleep(0.1)
+        batch = listener.process(listener.drain(receiver))
+    counts = {device_id: count for (device_id, _), count in batch.items()}
+    if counts != {7: 3, 8: 2}:
+        return f"按设备合并的心跳数错误: {counts}"
+    stats = listener.get_stats()
+    if (stats['received'], stats['malformed'], stats['duplicates'], stats['lost']) != (8, 1, 2, 2):
+        return f"统计错误: {stats}"
+
+    # 伪造来源的数据报被拒绝后不影响设备的序号：之后设备正常的序号 6 不算重复，也不算丢失
+    listener.on_batch = lambda checked: {key for key in checked if key[1] == '127.0.0.1'}
+    listener.process({(7, '10.0.0.9'): [1000, 1001]})
+    if listener.process({(7, '127.0.0.1'): [6]}) != {(7, '127.0.0.1'): 1}:
+        return "伪造来源的数据报改变了设备的序号"
+    stats = listener.get_stats()
+    if (stats['rejected'], stats['duplicates'], stats['lost']) != (2, 2, 2):
+        return f"拒绝伪造来源后统计错误: {stats}"
+    return None
+
+
+class AdmissionRecorder:
+    """拒绝奇数设备ID的图像，记录询问和分配的次数"""
+
+    def __init__(self):
+        self.asked = []
+        self.allocated = 0
+
+    def admit(self, device_id, length):
+        self.asked.append((device_id, length))
+        return device_id % 2 == 0
+
+    def allocate(self, size):
+        self.allocated += 1
+        return bytearray(size)
+
+    def parser(self):
+        return MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD, self.allocate, admit=self.admit)
+
+
+def test_admission(rng, iterations):
+    for iteration in range(iterations):
+        encoded, expected = zip(*[random_message(rng) for _ in range(rng.randrange(1, 20))])
+        stream = b''.join(encoded)
+        images = [(device_id, len(payload)) for msg_type, device_id, payload, _, _ in expected
+                  if msg_type == MSG_IMAGE_DATA]
+        expected = [(msg_type, device_id, None if msg_type == MSG_IMAGE_DATA and device_id % 2 else payload,
+                     seq, timestamp) for msg_type, device_id, payload, seq, timestamp in expected]
+
+        for name, parse in (("feed()", lambda parser: parse_with_feed(split_randomly(rng, stream), parser)),
+                            ("recv_into", lambda parser: parse_with_recv_into(rng, stream, parser))):
+            recorder = AdmissionRecorder()
+            parser, messages = parse(recorder.parser())
+            result = [(message.msg_type, message.device_id,
+                       None if message.payload is None else bytes(message.payload), message.seq, message.timestamp)
+                      for message in messages]
+            if result != expected or parser.pending:
+                return f"第{iteration}轮 {name} 解析结果不一致"
+            if recorder.asked != images:
+                return f"第{iteration}轮 {name} 每条图像消息应询问一次，实际 {len(recorder.asked)}/{len(images)}"
+            if recorder.allocated != sum(1 for device_id, _ in images if device_id % 2 == 0):
+                return f"第{iteration}轮 {name} 为被拒绝的图像分配了缓冲区"
+    return None
+
+
+def bench_small(count):
+    stream = b''.join(pack_header(MSG_HEARTBEAT, device_id % 65536) for device_id in range(count))
+    parser = MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD)
+    start = time.perf_counter()
+    parsed = 0
+    for position in range(0, len(stream), READ_CHUNK_SIZE):
+        parsed += len(parser.feed(stream[position:position + READ_CHUNK_SIZE]))
+    return parsed / (time.perf_counter() - start)
+
+
+def bench_large(frame_size, count, admit=None):
+    message = pack_message(MSG_IMAGE_DATA, 1, os.urandom(frame_size))
+    parser = MessageParser(SERVER_MESSAGE_TYPES, MAX_PAYLOAD, admit=admit)
+    start = time.perf_counter()
+    total = 0
+    for _ in range(count):
+        parser.feed(message)
+        total += frame_size
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="协议解析器测试")
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    rng = random.Random(seed)
+    print(f"随机种子: {seed}")
+
+    failed = False
+    for name, test in (("随机拆分", lambda: test_round_trip(rng, args.iterations)),
+                       ("随机数据", lambda: test_garbage(rng, args.iterations)),
+                       ("消息校验", test_validation),
+                       ("截断检测", lambda: test_truncated(rng)),
+                       ("v2 扩展", test_v2),
+                       ("准入控制", lambda: test_admission(rng, args.iterations)),
+                       ("UDP 心跳", test_udp_heartbeat)):
+        error = test()
+        if error:
+            failed = True
+            print(f"✗ {name}: {error}")
+        else:
+            print(f"✓ {name}")
+
+    print("-" * 40)
+    print(f"心跳消息解析: {bench_small(200000) / 1e6:.2f} M条/秒")
+    print(f"图像消息解析(200KB): {bench_large(200 * 1024, 500) / 1024 / 1024:.0f} MB/秒")
+    print(f"图像消息丢弃(200KB): {bench_large(200 * 1024, 500, lambda device_id, length: False) / 1024 / 1024:.0f} MB/秒")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储配额与保留期限测试
+生成一个合成存档（默认 30 万个小JPEG文件，20个设备，时间跨度30天），
+启动 RetentionManager，同时模拟接收线程持续写入新文件：
+
+- 删除后统计的占用与磁盘上剩余文件的实际大小一致，且不超过总容量上限
+- 超过保存天数的文件全部删除，单独设置了容量上限的设备不超过其上限
+- 按时间从旧到新删除：被删除的文件都不比保留的文件新
+- 写入时更新统计的耗时（record()）不受后台扫描和删除影响
+
+用法:
+    python scripts/test_retention.py
+    python scripts/test_retention.py --frames 500000 --devices 50
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from retention import RetentionManager, SECONDS_PER_DAY, scan_device_dir  # noqa: E402
+
+ARCHIVE_DAYS = 30
+MAX_DAYS = 20
+LIMITED_DEVICE = 1
+
+# 扫描完成后继续写入的时间（秒）
+WRITE_SECONDS = 2.0
+
+# 等待删除完成的最长时间（秒）
+TIMEOUT = 120
+
+
+def build_archive(root_dir, frames, devices, now):
+    """按时间顺序生成文件，大小 200-1200 字节，修改时间均匀分布在最近 ARCHIVE_DAYS 天内"""
+    step = ARCHIVE_DAYS * SECONDS_PER_DAY / frames
+    payload = os.urandom(1200)
+    total = 0
+    for device_id in range(1, devices + 1):
+        os.makedirs(os.path.join(root_dir, f"device_{device_id}"), exist_ok=True)
+    for index in range(frames):
+        device_id = index % devices + 1
+        timestamp = now - ARCHIVE_DAYS * SECONDS_PER_DAY + index * step
+        size = 200 + index % 1000
+        path = os.path.join(root_dir, f"device_{device_id}", f"motion_{index:08d}.jpg")
+        with open(path, 'wb') as f:
+            f.write(payload[:size])
+        os.utime(path, (timestamp, timestamp))
+        total += size
+    return total
+
+
+def list_archive(root_dir, devices):
+    """返回 {路径: (设备ID, 修改时间, 大小)}"""
+    files = {}
+    for device_id in range(1, devices + 1):
+        for item in scan_device_dir(os.path.join(root_dir, f"device_{device_id}")):
+            files[item.paths[0]] = (device_id, item.end_us / 1_000_000, item.size)
+    return files
+
+
+class Writer:
+    """模拟接收线程：持续写入新文件并记录 record() 的耗时"""
+
+    def __init__(self, manager, root_dir, devices):
+        self.manager = manager
+        self.root_dir = root_dir
+        self.devices = devices
+        self.latencies = []
+        self.running = True
+
+    def run(self):
+        index = 0
+        payload = b'\xff\xd8' + b'\0' * 500 + b'\xff\xd9'
+        while self.running:
+            device_id = index % self.devices + 1
+            path = os.path.join(self.root_dir, f"device_{device_id}", f"motion_new_{index:08d}.jpg")
+            with open(path, 'wb') as f:
+                f.write(payload)
+            started = time.perf_counter()
+            self.manager.record(device_id, path, len(payload))
+            self.latencies.append(time.perf_counter() - started)
+            index += 1
+            time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="存储配额与保留期限测试")
+    parser.add_argument('--frames', type=int, default=300000, help="合成存档的文件数")
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=1000, help="每批删除的文件数")
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix='retention_')
+    try:
+        now = time.time()
+        started = time.perf_counter()
+        archive_bytes = build_archive(root_dir, args.frames, args.devices, now)
+        print(f"合成存档: {args.frames}个文件, {args.devices}个设备, {archive_bytes / 1024 / 1024:.1f} MB "
+              f"(生成耗时 {time.perf_counter() - started:.1f}秒)")
+        before = list_archive(root_dir, args.devices)
+
+        # 总容量为存档的一半（保存天数删除约1/3后仍需继续删除），设备1单独限制为平均值的1/4
+        max_bytes = archive_bytes // 2
+        device_max_bytes = archive_bytes // args.devices // 4
+        manager = RetentionManager(root_dir, max_bytes=max_bytes, max_age=MAX_DAYS * SECONDS_PER_DAY,
+                                   device_limits={LIMITED_DEVICE: (device_max_bytes, None)},
+                                   interval=0.2, batch_size=args.batch_size, pause=0.01)
+        writer = Writer(manager, root_dir, args.devices)
+        writer_thread = threading.Thread(target=writer.run)
+        writer_thread.start()
+        time.sleep(0.2)
+
+        started = time.perf_counter()
+        manager.start()
+        while not manager.scanned:
+            time.sleep(0.05)
+        scan_seconds = time.perf_counter() - started
+        # 已有存档超出的部分删除完成（首次降到总容量以内）的时间
+        while manager.total_bytes > max_bytes and time.perf_counter() - started < TIMEOUT:
+            time.sleep(0.01)
+        evict_seconds = time.perf_counter() - started - scan_seconds
+        evicted_initial = sum(device['evicted'] for device in manager.get_stats().values())
+        # 删除期间继续写入 WRITE_SECONDS 秒，停止写入后等待删除完成（连续两次统计不再变化）
+        time.sleep(WRITE_SECONDS)
+        writer.running = False
+        writer_thread.join()
+        previous = None
+        while True:
+            stats = manager.get_stats()
+            evicted = sum(device['evicted'] for device in stats.values())
+            if evicted == previous:
+                break
+            previous = evicted
+            time.sleep(0.5)
+        manager.stop()
+
+        after = list_archive(root_dir, args.devices)
+        stats = manager.get_stats()
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    deleted = {path: info for path, info in before.items() if path not in after}
+    remaining_old = {path: info for path, info in after.items() if path in before}
+    on_disk = sum(size for _, _, size in after.values())
+    latencies = sorted(writer.latencies)
+    print(f"扫描: {scan_seconds:.2f}秒; 删除 {evicted_initial}个文件: {evict_seconds:.2f}秒 "
+          f"({evicted_initial / max(evict_seconds, 1e-6):.0f} 文件/秒); 共删除 {len(deleted)}个已有文件")
+    print(f"剩余: {len(after)}个文件, {on_disk / 1024 / 1024:.1f} MB (上限 {max_bytes / 1024 / 1024:.1f} MB)")
+    print(f"record() 耗时: 共{len(latencies)}次, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}µs, "
+          f"最大 {latencies[-1] * 1e6:.0f}µs")
+
+    cutoff = now - MAX_DAYS * SECONDS_PER_DAY
+    others_deleted = [mtime for device_id, mtime, _ in deleted.values() if device_id != LIMITED_DEVICE]
+    others_kept = [mtime for device_id, mtime, _ in remaining_old.values() if device_id != LIMITED_DEVICE]
+    limited_bytes = sum(size for device_id, _, size in after.values() if device_id == LIMITED_DEVICE)
+    checks = [
+        ("统计的占用与磁盘上的实际大小一致", manager.total_bytes == on_disk),
+        ("总占用不超过上限", on_disk <= max_bytes),
+        ("超过保存天数的文件全部删除", all(mtime >= cutoff for _, mtime, _ in remaining_old.values())),
+        ("单独限制的设备不超过其上限", limited_bytes <= device_max_bytes),
+        ("按时间从旧到新删除", not others_deleted or not others_kept or max(others_deleted) <= min(others_kept)),
+        ("各设备统计之和等于总占用", sum(device['bytes'] for device in stats.values()) == manager.total_bytes),
+        ("写入统计的耗时 p99 < 1ms", latencies[int(len(latencies) * 0.99)] < 0.001),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
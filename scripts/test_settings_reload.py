@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设置热重载测试（SIGHUP）
+启动服务器（不限速），修改配置文件后发送 SIGHUP，从 /metrics 核对新设置在不断开连接的情况下生效：
+
+- 准入控制：重新加载前同一连接发送的帧全部接收，重新加载后超过帧率上限的帧被丢弃
+- 心跳超时：缩短后，已注册但不再发送心跳的设备按新的超时时间离线
+- 连接数：调低 max_clients 后新连接被立即关闭，已有连接不受影响
+- 需要重启才能生效的设置保持原值并输出提示；配置文件格式错误时保持当前设置
+- 不是有限数的值（nan、inf）和小于最小值的值（如 status_report_interval = 0）视为无效，使用默认值并输出提示
+
+用法:
+    python scripts/test_settings_reload.py
+    python scripts/test_settings_reload.py --server-mode asyncio
+    python scripts/test_settings_reload.py --workers 2
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from protocol import MSG_HEARTBEAT, MSG_IMAGE_DATA, pack_header, pack_register  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(PROJECT_ROOT, 'server', 'server.py')
+
+ACTIVE_DEVICE = 1
+SILENT_DEVICE = 2
+FRAMES = 30
+FRAME_SIZE = 8 * 1024
+
+# 重新加载后的设置
+MAX_FPS = 5
+BURST_SECONDS = 1
+HEARTBEAT_TIMEOUT = 2
+
+# 等待 SIGHUP 处理完成的时间
+RELOAD_WAIT = 1.0
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, port, metrics_port, server_mode, workers, extra=()):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[server]\n")
+        f.write("host = 127.0.0.1\n")
+        f.write(f"port = {port}\n")
+        f.write("save_images = false\n")
+        f.write("display_images = false\n")
+        f.write(f"server_mode = {server_mode}\n")
+        f.write(f"server_workers = {workers}\n")
+        f.write(f"metrics_port = {metrics_port}\n")
+        f.write("check_interval = 1\n")
+        f.write("log_level = warning\n")
+        for line in extra:
+            f.write(line + "\n")
+
+
+def read_metrics(metrics_port, workers):
+    """返回 {'名称{标签}': 值}，多进程模式下合并各工作进程的指标"""
+    values = {}
+    for index in range(workers if workers > 1 else 1):
+        url = f"http://127.0.0.1:{metrics_port + index}/metrics"
+        text = urllib.request.urlopen(url, timeout=5).read().decode('utf-8')
+        for line in text.splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                values[name] = values.get(name, 0) + float(value)
+    return values
+
+
+def metric(values, name, **labels):
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return values.get(f"motion_server_{name}{{{label_text}}}" if labels else f"motion_server_{name}", 0)
+
+
+def connect(port, device_id):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(pack_register(device_id, f"Reload-{device_id}", "test"))
+    sock.recv(8)
+    return sock
+
+
+def heartbeat(sock):
+    """发送心跳并等待响应，连接已断开时返回 False"""
+    try:
+        sock.sendall(pack_header(MSG_HEARTBEAT, ACTIVE_DEVICE))
+        return len(sock.recv(8)) == 8
+    except OSError:
+        return False
+
+
+def send_frames(sock, count):
+    message = pack_header(MSG_IMAGE_DATA, ACTIVE_DEVICE, FRAME_SIZE) + b'\xff\xd8' + b'\0' * (FRAME_SIZE - 4) + b'\xff\xd9'
+    start = time.perf_counter()
+    for _ in range(count):
+        sock.sendall(message)
+    # 心跳响应说明之前的图像已被读完
+    heartbeat(sock)
+    return time.perf_counter() - start
+
+
+def connection_closed(port):
+    """新连接是否被服务器立即关闭"""
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.settimeout(3)
+        try:
+            return sock.recv(1) == b''
+        except ConnectionResetError:
+            return True
+        except socket.timeout:
+            return False
+
+
+def try_metrics(metrics_port, workers):
+    try:
+        read_metrics(metrics_port, workers)
+        return True
+    except OSError:
+        return False
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="设置热重载测试")
+    parser.add_argument('--server-mode', default='threaded', choices=('threaded', 'asyncio'))
+    parser.add_argument('--workers', type=int, default=1, help="工作进程数（大于1时测试多进程模式）")
+    args = parser.parse_args()
+
+    if not hasattr(signal, 'SIGHUP'):
+        print("当前系统不支持 SIGHUP")
+        return 1
+
+    port, metrics_port = find_free_port(), find_free_port()
+    checks = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'reload_server.ini')
+        log_path = os.path.join(tmp_dir, 'server.log')
+        write_config(config_path, port, metrics_port, args.server_mode, args.workers)
+        with open(log_path, 'w', encoding='utf-8') as log_file:
+            server = subprocess.Popen([sys.executable, SERVER_SCRIPT, config_path], cwd=tmp_dir,
+                                      stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            if not wait_for(lambda: try_metrics(metrics_port, args.workers), 15):
+                raise RuntimeError("服务器启动失败")
+
+            active = connect(port, ACTIVE_DEVICE)
+            silent = connect(port, SILENT_DEVICE)
+            send_frames(active, FRAMES)
+            before = read_metrics(metrics_port, args.workers)
+
+            # 修改准入控制、心跳超时、连接数，以及一项需要重启的设置
+            write_config(config_path, port, metrics_port, args.server_mode, args.workers, extra=(
+                f"admission_max_fps = {MAX_FPS}",
+                f"admission_burst_seconds = {BURST_SECONDS}",
+                f"heartbeat_timeout = {HEARTBEAT_TIMEOUT}",
+                "max_clients = 1",
+                "pipeline_workers = 3",
+                "dedup_keep_interval = nan",
+                "status_report_interval = 0",
+            ))
+            server.send_signal(signal.SIGHUP)
+            time.sleep(RELOAD_WAIT)
+
+            checks.append(("重新加载后已有连接未断开", heartbeat(active)))
+            elapsed = send_frames(active, FRAMES)
+            after = read_metrics(metrics_port, args.workers)
+            received = (metric(after, 'device_frames_total', device=ACTIVE_DEVICE)
+                        - metric(before, 'device_frames_total', device=ACTIVE_DEVICE))
+            dropped = metric(after, 'admission_dropped_total', device=ACTIVE_DEVICE, reason='rate')
+            limit = MAX_FPS * (elapsed + BURST_SECONDS) + 1
+            print(f"重新加载前: 发送{FRAMES}帧, 接收{metric(before, 'device_frames_total', device=ACTIVE_DEVICE):.0f}帧")
+            print(f"重新加载后: 发送{FRAMES}帧, 接收{received:.0f}帧 (上限 {limit:.0f}), 按帧率丢弃{dropped:.0f}帧")
+
+            went_offline = wait_for(
+                lambda: heartbeat(active) and metric(read_metrics(metrics_port, args.workers),
+                                                     'devices', state='offline') >= 1,
+                HEARTBEAT_TIMEOUT + 5)
+            if args.workers == 1:
+                # 已有两个连接，超过新的 max_clients
+                checks.append(("调低 max_clients 后新连接被立即关闭", connection_closed(port)))
+            checks.append(("调低 max_clients 后已有连接不受影响", heartbeat(active)))
+
+            # 格式错误的配置文件：保持当前设置
+            with open(config_path, 'w', encoding='utf-8') as f:
+                f.write("[server\nport = \n")
+            server.send_signal(signal.SIGHUP)
+            time.sleep(RELOAD_WAIT)
+            checks.append(("配置文件格式错误时服务器继续运行", server.poll() is None and heartbeat(active)))
+            active.close()
+            silent.close()
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        with open(log_path, encoding='utf-8', errors='replace') as f:
+            log_text = f.read()
+
+    checks += [
+        ("重新加载前不限速，帧全部接收", metric(before, 'device_frames_total', device=ACTIVE_DEVICE) == FRAMES),
+        ("重新加载后超过帧率上限的帧被丢弃", dropped > 0 and received <= limit),
+        ("接收与丢弃的帧数之和等于发送的帧数", received + dropped == FRAMES),
+        ("缩短心跳超时后不再发送心跳的设备离线", went_offline),
+        ("需要重启的设置给出提示", "需要重启" in log_text and "pipeline_workers" in log_text),
+        ("配置文件格式错误时给出提示", "保持当前设置" in log_text),
+        ("nan 视为无效值", "dedup_keep_interval 的值无效: nan" in log_text),
+        ("小于最小值的值视为无效", "status_report_interval 的值无效: 0" in log_text),
+    ]
+    failed = False
+    for name, ok in checks:
+        failed = failed or not ok
+        print(f"{'✓' if ok else '✗'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
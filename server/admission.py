@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+接收准入控制
+解析出图像消息头时（接收数据之前）决定是否接收该帧，超出限制的帧数据只读出丢弃，不分配缓冲区、
+不解码也不保存，防止单个设备（如运动检测阈值设得过低）的图像洪流拖垮服务器：
+
+- 每个设备两个令牌桶：帧数/秒和字节数/秒，允许 burst_seconds 秒的突发
+- 全局在途内存预算：已接收（含正在接收）但尚未处理完的图像数据总字节数，超出后新帧丢弃
+- 同时连接数的上限（max_clients）由服务器在接受连接时检查
+
+丢弃的帧按原因分别计数：帧率（rate）、数据量（bandwidth）、内存（memory）
+各项限制可在运行中修改（configure），未设置任何限制时只统计在途内存
+"""
+
+import threading
+import time
+
+REASON_RATE = 'rate'
+REASON_BANDWIDTH = 'bandwidth'
+REASON_MEMORY = 'memory'
+REASONS = (REASON_RATE, REASON_BANDWIDTH, REASON_MEMORY)
+
+DEFAULT_BURST_SECONDS = 2.0
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 rate * burst_seconds 个"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, burst_seconds, now):
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = now
+
+    def resize(self, rate, burst_seconds):
+        """修改速率和突发量，已积累的令牌不超过新的容量"""
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def allows(self, amount):
+        """令牌足够时允许；桶容量小于 amount 时（单帧超过突发量）桶满即允许，欠下的令牌稍后补足"""
+        return self.tokens >= min(amount, self.capacity)
+
+class DeviceAdmission:
+    """一个设备的令牌桶和丢弃统计"""
+    __slots__ = ('frame_bucket', 'byte_bucket', 'admitted', 'dropped', 'dropped_bytes', 'dropping')
+
+    def __init__(self, frame_bucket, byte_bucket):
+        self.frame_bucket = frame_bucket   # TokenBucket，不限制时为 None
+        self.byte_bucket = byte_bucket
+        self.admitted = 0
+        self.dropped = dict.fromkeys(REASONS, 0)
+        self.dropped_bytes = 0
+        self.dropping = False   # 上一帧是否被丢弃，用于只在开始丢弃时输出日志
+
+class AdmissionControl:
+    """按设备限速并限制全局在途内存（各项为 None 表示不限制）"""
+
+    def __init__(self, max_fps=None, max_bytes_per_second=None, burst_seconds=DEFAULT_BURST_SECONDS,
+                 max_inflight_bytes=None, log=None):
+        self.max_fps = max_fps
+        self.max_bytes_per_second = max_bytes_per_second
+        self.burst_seconds = burst_seconds
+        self.max_inflight_bytes = max_inflight_bytes
+        self.log = log
+        self.lock = threading.Lock()
+        self.devices = {}        # device_id -> DeviceAdmission
+        self.inflight_bytes = 0
+
+    @property
+    def enabled(self):
+        return (self.max_fps is not None or self.max_bytes_per_second is not None or
+                self.max_inflight_bytes is not None)
+
+    def configure(self, max_fps=None, max_bytes_per_second=None, burst_seconds=DEFAULT_BURST_SECONDS,
+                  max_inflight_bytes=None):
+        """修改各项限制（重新加载设置时调用），已有设备的令牌桶按新的速率调整"""
+        now = time.monotonic()
+        with self.lock:
+            self.max_fps = max_fps
+            self.max_bytes_per_second = max_bytes_per_second
+            self.burst_seconds = burst_seconds
+            self.max_inflight_bytes = max_inflight_bytes
+            for device in self.devices.values():
+                device.frame_bucket = self.resize_bucket(device.frame_bucket, max_fps, now)
+                device.byte_bucket = self.resize_bucket(device.byte_bucket, max_bytes_per_second, now)
+
+    def resize_bucket(self, bucket, rate, now):
+        """在 self.lock 内调用，rate 为 None 时不再限制"""
+        if rate is None:
+            return None
+        if bucket is None:
+            return TokenBucket(rate, self.burst_seconds, now)
+        bucket.refill(now)
+        bucket.resize(rate, self.burst_seconds)
+        return bucket
+
+    def device(self, device_id, now):
+        """在 self.lock 内调用"""
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = DeviceAdmission(
+                TokenBucket(self.max_fps, self.burst_seconds, now) if self.max_fps else None,
+                TokenBucket(self.max_bytes_per_second, self.burst_seconds, now) if self.max_bytes_per_second
+                else None)
+        return device
+
+    def admit(self, device_id, length):
+        """收到图像消息头时调用（连接线程），返回 True 表示接收；接收的帧处理完后必须调用 release()"""
+        now = time.monotonic()
+        with self.lock:
+            device = self.device(device_id, now)
+            frame_bucket, byte_bucket = device.frame_bucket, device.byte_bucket
+            if frame_bucket is not None:
+                frame_bucket.refill(now)
+            if byte_bucket is not None:
+                byte_bucket.refill(now)
+            if self.max_inflight_bytes is not None and self.inflight_bytes + length > self.max_inflight_bytes:
+                reason = REASON_MEMORY
+            elif frame_bucket is not None and not frame_bucket.allows(1):
+                reason = REASON_RATE
+            elif byte_bucket is not None and not byte_bucket.allows(length):
+                reason = REASON_BANDWIDTH
+            else:
+                if frame_bucket is not None:
+                    frame_bucket.tokens -= 1
+                if byte_bucket is not None:
+                    byte_bucket.tokens -= length
+                device.admitted += 1
+                device.dropping = False
+                self.inflight_bytes += length
+                return True
+            device.dropped[reason] += 1
+            device.dropped_bytes += length
+            started = not device.dropping
+            device.dropping = True
+        if started and self.log:
+            self.log.warning('admission', f"超出准入限制（{reason}），丢弃图像", device_id, reason=reason)
+        return False
+
+    def release(self, length):
+        """一帧已接收的图像处理完成或被丢弃，归还在途内存"""
+        with self.lock:
+            self.inflight_bytes -= length
+
+    def get_stats(self):
+        """返回每个设备接收的帧数、按原因丢弃的帧数和丢弃的字节数"""
+        with self.lock:
+            return {device_id: {'admitted': device.admitted, 'dropped': dict(device.dropped),
+                                'dropped_bytes': device.dropped_bytes}
+                    for device_id, device in self.devices.items()}
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+心跳超时截止时间索引
+使用最小堆 + 惰性失效，按单调时钟记录每个设备的截止时间：
+- 心跳只更新字典中的截止时间，O(1)，不操作堆
+- 堆中每个设备最多一条记录，弹出时若截止时间已被心跳推后则重新入堆
+- 检测离线的开销为 O(过期设备数 + 重新入堆数)，与设备总数无关
+"""
+
+import heapq
+import threading
+import time
+
+class DeadlineIndex:
+    """按截止时间排序的设备索引"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.deadlines = {}    # device_id -> 当前截止时间（单调时钟）
+        self.heap = []         # (截止时间, device_id)，可能已过时
+        self.scheduled = set() # 在堆中有记录的设备
+        self.condition = threading.Condition()
+
+    def touch(self, device_id, now=None):
+        """设备有活动（注册/心跳/图像），将截止时间推后到 now + timeout"""
+        deadline = (time.monotonic() if now is None else now) + self.timeout
+        with self.condition:
+            self.deadlines[device_id] = deadline
+            if device_id not in self.scheduled:
+                self.scheduled.add(device_id)
+                heapq.heappush(self.heap, (deadline, device_id))
+                # 新的最早截止时间，唤醒等待中的监控线程
+                if self.heap[0][1] == device_id:
+                    self.condition.notify()
+
+    def touch_many(self, device_ids, now=None):
+        """一批设备同时有活动（UDP 心跳），只加一次锁"""
+        deadline = (time.monotonic() if now is None else now) + self.timeout
+        with self.condition:
+            deadlines = self.deadlines
+            scheduled = self.scheduled
+            pushed = False
+            for device_id in device_ids:
+                deadlines[device_id] = deadline
+                if device_id not in scheduled:
+                    scheduled.add(device_id)
+                    heapq.heappush(self.heap, (deadline, device_id))
+                    pushed = True
+            if pushed:
+                self.condition.notify()
+
+    def remove(self, device_id):
+        """不再跟踪该设备（堆中的记录在弹出时丢弃）"""
+        with self.condition:
+            self.deadlines.pop(device_id, None)
+
+    def set_timeout(self, timeout):
+        """修改超时时间，已跟踪设备的截止时间按新的超时时间重新计算（最后活动时间 + timeout）"""
+        with self.condition:
+            delta = timeout - self.timeout
+            self.timeout = timeout
+            if delta:
+                self.deadlines = {device_id: deadline + delta for device_id, deadline in self.deadlines.items()}
+                self.heap = [(deadline, device_id) for device_id, deadline in self.deadlines.items()]
+                heapq.heapify(self.heap)
+                self.scheduled = set(self.deadlines)
+            self.condition.notify()
+
+    def pop_expired(self, now=None):
+        """弹出所有已过截止时间的设备，返回 [(device_id, 截止时间)]"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.condition:
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                deadline, device_id = heapq.heappop(heap)
+                current = self.deadlines.get(device_id)
+                if current is None:
+                    # 已移除
+                    self.scheduled.discard(device_id)
+                elif current > now:
+                    # 期间有心跳，按新的截止时间重新入堆
+                    heapq.heappush(heap, (current, device_id))
+                else:
+                    self.scheduled.discard(device_id)
+                    del self.deadlines[device_id]
+                    expired.append((device_id, current))
+        return expired
+
+    def next_deadline(self):
+        with self.condition:
+            return self.heap[0][0] if self.heap else None
+
+    def wait_expired(self, max_wait, should_stop=None):
+        """等待直到有设备过期或经过 max_wait 秒，返回过期设备列表"""
+        end = time.monotonic() + max_wait
+        while True:
+            expired = self.pop_expired()
+            if expired:
+                return expired
+            if should_stop is not None and should_stop():
+                return []
+            now = time.monotonic()
+            if now >= end:
+                return []
+            with self.condition:
+                wait = end - now
+                if self.heap:
+                    wait = min(wait, max(self.heap[0][0] - now, 0))
+                self.condition.wait(wait)
+
+    def wake(self):
+        """唤醒等待中的线程（停止服务器时使用）"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.deadlines)
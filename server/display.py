@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像显示
+处理线程只把每个设备的最新一帧放入该设备的单格信箱（覆盖未显示的旧帧），
+由唯一的显示线程按固定的最高刷新率把所有设备拼接成一个窗口显示。
+
+- 所有 HighGUI 调用（imshow/waitKey/destroyAllWindows）都在显示线程中执行
+- 处理线程放入信箱只是一次赋值，不会被显示速度拖慢
+- 被覆盖的帧不解码；JPEG 按格子大小缩小解码（见 jpeg_decoder）
+- 超过 stale_seconds 没有新画面的格子变暗并标注
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from jpeg_decoder import DECODER_OPENCV, DecodedFrame, get_decoder
+
+DISPLAY_WINDOW_NAME = 'Motion Monitor'
+
+def display_available():
+    """是否有图形界面：Linux 下没有 DISPLAY 时 HighGUI(Qt) 会直接终止进程，只能事先检查"""
+    if sys.platform.startswith('linux'):
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True
+
+def parse_tile_size(text, default=(320, 240)):
+    """解析 '宽x高'，格式错误时返回默认值"""
+    try:
+        width, height = (int(value) for value in text.lower().split('x'))
+    except (AttributeError, ValueError):
+        return default
+    if width <= 0 or height <= 0:
+        return default
+    return width, height
+
+def decode_for_tile(jpeg_data, tile_width, tile_height, decoder=None):
+    """解码JPEG，在不小于格子尺寸的前提下尽量缩小解码"""
+    return DecodedFrame(jpeg_data, decoder or get_decoder(DECODER_OPENCV)).get_fitting(tile_width, tile_height)
+
+def fit_to_tile(frame, tile_width, tile_height):
+    """等比缩放到格子内，空白处填黑"""
+    tile = np.zeros((tile_height, tile_width, 3), np.uint8)
+    height, width = frame.shape[:2]
+    scale = min(tile_width / width, tile_height / height)
+    new_width, new_height = max(1, int(width * scale)), max(1, int(height * scale))
+    resized = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    if resized.ndim == 2:
+        resized = cv2.cvtColor(resized, cv2.COLOR_GRAY2BGR)
+    top = (tile_height - new_height) // 2
+    left = (tile_width - new_width) // 2
+    tile[top:top + new_height, left:left + new_width] = resized
+    return tile
+
+class DisplaySlot:
+    """一个设备的单格信箱和当前显示的格子"""
+    __slots__ = ('device_id', 'label', 'jpeg', 'frame', 'updated', 'tile', 'posted', 'skipped')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.label = ''
+        self.jpeg = None      # 尚未显示的最新一帧（JPEG数据或已解码的图像二选一）
+        self.frame = None
+        self.updated = 0.0    # 最近一次放入新帧的单调时钟时间
+        self.tile = None      # 已渲染的格子图像
+        self.posted = 0
+        self.skipped = 0      # 未显示就被覆盖的帧数
+
+class MosaicDisplay:
+    """单线程的多设备拼接显示"""
+
+    def __init__(self, max_fps=10, tile_size=(320, 240), max_tiles=16, stale_seconds=5.0,
+                 window_name=DISPLAY_WINDOW_NAME, decoder=None, show=None, on_render=None, log=None):
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.tile_width, self.tile_height = tile_size
+        self.max_tiles = max_tiles
+        self.stale_seconds = stale_seconds
+        self.window_name = window_name
+        self.decoder = decoder or get_decoder(DECODER_OPENCV)
+        # show(mosaic, wait_ms) 显示后等待 wait_ms 毫秒，默认为 imshow + waitKey，测试时可替换
+        self.show = show or self.show_window
+        self.on_render = on_render  # on_render(秒) 记录每次解码和拼接的耗时
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.slots = {}  # device_id -> DisplaySlot
+        self.rendered = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.render_loop, name='display', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def post_jpeg(self, device_id, jpeg_data, label=''):
+        """放入设备最新的JPEG数据（复制，调用方可以立即复用缓冲区）"""
+        if self.running:
+            self.post(device_id, bytes(jpeg_data), None, label)
+
+    def post_frame(self, device_id, frame, label=''):
+        """放入设备最新的已解码图像（不复制，调用方之后不能再修改该图像）"""
+        self.post(device_id, None, frame, label)
+
+    def post(self, device_id, jpeg, frame, label):
+        if not self.running:
+            return
+        with self.lock:
+            slot = self.slots.get(device_id)
+            if slot is None:
+                slot = self.slots[device_id] = DisplaySlot(device_id)
+            if slot.jpeg is not None or slot.frame is not None:
+                slot.skipped += 1
+            slot.jpeg = jpeg
+            slot.frame = frame
+            slot.label = label
+            slot.updated = time.monotonic()
+            slot.posted += 1
+
+    def take_updates(self):
+        """取出各信箱中待显示的帧，返回 (按最近更新排序的显示设备, [(slot, jpeg, frame)])"""
+        with self.lock:
+            slots = sorted(self.slots.values(), key=lambda slot: slot.updated, reverse=True)[:self.max_tiles]
+            updates = []
+            for slot in slots:
+                if slot.jpeg is not None or slot.frame is not None:
+                    updates.append((slot, slot.jpeg, slot.frame))
+                    slot.jpeg = slot.frame = None
+        return sorted(slots, key=lambda slot: slot.device_id), updates
+
+    def render(self):
+        """生成拼接图像，没有任何设备时返回 None"""
+        slots, updates = self.take_updates()
+        if not slots:
+            return None
+
+        for slot, jpeg, frame in updates:
+            if jpeg is not None:
+                frame = decode_for_tile(jpeg, self.tile_width, self.tile_height, self.decoder)
+                if frame is None:
+                    continue
+            slot.tile = fit_to_tile(frame, self.tile_width, self.tile_height)
+
+        columns = math.ceil(math.sqrt(len(slots)))
+        rows = math.ceil(len(slots) / columns)
+        mosaic = np.zeros((rows * self.tile_height, columns * self.tile_width, 3), np.uint8)
+        now = time.monotonic()
+        for index, slot in enumerate(slots):
+            top = (index // columns) * self.tile_height
+            left = (index % columns) * self.tile_width
+            view = mosaic[top:top + self.tile_height, left:left + self.tile_width]
+            if slot.tile is not None:
+                view[:] = slot.tile
+            age = now - slot.updated
+            if age > self.stale_seconds:
+                view //= 3
+                cv2.putText(view, f"NO FRAME {int(age)}s", (8, self.tile_height - 12),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
+            # HighGUI 的字体不支持中文，标签只用ASCII
+            cv2.putText(view, f"#{slot.device_id} {slot.label}", (8, 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
+            cv2.rectangle(view, (0, 0), (self.tile_width - 1, self.tile_height - 1), (64, 64, 64), 1)
+        return mosaic
+
+    def show_window(self, mosaic, wait_ms):
+        if mosaic is not None:
+            cv2.imshow(self.window_name, mosaic)
+        # waitKey 同时处理窗口事件并等待到下一次刷新
+        cv2.waitKey(max(1, wait_ms))
+
+    def render_loop(self):
+        try:
+            while self.running:
+                started = time.monotonic()
+                mosaic = self.render()
+                if mosaic is not None:
+                    self.rendered += 1
+                    if self.on_render:
+                        self.on_render(time.monotonic() - started)
+                wait_ms = int((self.interval - (time.monotonic() - started)) * 1000)
+                self.show(mosaic, wait_ms)
+        except Exception as e:
+            # 常见原因是没有图形界面；显示停止后处理线程照常放入信箱，不受影响
+            self.running = False
+            if self.log:
+                self.log.error('display', f"图像显示已停止: {e}")
+        finally:
+            if self.show == self.show_window:
+                try:
+                    cv2.destroyAllWindows()
+                except cv2.error:
+                    pass
+
+    def get_stats(self):
+        """返回每个设备放入和被覆盖的帧数"""
+        with self.lock:
+            return {device_id: {'posted': slot.posted, 'skipped': slot.skipped}
+                    for device_id, slot in self.slots.items()}
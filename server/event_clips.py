@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运动事件视频片段
+设备在画面变化期间连续发送图像，一次30秒的事件就会产生数百个JPEG文件。
+按设备把相邻间隔不超过 gap 秒的图像归为一个事件，由后台线程池解码并用
+cv2.VideoWriter 编码为一个视频片段，同时保存一张代表帧和一条事件索引记录。
+
+- 接收线程只把JPEG追加到设备当前事件的待编码批次，从不等待编码
+- 每攒够 CLIP_BATCH_FRAMES 帧加入事件的任务队列，每个事件同时最多占用一个后台线程，
+  批次和收尾按加入的顺序执行，不同事件的编码并行
+- 待编码的帧超过 max_pending_frames 时丢弃新帧并计数，编码跟不上时内存也有上限
+- 事件结束（超过 gap 秒没有新帧、时长超过 max_seconds 或服务器停止）后关闭视频，
+  写入代表帧（事件中最大的一帧JPEG，通常是画面内容最多的一帧）和索引记录
+
+目录结构:
+    <save_dir>/device_<id>/event_<起始微秒时间戳>.mp4   视频片段（扩展名取决于编码器）
+    <save_dir>/device_<id>/event_<起始微秒时间戳>.jpg   代表帧（原始JPEG）
+    <save_dir>/device_<id>/events.idx                   事件索引
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from jpeg_decoder import DECODER_OPENCV, get_decoder
+from segment_store import to_microseconds
+
+# 事件索引记录：起始/结束时间(微秒, int64)、帧数(uint32)、视频字节数(uint64)，小端，共28字节
+# 记录在事件编码完成后追加，不同事件的完成顺序可能与开始顺序不同，读取时按起始时间排序
+EVENT_INDEX_DTYPE = np.dtype([('start', '<i8'), ('end', '<i8'), ('frames', '<u4'), ('bytes', '<u8')])
+EVENT_INDEX_NAME = 'events.idx'
+
+CLIP_NAME_PATTERN = re.compile(r'^event_(\d+)\.(mp4|avi)$')
+
+# opencv-python 自带的 FFmpeg 支持的编码器 -> 文件扩展名
+CODEC_EXTENSIONS = {
+    'mp4v': '.mp4',   # MPEG-4 Part 2，体积约为 MJPG 的 1/7
+    'XVID': '.avi',
+    'MJPG': '.avi',   # 每帧独立的JPEG，体积与单独保存图像相近
+}
+DEFAULT_CODEC = 'mp4v'
+
+# 每批提交给后台编码的帧数
+CLIP_BATCH_FRAMES = 15
+
+# 无法从时间戳估计帧率时使用的帧率，以及估计帧率的范围
+DEFAULT_CLIP_FPS = 10.0
+MIN_CLIP_FPS = 1.0
+MAX_CLIP_FPS = 60.0
+
+def read_event_index(device_dir):
+    """读取设备的事件索引，按起始时间排序，忽略写入中断留下的半条记录"""
+    path = os.path.join(device_dir, EVENT_INDEX_NAME)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return np.zeros(0, dtype=EVENT_INDEX_DTYPE)
+    count = len(data) // EVENT_INDEX_DTYPE.itemsize
+    index = np.frombuffer(data[:count * EVENT_INDEX_DTYPE.itemsize], dtype=EVENT_INDEX_DTYPE)
+    return np.sort(index, order='start')
+
+class MotionEvent:
+    """一个设备正在进行的事件"""
+    __slots__ = ('device_id', 'device_dir', 'start_us', 'last_us', 'clip_path', 'keyframe_path',
+                 'pending', 'frames', 'dropped', 'keyframe', 'writer', 'size', 'fps', 'written',
+                 'tasks', 'scheduled')
+
+    def __init__(self, device_dir, device_id, start_us, extension):
+        self.device_id = device_id
+        self.device_dir = device_dir
+        self.start_us = start_us
+        self.last_us = start_us
+        self.clip_path = os.path.join(device_dir, f"event_{start_us}{extension}")
+        self.keyframe_path = os.path.join(device_dir, f"event_{start_us}.jpg")
+        self.pending = []      # 待提交的 [(微秒时间戳, JPEG)]
+        self.frames = 0        # 加入事件的帧数（不含丢弃的帧）
+        self.dropped = 0
+        self.keyframe = b''
+        self.writer = None     # 以下只由正在执行该事件任务的后台线程使用
+        self.size = None
+        self.fps = None
+        self.written = 0
+        self.tasks = deque()   # 待执行的 (批次, 是否收尾)，在 EventClipBuilder.lock 内修改
+        self.scheduled = False  # 是否已有后台线程在执行该事件的任务
+
+class DeviceClipStats:
+    __slots__ = ('events', 'frames', 'dropped', 'bytes')
+
+    def __init__(self):
+        self.events = 0    # 已完成的事件数
+        self.frames = 0    # 写入视频的帧数
+        self.dropped = 0   # 编码积压而丢弃的帧数
+        self.bytes = 0     # 视频片段总字节数
+
+class EventClipBuilder:
+    """按设备聚合运动事件并在后台编码为视频片段"""
+
+    def __init__(self, root_dir, gap=2.0, max_seconds=300, codec=DEFAULT_CODEC, fps=0, workers=2,
+                 max_pending_frames=1000, decoder=None, on_encode=None, on_clip=None, log=None):
+        self.root_dir = root_dir
+        self.gap_us = int(gap * 1_000_000)
+        self.max_us = int(max_seconds * 1_000_000)
+        self.codec = codec if codec in CODEC_EXTENSIONS else DEFAULT_CODEC
+        self.fps = fps                      # 0 表示按事件中帧的时间间隔估计
+        self.workers = max(1, workers)
+        self.max_pending_frames = max_pending_frames
+        self.decoder = decoder or get_decoder(DECODER_OPENCV)
+        self.on_encode = on_encode          # on_encode(秒) 记录每批编码的耗时
+        self.on_clip = on_clip              # on_clip(事件, 视频字节数) 在事件写入索引后调用
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.events = {}       # device_id -> 进行中的 MotionEvent
+        self.last_start = {}   # device_id -> 上一个事件的起始时间，保证起始时间（文件名）递增
+        self.stats = {}        # device_id -> DeviceClipStats
+        self.pending_frames = 0
+        self.executor = None
+        self.flush_thread = None
+        self.stopped = threading.Event()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='clip')
+        self.stopped.clear()
+        self.flush_thread = threading.Thread(target=self.flush_loop, name='clip-flush', daemon=True)
+        self.flush_thread.start()
+
+    def stop(self):
+        """结束所有进行中的事件，等待编码完成"""
+        self.stopped.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join(timeout=5)
+            self.flush_thread = None
+        with self.lock:
+            for event in list(self.events.values()):
+                self.close_event(event)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def device_dir(self, device_id):
+        return os.path.join(self.root_dir, f"device_{device_id}")
+
+    def stats_for(self, device_id):
+        stats = self.stats.get(device_id)
+        if stats is None:
+            stats = self.stats[device_id] = DeviceClipStats()
+        return stats
+
+    def add(self, device_id, jpeg_data, timestamp=None):
+        """加入一帧JPEG（复制），返回 (视频片段路径, 帧序号)，因编码积压被丢弃时返回 None"""
+        timestamp_us = to_microseconds(time.time() if timestamp is None else timestamp)
+        with self.lock:
+            if self.executor is None:
+                return None
+            event = self.events.get(device_id)
+            if event is not None and (timestamp_us - event.last_us > self.gap_us or
+                                      timestamp_us - event.start_us >= self.max_us):
+                self.close_event(event)
+                event = None
+            if event is None:
+                event = self.open_event(device_id, timestamp_us)
+            event.last_us = max(event.last_us, timestamp_us)
+
+            if self.pending_frames >= self.max_pending_frames:
+                event.dropped += 1
+                self.stats_for(device_id).dropped += 1
+                return None
+            event.pending.append((event.last_us, bytes(jpeg_data)))
+            self.pending_frames += 1
+            event.frames += 1
+            if len(jpeg_data) > len(event.keyframe):
+                event.keyframe = event.pending[-1][1]
+            if len(event.pending) >= CLIP_BATCH_FRAMES:
+                batch, event.pending = event.pending, []
+                self.schedule(event, batch)
+            return event.clip_path, event.frames - 1
+
+    def open_event(self, device_id, start_us):
+        """在 self.lock 内调用"""
+        last_start = self.last_start.get(device_id)
+        if last_start is not None and start_us <= last_start:
+            start_us = last_start + 1
+        self.last_start[device_id] = start_us
+        device_dir = self.device_dir(device_id)
+        os.makedirs(device_dir, exist_ok=True)
+        event = self.events[device_id] = MotionEvent(device_dir, device_id, start_us, CODEC_EXTENSIONS[self.codec])
+        return event
+
+    def close_event(self, event):
+        """结束事件，剩余的帧和收尾交给后台（在 self.lock 内调用）"""
+        if self.events.get(event.device_id) is event:
+            del self.events[event.device_id]
+        batch, event.pending = event.pending, []
+        self.schedule(event, batch, final=True)
+
+    def schedule(self, event, batch, final=False):
+        """把一批帧加入事件的任务队列（在 self.lock 内调用）
+
+        线程池中的任务不保证按提交顺序执行，同一事件的任务由一个线程依次执行，
+        执行完后才允许再次提交，保证帧的顺序和收尾在所有批次之后
+        """
+        event.tasks.append((batch, final))
+        if not event.scheduled:
+            event.scheduled = True
+            self.executor.submit(self.run_tasks, event)
+
+    def run_tasks(self, event):
+        """后台线程：依次执行事件队列中的任务，直到队列为空"""
+        while True:
+            with self.lock:
+                if not event.tasks:
+                    event.scheduled = False
+                    return
+                batch, final = event.tasks.popleft()
+            try:
+                if final:
+                    self.finish(event, batch)
+                else:
+                    self.encode(event, batch)
+            except Exception as e:
+                if self.log:
+                    self.log.error('clip', f"保存视频片段失败: {e}", event.device_id)
+
+    def release(self, device_id):
+        """结束设备当前的事件（多进程模式下设备转到其他进程时调用）"""
+        with self.lock:
+            event = self.events.get(device_id)
+            if event is not None and self.executor is not None:
+                self.close_event(event)
+
+    def prune_index(self, device_id, clip_paths):
+        """视频片段已被删除（保留策略）后从事件索引中移除对应的记录"""
+        removed = {int(CLIP_NAME_PATTERN.match(os.path.basename(path)).group(1))
+                   for path in clip_paths if CLIP_NAME_PATTERN.match(os.path.basename(path))}
+        device_dir = self.device_dir(device_id)
+        with self.lock:
+            index = read_event_index(device_dir)
+            kept = index[~np.isin(index['start'], list(removed))]
+            if len(kept) == len(index):
+                return
+            # 写入临时文件后替换，中断时索引保持完整
+            path = os.path.join(device_dir, EVENT_INDEX_NAME)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(kept.tobytes())
+            os.replace(path + '.tmp', path)
+
+    def flush_loop(self):
+        """结束超过 gap 没有新帧的事件"""
+        interval = min(max(self.gap_us / 2_000_000, 0.1), 1.0)
+        while not self.stopped.wait(interval):
+            now_us = to_microseconds(time.time())
+            with self.lock:
+                for event in list(self.events.values()):
+                    if now_us - event.last_us > self.gap_us:
+                        self.close_event(event)
+
+    def encode(self, event, batch):
+        """后台线程：解码一批JPEG并写入事件的视频（由 run_tasks 按顺序调用）"""
+        started = time.monotonic()
+        try:
+            for timestamp_us, jpeg in batch:
+                frame = self.decoder.decode(jpeg)
+                if frame is None:
+                    continue
+                if event.writer is None:
+                    self.open_writer(event, frame, batch)
+                if (frame.shape[1], frame.shape[0]) != event.size:
+                    frame = cv2.resize(frame, event.size, interpolation=cv2.INTER_AREA)
+                event.writer.write(frame)
+                event.written += 1
+        except Exception as e:
+            if self.log:
+                self.log.error('clip', f"视频编码失败: {e}", event.device_id)
+        finally:
+            with self.lock:
+                self.pending_frames -= len(batch)
+        if self.on_encode and batch:
+            self.on_encode(time.monotonic() - started)
+
+    def open_writer(self, event, frame, batch):
+        fps = self.fps
+        if fps <= 0:
+            # 按第一批帧的时间间隔估计帧率
+            span = (batch[-1][0] - batch[0][0]) / 1_000_000
+            fps = (len(batch) - 1) / span if len(batch) > 1 and span > 0 else DEFAULT_CLIP_FPS
+        event.fps = min(max(fps, MIN_CLIP_FPS), MAX_CLIP_FPS)
+        event.size = (frame.shape[1], frame.shape[0])
+        event.writer = cv2.VideoWriter(event.clip_path, cv2.VideoWriter_fourcc(*self.codec), event.fps, event.size)
+        if not event.writer.isOpened():
+            raise RuntimeError(f"无法创建视频文件: {event.clip_path} ({self.codec})")
+
+    def finish(self, event, batch):
+        """后台线程：编码剩余的帧，关闭视频，写入代表帧和索引"""
+        self.encode(event, batch)
+        if event.writer is not None:
+            event.writer.release()
+            event.writer = None
+        if event.written == 0:
+            # 没有任何一帧能解码
+            if os.path.exists(event.clip_path):
+                os.remove(event.clip_path)
+            return
+        with open(event.keyframe_path, 'wb') as f:
+            f.write(event.keyframe)
+        clip_bytes = os.path.getsize(event.clip_path)
+        # 先写视频和代表帧再写索引，索引中的事件总是完整的
+        record = np.array([(event.start_us, event.last_us, event.written, clip_bytes)], dtype=EVENT_INDEX_DTYPE)
+        with self.lock:
+            with open(os.path.join(event.device_dir, EVENT_INDEX_NAME), 'ab') as f:
+                f.write(record.tobytes())
+            stats = self.stats_for(event.device_id)
+            stats.events += 1
+            stats.frames += event.written
+            stats.bytes += clip_bytes
+        if self.on_clip:
+            self.on_clip(event, clip_bytes + len(event.keyframe))
+        if self.log:
+            seconds = (event.last_us - event.start_us) / 1_000_000
+            self.log.info('event_clip', f"运动事件已保存: {event.clip_path}, {event.written}帧, {seconds:.1f}秒, "
+                          f"{clip_bytes / 1024:.0f} KB", event.device_id, path=event.clip_path,
+                          frames=event.written, seconds=round(seconds, 3), bytes=clip_bytes)
+
+    def get_stats(self):
+        """返回每个设备已完成的事件数、写入帧数、丢弃帧数和视频字节数"""
+        with self.lock:
+            return {device_id: {'events': stats.events, 'clip_frames': stats.frames,
+                                'clip_dropped': stats.dropped, 'clip_bytes': stats.bytes}
+                    for device_id, stats in self.stats.items()}
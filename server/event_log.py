@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器事件日志
+调用方只把记录放入有界队列，格式化和写入由后台线程批量完成，
+控制台/文件I/O不再占用连接线程和处理线程的时间。
+
+- 输出格式：text（可读文本）或 json（每行一个JSON对象）
+- 级别：debug / info / warning / error
+- 每个设备每个汇总周期最多输出 device_rate 条日志，超出部分只计数
+- 逐帧的"接收/保存"消息默认合并为每个设备的周期汇总
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+# 后台线程一次最多取出并写入的记录数
+WRITE_BATCH = 512
+
+# 逐帧输出时限流计数的周期（秒）
+DEFAULT_WINDOW = 10
+
+class FrameSummary:
+    """一个设备在当前汇总周期内的逐帧统计"""
+    __slots__ = ('frames', 'bytes', 'saved', 'suppressed')
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.saved = 0
+        self.suppressed = 0
+
+class EventLog:
+    """异步事件日志"""
+
+    def __init__(self, level=INFO, log_format=LOG_FORMAT_TEXT, stream=None,
+                 queue_size=10000, summary_interval=10, device_rate=5, source=None):
+        self.level = level
+        self.log_format = log_format
+        self.stream = stream or sys.stdout
+        self.source = source  # 多进程模式下标识输出日志的进程，如 worker-1
+        # summary_interval 为 0 时逐帧输出，限流周期使用 DEFAULT_WINDOW
+        self.per_frame = summary_interval <= 0
+        self.summary_interval = summary_interval if summary_interval > 0 else DEFAULT_WINDOW
+        self.device_rate = device_rate            # 0 表示不限制
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # 队列满时丢弃的记录数（多个调用方线程同时修改，由 dropped_lock 保护）
+        self.dropped_lock = threading.Lock()
+
+        # 当前汇总周期的设备统计（调用方线程写入，后台线程定期取走）
+        self.summary_lock = threading.Lock()
+        self.summaries = {}      # device_id -> FrameSummary
+        self.device_counts = {}  # device_id -> 本周期已输出条数
+        self.window_start = time.monotonic()
+
+        self.text_second = None
+        self.text_time = ''
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """写出队列中剩余的记录和最后一次汇总后停止后台线程"""
+        thread = self.thread
+        if thread is None:
+            return
+        self.thread = None
+        self.queue.put(None)
+        thread.join(timeout=5)
+
+    def log(self, level, event, message, device_id=None, **fields):
+        """记录一条日志，不在调用线程中做任何I/O"""
+        if level < self.level:
+            return
+        if device_id is not None and level < ERROR and not self.allow(device_id):
+            return
+        record = (time.time(), level, event, message, device_id, fields)
+        if self.thread is None:
+            # 后台线程未启动或已停止（启动前和关闭后），直接写出
+            self.write_records([record])
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def debug(self, event, message, device_id=None, **fields):
+        self.log(DEBUG, event, message, device_id, **fields)
+
+    def info(self, event, message, device_id=None, **fields):
+        self.log(INFO, event, message, device_id, **fields)
+
+    def warning(self, event, message, device_id=None, **fields):
+        self.log(WARNING, event, message, device_id, **fields)
+
+    def error(self, event, message, device_id=None, **fields):
+        self.log(ERROR, event, message, device_id, **fields)
+
+    def allow(self, device_id):
+        """每个设备每个汇总周期的限流，被抑制的条数计入汇总"""
+        if self.device_rate <= 0:
+            return True
+        with self.summary_lock:
+            count = self.device_counts.get(device_id, 0)
+            if count < self.device_rate:
+                self.device_counts[device_id] = count + 1
+                return True
+            summary = self.summaries.get(device_id)
+            if summary is None:
+                summary = self.summaries[device_id] = FrameSummary()
+            summary.suppressed += 1
+            return False
+
+    def frame(self, device_id, shape, data_length, saved_to=None):
+        """记录一帧图像的接收和保存
+
+        汇总模式下只累加计数，由后台线程按 summary_interval 输出每个设备的汇总
+        """
+        if self.per_frame:
+            self.info('frame_received', f"成功接收图像: {shape}, 大小: {data_length} 字节",
+                      device_id, shape=list(shape) if shape else None, bytes=data_length)
+            if saved_to:
+                self.info('frame_saved', f"图像已保存: {saved_to}", device_id, path=saved_to)
+            return
+        if self.level > INFO:
+            return
+        with self.summary_lock:
+            summary = self.summaries.get(device_id)
+            if summary is None:
+                summary = self.summaries[device_id] = FrameSummary()
+            summary.frames += 1
+            summary.bytes += data_length
+            if saved_to:
+                summary.saved += 1
+
+    def take_summaries(self):
+        """取走当前周期的统计并开始新周期，返回 (周期秒数, {device_id: FrameSummary})"""
+        now = time.monotonic()
+        with self.summary_lock:
+            summaries = self.summaries
+            self.summaries = {}
+            self.device_counts = {}
+            elapsed = now - self.window_start
+            self.window_start = now
+        return elapsed, summaries
+
+    def summary_records(self):
+        elapsed, summaries = self.take_summaries()
+        now = time.time()
+        records = []
+        for device_id, summary in sorted(summaries.items()):
+            parts = []
+            if summary.frames:
+                parts.append(f"接收{summary.frames}帧 ({summary.bytes / 1024:.1f} KB)")
+                parts.append(f"保存{summary.saved}帧")
+            if summary.suppressed:
+                parts.append(f"抑制日志{summary.suppressed}条")
+            records.append((now, INFO, 'frame_summary', f"最近{elapsed:.0f}秒: " + ", ".join(parts),
+                            device_id, {'interval': round(elapsed, 3), 'frames': summary.frames,
+                                        'bytes': summary.bytes, 'saved': summary.saved,
+                                        'suppressed': summary.suppressed}))
+        if self.dropped:
+            with self.dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            records.append((now, WARNING, 'log_dropped', f"日志队列已满，丢弃{dropped}条日志",
+                            None, {'dropped': dropped}))
+        return records
+
+    def writer_loop(self):
+        """后台线程：批量取出记录写入输出流，按周期输出汇总"""
+        interval = self.summary_interval
+        next_summary = time.monotonic() + interval
+        running = True
+        while running:
+            timeout = max(0.0, next_summary - time.monotonic())
+            records = []
+            try:
+                record = self.queue.get(timeout=timeout)
+                while True:
+                    if record is None:
+                        running = False
+                        break
+                    records.append(record)
+                    if len(records) >= WRITE_BATCH:
+                        break
+                    record = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            if not running or time.monotonic() >= next_summary:
+                records.extend(self.summary_records())
+                next_summary = time.monotonic() + interval
+            if records:
+                self.write_records(records)
+
+    def write_records(self, records):
+        format_record = self.format_json if self.log_format == LOG_FORMAT_JSON else self.format_text
+        try:
+            self.stream.write("".join(format_record(*record) for record in records))
+            self.stream.flush()
+        except (OSError, ValueError):
+            # 输出流已关闭（如管道另一端退出），不影响服务器运行
+            pass
+
+    def format_text(self, timestamp, level, event, message, device_id, fields):
+        second = int(timestamp)
+        if second != self.text_second:
+            # 同一秒内的记录共用格式化后的时间
+            self.text_second = second
+            self.text_time = datetime.fromtimestamp(second).strftime('%H:%M:%S')
+        prefix = self.text_time
+        if self.source:
+            prefix += f" [{self.source}]"
+        if level >= WARNING:
+            prefix += f" [{LEVEL_NAMES[level].upper()}]"
+        if device_id is not None:
+            prefix += f" [设备{device_id}]"
+        return f"{prefix} {message}\n"
+
+    def format_json(self, timestamp, level, event, message, device_id, fields):
+        record = {
+            'time': datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'),
+            'level': LEVEL_NAMES[level],
+            'event': event,
+        }
+        if self.source:
+            record['source'] = self.source
+        if device_id is not None:
+            record['device'] = device_id
+        record['msg'] = message
+        record.update(fields)
+        return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+def parse_level(name):
+    """解析日志级别名称，未知名称返回 None"""
+    return LEVELS.get(name.strip().lower())
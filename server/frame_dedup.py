@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相似帧检测（保存前去重）
+设备在画面持续变化期间发送每一帧，画面中有人静止不动时会产生大量几乎相同的图像。
+对每帧计算差值哈希（dHash），与该设备最近保留的若干帧比较汉明距离，
+距离不超过阈值的帧视为重复，不再保存。
+
+- 哈希只需要极小的灰度图：按 1/8 缩小解码后再缩放到 9x8，比较相邻像素得到64位
+- 每个设备保存最近 history 个保留帧的哈希（环形数组），一次向量化计算全部距离
+- keep_interval 秒内没有保留过帧时，即使重复也保留一帧，静止画面仍按固定间隔留档
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from jpeg_decoder import COLOR_GRAY
+
+# 哈希为 DHASH_SIZE x DHASH_SIZE 位
+DHASH_SIZE = 8
+
+# 计算哈希使用的解码缩小倍数和颜色（见 jpeg_decoder）
+DEDUP_DECODE_SCALE = 8
+DEDUP_DECODE_COLOR = COLOR_GRAY
+
+# 每个字节中为1的位数
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], np.uint8)
+
+def dhash(gray):
+    """计算灰度图的64位差值哈希"""
+    small = cv2.resize(gray, (DHASH_SIZE + 1, DHASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.uint64(np.packbits(bits).view('>u8')[0])
+
+def hamming_distances(value, hashes):
+    """value 与数组 hashes 中每个哈希的汉明距离"""
+    diff = np.bitwise_xor(hashes, value)
+    return POPCOUNT_TABLE[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class DeviceHashes:
+    """一个设备最近保留帧的哈希和去重统计"""
+    __slots__ = ('hashes', 'count', 'next', 'last_kept', 'kept', 'dropped', 'bytes_saved')
+
+    def __init__(self, history):
+        self.hashes = np.zeros(history, np.uint64)  # 环形数组
+        self.count = 0
+        self.next = 0
+        self.last_kept = 0.0
+        self.kept = 0
+        self.dropped = 0
+        self.bytes_saved = 0
+
+    def add(self, value, now):
+        self.hashes[self.next] = value
+        self.next = (self.next + 1) % len(self.hashes)
+        self.count = min(self.count + 1, len(self.hashes))
+        self.last_kept = now
+        self.kept += 1
+
+class FrameDeduplicator:
+    """按设备判断新帧是否与最近保留的帧重复"""
+
+    def __init__(self, threshold=2, history=8, keep_interval=10.0):
+        self.threshold = threshold
+        self.history = max(1, history)
+        self.keep_interval = keep_interval
+        self.lock = threading.Lock()
+        self.devices = {}  # device_id -> DeviceHashes
+
+    def check(self, device_id, gray, data_length, now=None):
+        """判断一帧是否需要保留，返回 True 表示保留；重复帧计入节省的写入次数和字节数"""
+        value = dhash(gray)
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                device = self.devices[device_id] = DeviceHashes(self.history)
+            if device.count and (self.keep_interval <= 0 or now - device.last_kept < self.keep_interval):
+                distances = hamming_distances(value, device.hashes[:device.count])
+                if distances.min() <= self.threshold:
+                    device.dropped += 1
+                    device.bytes_saved += data_length
+                    return False
+            device.add(value, now)
+            return True
+
+    def get_stats(self):
+        """返回每个设备保留和跳过的帧数、节省的字节数"""
+        with self.lock:
+            return {device_id: {'dedup_kept': device.kept, 'dedup_dropped': device.dropped,
+                                'dedup_bytes_saved': device.bytes_saved}
+                    for device_id, device in self.devices.items()}
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像处理流水线
+连接线程只负责把收到的JPEG数据放入有界队列，
+由独立的工作线程（或进程）完成解码和保存，避免慢磁盘拖慢网络接收
+"""
+
+import threading
+import time
+from collections import deque, OrderedDict
+
+import cv2
+
+from jpeg_decoder import DECODER_OPENCV, get_decoder
+
+# 队列满时的处理策略
+DROP_POLICY_DROP_OLDEST = 'drop_oldest'  # 丢弃该设备最早排队的帧
+DROP_POLICY_BLOCK = 'block'              # 阻塞连接线程，直到队列有空位（TCP反压）
+
+PIPELINE_EXECUTOR_THREAD = 'thread'
+PIPELINE_EXECUTOR_PROCESS = 'process'
+
+class BufferPool:
+    """可复用的接收缓冲区池
+
+    连接线程从池中取出缓冲区接收图像，缓冲区随任务进入队列，
+    工作线程处理完成后归还，稳定运行时每帧不再分配新的内存
+    """
+
+    def __init__(self, max_buffers):
+        self.max_buffers = max_buffers
+        self.buffers = []
+        self.lock = threading.Lock()
+
+    def acquire(self, size):
+        with self.lock:
+            for index, buffer in enumerate(self.buffers):
+                if len(buffer) >= size:
+                    return self.buffers.pop(index)
+        return bytearray(size)
+
+    def release(self, buffer):
+        if buffer is None or not isinstance(buffer, bytearray):
+            return
+        with self.lock:
+            if len(self.buffers) < self.max_buffers:
+                self.buffers.append(buffer)
+
+class FrameJob:
+    """一帧待处理的图像"""
+    __slots__ = ('device_id', 'client_address', 'buffer', 'length', 'enqueue_time')
+
+    def __init__(self, device_id, client_address, buffer, length):
+        self.device_id = device_id
+        self.client_address = client_address
+        self.buffer = buffer
+        self.length = length
+        self.enqueue_time = time.monotonic()
+
+    @property
+    def data(self):
+        """图像数据视图（不复制）"""
+        return memoryview(self.buffer)[:self.length]
+
+class DeviceQueueStats:
+    """单个设备的队列统计"""
+    __slots__ = ('depth', 'enqueued', 'processed', 'dropped')
+
+    def __init__(self):
+        self.depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def to_dict(self):
+        return {
+            'queue_depth': self.depth,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped
+        }
+
+class FramePipeline:
+    """有界的多设备帧队列 + 工作线程池
+
+    每个设备一个FIFO队列，工作线程按设备轮询取帧，
+    避免单个高帧率设备占满所有工作线程
+    """
+
+    def __init__(self, handler, workers=2, queue_size=64, device_queue_size=8,
+                 drop_policy=DROP_POLICY_DROP_OLDEST, buffer_pool=None, on_release=None, log=None):
+        self.handler = handler
+        self.workers = workers
+        # 队列上限为 0 时 is_full 恒为真，block 策略会永远等待，drop_oldest 会丢弃每一帧
+        self.queue_size = max(1, queue_size)
+        self.device_queue_size = max(1, device_queue_size)
+        self.drop_policy = drop_policy
+        self.buffer_pool = buffer_pool
+        self.on_release = on_release  # on_release(length) 在一帧处理完成或被丢弃后调用
+        self.log = log                # EventLog，处理出错时记录
+
+        self.queues = OrderedDict()  # device_id -> deque[FrameJob]，顺序即轮询顺序
+        self.stats = {}              # device_id -> DeviceQueueStats
+        self.total_depth = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, name=f"frame-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=2.0):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def device_stats(self, device_id):
+        stats = self.stats.get(device_id)
+        if stats is None:
+            stats = self.stats[device_id] = DeviceQueueStats()
+        return stats
+
+    def submit(self, device_id, client_address, buffer, length):
+        """放入一帧图像，返回 False 表示该帧被丢弃"""
+        job = FrameJob(device_id, client_address, buffer, length)
+        dropped_job = None
+
+        with self.condition:
+            stats = self.device_stats(device_id)
+            device_queue = self.queues.get(device_id)
+            if device_queue is None:
+                device_queue = self.queues[device_id] = deque()
+
+            if self.drop_policy == DROP_POLICY_BLOCK:
+                while self.running and self.is_full(device_queue):
+                    self.condition.wait()
+                if not self.running:
+                    stats.dropped += 1
+                    dropped_job = job
+                    job = None
+            elif self.is_full(device_queue):
+                if device_queue:
+                    # 丢弃该设备最早的帧，保留最新画面
+                    dropped_job = device_queue.popleft()
+                    self.total_depth -= 1
+                    stats.depth -= 1
+                else:
+                    # 队列被其他设备占满，本设备没有可丢弃的旧帧，只能丢弃新帧
+                    dropped_job = job
+                    job = None
+                stats.dropped += 1
+
+            if job is not None:
+                device_queue.append(job)
+                self.total_depth += 1
+                stats.depth += 1
+                stats.enqueued += 1
+                self.condition.notify()
+
+        if dropped_job is not None:
+            self.release(dropped_job)
+        return job is not None
+
+    def is_full(self, device_queue):
+        return len(device_queue) >= self.device_queue_size or self.total_depth >= self.queue_size
+
+    def take(self):
+        """按设备轮询取出一帧，队列为空时等待"""
+        with self.condition:
+            while self.running and self.total_depth == 0:
+                self.condition.wait()
+            if not self.running:
+                return None
+
+            for device_id, device_queue in self.queues.items():
+                if device_queue:
+                    job = device_queue.popleft()
+                    # 将该设备移到轮询顺序末尾
+                    self.queues.move_to_end(device_id)
+                    self.total_depth -= 1
+                    self.stats[device_id].depth -= 1
+                    # 通知可能阻塞在 submit 上的连接线程
+                    self.condition.notify_all()
+                    return job
+        return None
+
+    def worker_loop(self):
+        while self.running:
+            job = self.take()
+            if job is None:
+                continue
+            try:
+                self.handler(job)
+            except Exception as e:
+                if self.log is not None:
+                    self.log.error('process_error', f"处理图像时出错: {e}", job.device_id)
+                else:
+                    print(f"[设备{job.device_id}] 处理图像时出错: {e}")
+            finally:
+                with self.condition:
+                    self.stats[job.device_id].processed += 1
+                self.release(job)
+
+    def release(self, job):
+        """归还一帧的缓冲区"""
+        if self.buffer_pool:
+            self.buffer_pool.release(job.buffer)
+        if self.on_release:
+            self.on_release(job.length)
+
+    def get_stats(self):
+        """返回每个设备的队列深度、入队、处理和丢弃计数"""
+        with self.condition:
+            return {device_id: stats.to_dict() for device_id, stats in self.stats.items()}
+
+def decode_and_save(image_data, filename, return_frame, return_encoded=False, decoder=DECODER_OPENCV):
+    """在工作进程中解码并保存图像
+
+    返回 (shape, frame, encoded)，frame 仅在 return_frame 为 True 时返回，
+    encoded 为重新编码后的JPEG数据，仅在 return_encoded 为 True 时返回（用于分段存储），
+    decoder 为解码后端名称（每个工作进程创建一次），
+    解码失败时返回 (None, None, None)
+    """
+    frame = get_decoder(decoder).decode(image_data)
+    if frame is None:
+        return None, None, None
+    if filename:
+        cv2.imwrite(filename, frame)
+    encoded = cv2.imencode('.jpg', frame)[1].tobytes() if return_encoded else None
+    return frame.shape, (frame if return_frame else None), encoded
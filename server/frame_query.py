@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储图像的时间范围查询与回放
+基于分段存储的时间索引，按设备和时间窗口惰性地返回图像，
+查询开销只与结果大小相关，与存档总量无关
+
+用法:
+    python server/frame_query.py devices
+    python server/frame_query.py count 1 --start "2024-01-01 08:00:00" --end "2024-01-01 09:00:00"
+    python server/frame_query.py export 1 --start "2024-01-01 08:00:00" --step 15 --out exported
+    python server/frame_query.py replay 1 --start "2024-01-01 08:00:00" --speed 4
+"""
+
+import argparse
+import configparser
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from segment_store import SegmentStore
+
+StoredFrame = namedtuple('StoredFrame', ['device_id', 'timestamp', 'data'])
+
+class FrameQuery:
+    """分段存储之上的查询接口"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def count(self, device_id, start=None, end=None):
+        """统计时间范围内的帧数（只读索引）"""
+        return sum(len(records) for _, records in self.store.find(device_id, start, end))
+
+    def frames(self, device_id, start=None, end=None, step=1, offset=0, limit=None, decode=False):
+        """按时间顺序惰性返回 StoredFrame
+
+        step: 每隔 step 帧取一帧
+        offset/limit: 在采样后的结果中跳过 offset 帧，最多返回 limit 帧
+        decode: 为 True 时 data 为解码后的图像数组，否则为原始JPEG数据
+        """
+        if step < 1:
+            raise ValueError("step 必须大于等于1")
+
+        position = 0           # 当前段之前已经经过的帧数（采样前）
+        skip = offset * step   # 需要跳过的原始帧数
+        remaining = limit
+
+        for segment, records in self.store.find(device_id, start, end):
+            count = len(records)
+            # 第一个满足采样条件且不在跳过范围内的位置
+            first = max(skip - position, (-position) % step)
+            if first >= count:
+                position += count
+                continue
+
+            selected = records[first::step]
+            if remaining is not None:
+                selected = selected[:remaining]
+
+            with open(segment.data_path, 'rb') as data_file:
+                for record in selected:
+                    data_file.seek(int(record['offset']))
+                    data = data_file.read(int(record['length']))
+                    if decode:
+                        data = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                    yield StoredFrame(device_id, record['timestamp'] / 1_000_000, data)
+
+            if remaining is not None:
+                remaining -= len(selected)
+                if remaining <= 0:
+                    return
+            position += count
+
+    def page(self, device_id, start=None, end=None, page=0, page_size=100, step=1, decode=False):
+        """分页查询，返回第 page 页（从0开始）的帧列表"""
+        return list(self.frames(device_id, start, end, step=step,
+                                offset=page * page_size, limit=page_size, decode=decode))
+
+    def seek(self, device_id, timestamp, decode=False):
+        """返回时间戳处或之后的第一帧，不存在时返回 None"""
+        return next(self.frames(device_id, start=timestamp, limit=1, decode=decode), None)
+
+    def replay(self, device_id, start=None, end=None, speed=1.0, step=1, decode=True):
+        """按原始时间间隔（可加速）回放，返回 StoredFrame 生成器"""
+        first_timestamp = None
+        started = time.monotonic()
+        for frame in self.frames(device_id, start, end, step=step, decode=decode):
+            if first_timestamp is None:
+                first_timestamp = frame.timestamp
+            delay = (frame.timestamp - first_timestamp) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            yield frame
+
+def parse_time(value):
+    """解析时间参数，支持 Unix 时间戳或 "YYYY-mm-dd HH:MM:SS" 本地时间"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"无法识别的时间: {value}")
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def load_save_dir(config_file):
+    config = configparser.ConfigParser()
+    if os.path.exists(config_file):
+        config.read(config_file, encoding='utf-8')
+    return config.get('server', 'save_dir', fallback='received_images')
+
+def main():
+    parser = argparse.ArgumentParser(description="查询和回放分段存储中的图像")
+    parser.add_argument('--config', default='config/server_config.ini', help="服务器配置文件（读取 save_dir）")
+    parser.add_argument('--save-dir', help="存储目录，优先于配置文件")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('devices', help="列出存储中的设备")
+
+    def add_range_arguments(sub):
+        sub.add_argument('device_id', type=int)
+        sub.add_argument('--start', type=parse_time, help="起始时间（包含）")
+        sub.add_argument('--end', type=parse_time, help="结束时间（不包含）")
+        sub.add_argument('--step', type=int, default=1, help="每隔N帧取一帧")
+
+    count_parser = subparsers.add_parser('count', help="统计时间范围内的帧数")
+    add_range_arguments(count_parser)
+
+    list_parser = subparsers.add_parser('list', help="分页列出帧的时间和大小")
+    add_range_arguments(list_parser)
+    list_parser.add_argument('--page', type=int, default=0)
+    list_parser.add_argument('--page-size', type=int, default=50)
+
+    export_parser = subparsers.add_parser('export', help="导出为JPEG文件")
+    add_range_arguments(export_parser)
+    export_parser.add_argument('--limit', type=int)
+    export_parser.add_argument('--out', default='exported_images')
+
+    replay_parser = subparsers.add_parser('replay', help="在窗口中按时间回放")
+    add_range_arguments(replay_parser)
+    replay_parser.add_argument('--speed', type=float, default=1.0, help="回放倍速")
+
+    args = parser.parse_args()
+    store = SegmentStore(args.save_dir or load_save_dir(args.config))
+    query = FrameQuery(store)
+
+    if args.command == 'devices':
+        for device_id in store.list_devices():
+            print(f"设备{device_id}: {len(store.segments(device_id))}个段文件, {query.count(device_id)}帧")
+        return 0
+
+    if args.command == 'count':
+        if args.step == 1:
+            print(query.count(args.device_id, args.start, args.end))
+        else:
+            total = query.count(args.device_id, args.start, args.end)
+            print((total + args.step - 1) // args.step)
+        return 0
+
+    if args.command == 'list':
+        for frame in query.page(args.device_id, args.start, args.end, page=args.page,
+                                page_size=args.page_size, step=args.step):
+            print(f"{format_time(frame.timestamp)}  {len(frame.data)} 字节")
+        return 0
+
+    if args.command == 'export':
+        os.makedirs(args.out, exist_ok=True)
+        count = 0
+        for frame in query.frames(args.device_id, args.start, args.end, step=args.step, limit=args.limit):
+            name = datetime.fromtimestamp(frame.timestamp).strftime("%Y%m%d_%H%M%S_%f")
+            with open(os.path.join(args.out, f"motion_{name}.jpg"), 'wb') as f:
+                f.write(frame.data)
+            count += 1
+        print(f"[OK] 导出 {count} 帧到 {args.out}")
+        return 0
+
+    if args.command == 'replay':
+        window_name = f"回放 设备{args.device_id}"
+        for frame in query.replay(args.device_id, args.start, args.end, speed=args.speed, step=args.step):
+            if frame.data is None:
+                continue
+            cv2.imshow(window_name, frame.data)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+        cv2.destroyAllWindows()
+        return 0
+
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPEG 解码
+不同的使用方需要的分辨率和颜色不同（保存需要原图，拼接显示只需要缩略图，
+相似帧检测只需要很小的灰度图）。JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小（DCT缩放），
+比先完整解码再缩小快得多。
+
+- 解码后端：OpenCV（IMREAD_REDUCED_* / IMREAD_GRAYSCALE），
+  或安装了 PyTurboJPEG 时使用 libjpeg-turbo
+- DecodedFrame：同一帧的多次解码请求共享结果，较小的尺寸和灰度图优先由已有结果转换得到
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+from jpeg_utils import read_jpeg_shape
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY
+except ImportError:
+    TurboJPEG = None
+
+DECODER_AUTO = 'auto'            # 已安装 PyTurboJPEG 时使用 turbojpeg，否则使用 opencv
+DECODER_OPENCV = 'opencv'
+DECODER_TURBOJPEG = 'turbojpeg'
+
+COLOR_BGR = 'bgr'
+COLOR_GRAY = 'gray'
+
+# 支持的缩小倍数（解码尺寸为原图的 1/scale）
+SCALES = (1, 2, 4, 8)
+
+OPENCV_FLAGS = {
+    (1, COLOR_BGR): cv2.IMREAD_COLOR,
+    (2, COLOR_BGR): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, COLOR_BGR): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, COLOR_BGR): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, COLOR_GRAY): cv2.IMREAD_GRAYSCALE,
+    (2, COLOR_GRAY): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, COLOR_GRAY): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, COLOR_GRAY): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+class OpenCVDecoder:
+    name = DECODER_OPENCV
+
+    def decode(self, data, scale=1, color=COLOR_BGR):
+        """解码为 1/scale 尺寸的图像，失败时返回 None"""
+        return cv2.imdecode(np.frombuffer(data, np.uint8), OPENCV_FLAGS[(scale, color)])
+
+class TurboJPEGDecoder:
+    name = DECODER_TURBOJPEG
+
+    def __init__(self):
+        self.jpeg = TurboJPEG()  # 找不到 libjpeg-turbo 时抛出异常
+
+    def decode(self, data, scale=1, color=COLOR_BGR):
+        pixel_format = TJPF_GRAY if color == COLOR_GRAY else TJPF_BGR
+        try:
+            frame = self.jpeg.decode(bytes(data), pixel_format=pixel_format, scaling_factor=(1, scale))
+        except (OSError, ValueError):
+            return None
+        # 与 OpenCV 保持一致：灰度图为二维数组
+        return frame[:, :, 0] if color == COLOR_GRAY and frame.ndim == 3 else frame
+
+def turbojpeg_available():
+    if TurboJPEG is None:
+        return False
+    try:
+        TurboJPEG()
+    except (OSError, RuntimeError):
+        return False
+    return True
+
+def create_decoder(name=DECODER_AUTO):
+    """按名称创建解码后端，返回 (后端, 警告信息或 None)；turbojpeg 不可用时退回 opencv"""
+    name = (name or DECODER_AUTO).strip().lower()
+    if name in (DECODER_AUTO, DECODER_TURBOJPEG):
+        if turbojpeg_available():
+            return TurboJPEGDecoder(), None
+        if name == DECODER_TURBOJPEG:
+            return OpenCVDecoder(), "未安装 PyTurboJPEG 或 libjpeg-turbo，使用 opencv 解码"
+        return OpenCVDecoder(), None
+    if name != DECODER_OPENCV:
+        return OpenCVDecoder(), f"未知的解码器: {name}，使用 {DECODER_OPENCV}"
+    return OpenCVDecoder(), None
+
+# 每个进程缓存一个后端实例（进程池工作进程中使用）
+_decoders = {}
+_decoders_lock = threading.Lock()
+
+def get_decoder(name=DECODER_AUTO):
+    with _decoders_lock:
+        decoder = _decoders.get(name)
+        if decoder is None:
+            decoder = _decoders[name] = create_decoder(name)[0]
+        return decoder
+
+def choose_scale(shape, width, height):
+    """在解码结果不小于 width x height 的前提下选择最大的缩小倍数，shape 为 (高, 宽, ...) 或 None"""
+    if shape is None:
+        return 1
+    for scale in reversed(SCALES):
+        if shape[1] // scale >= width and shape[0] // scale >= height:
+            return scale
+    return 1
+
+class DecodedFrame:
+    """一帧JPEG的共享解码结果
+
+    get(scale, color) 依次尝试：已有的相同结果；由更大的已有结果缩小/转灰度；重新解码。
+    同一帧的使用方（保存、显示、相似帧检测等）传递同一个对象即可共享解码
+    """
+    __slots__ = ('data', 'decoder', 'results', 'decode_count', 'failed', 'lock')
+
+    def __init__(self, data, decoder):
+        self.data = data
+        self.decoder = decoder
+        self.results = {}   # (scale, color) -> 图像
+        self.decode_count = 0
+        self.failed = False  # 数据无法解码，之后的请求直接返回 None
+        self.lock = threading.Lock()
+
+    def get(self, scale=1, color=COLOR_BGR):
+        """返回 1/scale 尺寸的图像，解码失败时返回 None"""
+        key = (scale, color)
+        with self.lock:
+            frame = self.results.get(key)
+            if frame is not None or self.failed:
+                return frame
+            frame = self.derive(scale, color)
+            if frame is None:
+                frame = self.decoder.decode(self.data, scale, color)
+                self.decode_count += 1
+                if frame is None:
+                    self.failed = True
+                    return None
+            self.results[key] = frame
+            return frame
+
+    def get_fitting(self, width, height, color=COLOR_BGR):
+        """返回不小于 width x height 的最小缩小解码结果"""
+        return self.get(choose_scale(read_jpeg_shape(self.data), width, height), color)
+
+    def put(self, frame, scale=1, color=COLOR_BGR):
+        """放入已有的解码结果（例如进程池返回的原图），供之后的请求复用"""
+        with self.lock:
+            self.results[(scale, color)] = frame
+
+    def derive(self, scale, color):
+        """由已解码的更大（或同尺寸彩色）结果得到所需图像"""
+        best = None
+        for (source_scale, source_color), frame in self.results.items():
+            if frame is None or source_scale > scale:
+                continue
+            if color == COLOR_BGR and source_color == COLOR_GRAY:
+                continue
+            # 优先选择尺寸最接近的结果，缩小的计算量最少
+            if best is None or source_scale > best[0]:
+                best = (source_scale, source_color, frame)
+        if best is None:
+            return None
+        source_scale, source_color, frame = best
+        if color == COLOR_GRAY and source_color == COLOR_BGR:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if source_scale != scale:
+            # 与DCT缩放的尺寸计算一致（向上取整）
+            height, width = frame.shape[:2]
+            factor = scale // source_scale
+            size = ((width + factor - 1) // factor, (height + factor - 1) // factor)
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return frame
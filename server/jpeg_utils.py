@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPEG 辅助函数
+只解析文件头，不解码像素，用于直存模式下的快速校验和获取图像尺寸
+"""
+
+import struct
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+# SOF 标记（不含 DHT=0xC4、JPG=0xC8、DAC=0xCC）
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# 数据末尾允许的填充字节数（部分编码器会在EOI之后补零）
+EOI_SEARCH_WINDOW = 16
+
+def is_valid_jpeg(data):
+    """检查 SOI/EOI 标记，判断数据是否为完整的JPEG"""
+    if len(data) < 4 or bytes(data[:2]) != JPEG_SOI:
+        return False
+    tail = bytes(data[-EOI_SEARCH_WINDOW:])
+    return JPEG_EOI in tail
+
+def read_jpeg_shape(data):
+    """从帧头解析图像尺寸，返回 (高, 宽, 通道数)，无法解析时返回 None"""
+    length = len(data)
+    if length < 4 or bytes(data[:2]) != JPEG_SOI:
+        return None
+
+    offset = 2
+    while offset + 4 <= length:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        # 填充字节
+        if marker == 0xFF:
+            offset += 1
+            continue
+        # 无长度字段的标记
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # 到达EOI或扫描数据，之前没有出现SOF
+            return None
+
+        segment_length = (data[offset + 2] << 8) | data[offset + 3]
+        if marker in SOF_MARKERS:
+            if offset + 10 > length:
+                return None
+            height, width, channels = struct.unpack_from('>HHB', data, offset + 5)
+            return (height, width, channels)
+        offset += 2 + segment_length
+
+    return None
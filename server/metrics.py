@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器运行指标
+记录每个设备的计数（帧数、字节数、心跳、解码失败）和图像处理各阶段的耗时直方图，
+通过本地HTTP端口以 Prometheus 文本格式输出（GET /metrics）
+
+记录操作只是在锁内做一次字典累加或二分查找，开销为微秒级以下，可在生产环境常开
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRIC_PREFIX = 'motion_server'
+
+# 阶段耗时直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# 每个设备的计数器：名称 -> 说明
+DEVICE_COUNTERS = {
+    'frames_total': "接收的图像帧数",
+    'bytes_total': "接收的图像字节数",
+    'heartbeats_total': "接收的心跳次数",
+    'decode_failures_total': "图像解码或校验失败次数",
+    'frames_reordered_total': "v2 设备迟到（序号小于已收到的最大序号）的帧数",
+}
+
+# 处理阶段：名称 -> 说明
+STAGES = {
+    'receive': "从收到消息头到收完图像数据",
+    'queue_wait': "在处理队列中等待",
+    'decode': "JPEG 解码（jpeg_decoder 后端）",
+    'validate': "JPEG完整性校验",
+    'dedup': "相似帧检测（缩小灰度解码并计算哈希）",
+    'save': "写入存储",
+    'clip_encode': "后台解码并编码一批视频片段帧",
+    'display': "显示线程缩小解码并拼接一次画面",
+    'state_snapshot': "写入一次状态快照（设备注册表和存储索引）",
+    'latency': "v2 设备从采集到服务器收到（依赖设备与服务器时钟同步）",
+}
+
+class Histogram:
+    """固定桶的累计直方图"""
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Metrics:
+    """指标注册表"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.counters = {name: {} for name in DEVICE_COUNTERS}  # 名称 -> {device_id: 值}
+        self.histograms = {stage: Histogram(buckets) for stage in STAGES}
+        self.collectors = []
+        self.start_time = time.time()
+
+    def inc(self, name, device_id, value=1):
+        """累加设备计数"""
+        with self.lock:
+            values = self.counters[name]
+            values[device_id] = values.get(device_id, 0) + value
+
+    def inc_many(self, name, values):
+        """批量累加设备计数 {device_id: 增量}"""
+        with self.lock:
+            counters = self.counters[name]
+            for device_id, value in values.items():
+                counters[device_id] = counters.get(device_id, 0) + value
+
+    def observe(self, stage, seconds):
+        """记录一次阶段耗时"""
+        with self.lock:
+            self.histograms[stage].observe(seconds)
+
+    def add_collector(self, collector):
+        """注册采集函数，导出时调用
+
+        采集函数返回 [(名称, 类型, 说明, [(标签字典, 值)])]，用于队列深度等即时值
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        with self.lock:
+            counters = {name: dict(values) for name, values in self.counters.items()}
+            histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in self.histograms.items()}
+            buckets = next(iter(self.histograms.values())).buckets
+
+        lines = []
+        for name, help_text in DEVICE_COUNTERS.items():
+            metric = f"{METRIC_PREFIX}_device_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for device_id, value in sorted(counters[name].items()):
+                lines.append(f'{metric}{{device="{device_id}"}} {value}')
+
+        metric = f"{METRIC_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {metric} 图像处理各阶段耗时")
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, (counts, total, count) in histograms.items():
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {count}')
+
+        for collector in self.collectors:
+            for name, metric_type, help_text, samples in collector():
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {metric_type}")
+                for labels, value in samples:
+                    if labels:
+                        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                        lines.append(f"{metric}{{{label_text}}} {value}")
+                    else:
+                        lines.append(f"{metric} {value}")
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_start_time_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_start_time_seconds {self.start_time:.3f}")
+        return "\n".join(lines) + "\n"
+
+class StageTimer:
+    """记录代码块耗时的上下文管理器
+
+    用法:
+        with StageTimer(metrics, 'decode'):
+            frame = cv2.imdecode(...)
+    """
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class MetricsServer:
+    """在后台线程中提供 /metrics 的HTTP服务"""
+
+    def __init__(self, metrics, host, port):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 不在控制台输出每次抓取的访问日志
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
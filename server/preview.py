@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时预览（MJPEG over HTTP）
+无图形界面的服务器上用浏览器查看设备画面：
+
+    GET /                  设备列表页面
+    GET /stream/<设备ID>   multipart/x-mixed-replace 连续画面
+    GET /snapshot/<设备ID> 当前一帧JPEG（没有人观看该设备时等待下一帧）
+
+原样转发设备发送的JPEG数据，不解码也不重新编码。
+每个设备只保存最新一帧，所有观看者共享同一份数据；
+观看者各自在自己的线程中发送，发送完一帧后直接取当时的最新帧，
+网络慢的观看者只会跳过中间的帧，不会拖慢图像接收。
+每个观看者的帧率不超过 max_fps，设备帧率更高时同样只发送最新帧。
+没有观看者的设备不复制数据。
+"""
+
+import html
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOUNDARY = 'frame'
+
+STREAM_PATH = re.compile(r'^/stream/(\d+)$')
+SNAPSHOT_PATH = re.compile(r'^/snapshot/(\d+)$')
+
+# 等待新帧的最长时间（秒），超时后检查服务是否已停止
+WAIT_TIMEOUT = 1.0
+
+class PreviewChannel:
+    """一个设备的最新帧"""
+    __slots__ = ('condition', 'jpeg', 'version', 'updated', 'viewers', 'sent', 'skipped')
+
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)  # 只唤醒观看该设备的线程
+        self.jpeg = None
+        self.version = 0
+        self.updated = 0.0
+        self.viewers = 0
+        self.sent = 0      # 发送给观看者的帧数（每个观看者分别计数）
+        self.skipped = 0   # 观看者来不及发送而跳过的帧数
+
+class PreviewHub:
+    """各设备最新帧的共享存储"""
+
+    def __init__(self, is_registered=None):
+        self.lock = threading.Lock()
+        self.channels = {}  # device_id -> PreviewChannel
+        self.running = True
+        # is_registered(device_id) -> bool，只为已注册的设备创建通道，None 表示不检查
+        self.is_registered = is_registered
+
+    def channel(self, device_id):
+        """返回设备的通道，未注册的设备返回 None"""
+        channel = self.channels.get(device_id)
+        if channel is None:
+            if self.is_registered is not None and not self.is_registered(device_id):
+                return None
+            with self.lock:
+                channel = self.channels.get(device_id)
+                if channel is None:
+                    channel = self.channels[device_id] = PreviewChannel(self.lock)
+        return channel
+
+    def publish(self, device_id, jpeg_data):
+        """放入设备最新的一帧（接收线程调用），没有观看者时不复制数据"""
+        channel = self.channels.get(device_id)
+        if channel is None or channel.viewers <= 0:
+            return
+        jpeg = bytes(jpeg_data)
+        with self.lock:
+            channel.jpeg = jpeg
+            channel.version += 1
+            channel.updated = time.time()
+            channel.condition.notify_all()
+
+    def wait_frame(self, device_id, last_version, timeout=WAIT_TIMEOUT):
+        """等待比 last_version 更新的帧，返回 (版本, JPEG)，超时返回 (last_version, None)"""
+        channel = self.channel(device_id)
+        with self.lock:
+            if self.running and channel.version == last_version:
+                channel.condition.wait(timeout)
+            if channel.version == last_version or channel.jpeg is None:
+                return last_version, None
+            if last_version:
+                channel.skipped += channel.version - last_version - 1
+            channel.sent += 1
+            return channel.version, channel.jpeg
+
+    def add_viewer(self, device_id, delta=1):
+        channel = self.channel(device_id)
+        with self.lock:
+            channel.viewers += delta
+            if channel.viewers <= 0:
+                # 没有观看者后不再保留画面，之后的观看者等待新帧
+                channel.jpeg = None
+
+    def snapshot(self, device_id, timeout=WAIT_TIMEOUT * 2):
+        """等待设备的下一帧（没有观看者时不保存画面），超时返回 None"""
+        self.add_viewer(device_id)
+        try:
+            channel = self.channel(device_id)
+            if channel.jpeg is not None:
+                return channel.jpeg
+            return self.wait_frame(device_id, channel.version, timeout)[1]
+        finally:
+            self.add_viewer(device_id, -1)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for channel in self.channels.values():
+                channel.condition.notify_all()
+
+    def get_stats(self):
+        """返回每个设备的观看者数、发送帧数和跳过帧数"""
+        with self.lock:
+            return {device_id: {'viewers': channel.viewers, 'sent': channel.sent, 'skipped': channel.skipped}
+                    for device_id, channel in self.channels.items()}
+
+class PreviewHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有5，大量观看者同时打开页面时连接会被拒绝
+    request_queue_size = 128
+
+class PreviewServer:
+    """在后台线程中提供预览HTTP服务"""
+
+    def __init__(self, hub, host, port, list_devices=None, max_fps=10):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        # list_devices() -> [(device_id, 名称)]，用于首页的设备列表
+        self.list_devices = list_devices or (lambda: [(device_id, '') for device_id in sorted(hub.channels)])
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        hub = self.hub
+        list_devices = self.list_devices
+        interval = self.interval
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                match = STREAM_PATH.match(path)
+                if match:
+                    self.stream(int(match.group(1)))
+                    return
+                match = SNAPSHOT_PATH.match(path)
+                if match:
+                    self.snapshot(int(match.group(1)))
+                    return
+                if path == '/':
+                    self.index()
+                    return
+                self.send_error(404)
+
+            def index(self):
+                # 设备名称由设备注册时上报，原样输出会被当作HTML执行
+                items = "".join(
+                    f'<div style="display:inline-block;margin:4px"><div>设备{device_id} {html.escape(name)}</div>'
+                    f'<img src="/stream/{device_id}" width="320"></div>'
+                    for device_id, name in list_devices())
+                body = (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>设备实时画面</title></head>'
+                        f'<body>{items or "当前无设备"}</body></html>').encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def snapshot(self, device_id):
+                if hub.channel(device_id) is None:
+                    self.send_error(404)
+                    return
+                jpeg = hub.snapshot(device_id)
+                if jpeg is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(jpeg)))
+                self.end_headers()
+                self.wfile.write(jpeg)
+
+            def stream(self, device_id):
+                if hub.channel(device_id) is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                hub.add_viewer(device_id)
+                version = 0
+                next_send = 0.0
+                try:
+                    while hub.running:
+                        delay = next_send - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                        version, jpeg = hub.wait_frame(device_id, version)
+                        if jpeg is None:
+                            continue
+                        next_send = time.monotonic() + interval
+                        # 发送期间到达的帧会被下一帧覆盖，慢的观看者只会跳帧
+                        self.wfile.write(
+                            f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+                            f'Content-Length: {len(jpeg)}\r\n\r\n'.encode('ascii'))
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    hub.add_viewer(device_id, -1)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = PreviewHTTPServer((self.host, self.port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.hub.stop()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备通信协议（与 src/protocol.h 一致）
+不做任何I/O：调用方把从连接读到的任意字节块交给 MessageParser，
+解析器按状态机累积数据，返回已完整的消息，一次读取可包含多条消息。
+
+消息格式:
+    消息头 8 字节，网络字节序 '!BBHI'：类型、协议版本（原保留字段）、设备ID、数据长度
+    REGISTER 数据：设备名称 32 字节 + 位置 64 字节，不足部分以 0 填充
+
+协议版本（v2）:
+    设备在 REGISTER 的保留字段中填写支持的最高版本，服务器在 REGISTER_ACK 的同一字段中
+    回复双方都支持的版本；旧设备填 0，按 v1 处理，收到的响应与原来完全相同。
+    v2 的 HEARTBEAT 和 IMAGE_DATA 在消息头之后带 12 字节扩展头 '!IQ'：
+    帧序号和时间戳（微秒，Unix时间），数据长度包含扩展头，v1 解析器仍能正确分帧。
+    - IMAGE_DATA：序号为该帧的序号（设备本地丢弃的帧也占用序号），时间戳为采集时间
+    - HEARTBEAT：序号为最近一帧的序号（尚无图像时为 0），时间戳为发送时间
+    v2 的 HEARTBEAT_ACK 为累计确认，数据 '!IQ'：本连接上收到的最大帧序号、回显时间戳。
+    服务器不逐条回复心跳：一次读取中的消息合并为一次确认，
+    每收到心跳或 ACK_EVERY_FRAMES 帧图像时发送，设备不应同步等待确认。
+
+大数据（图像）的接收不经过中间缓冲区：解析完消息头后，
+get_buffer() 直接返回该消息数据缓冲区中未填充的部分，recv_into 可直接写入
+
+准入控制：解析器在收到图像消息头后调用 admit(设备ID, 长度)，返回 False 时
+不分配缓冲区，数据读入暂存区后直接丢弃，返回 payload 为 None 的消息（仍带序号，用于确认）
+
+UDP 心跳（可选，服务器设置了 udp_heartbeat_port 时）:
+    已通过 TCP 注册的设备可改为向 UDP 端口发送心跳数据报，TCP 连接只传输图像。
+    数据报 8 字节，与消息头布局相同 '!BBHI'：类型 MSG_HEARTBEAT_DATAGRAM、协议版本、设备ID、心跳序号。
+    序号每次加 1（32 位回绕），服务器据此统计丢失的心跳；服务器不回复。
+"""
+
+import struct
+import time
+
+# 消息类型定义
+MSG_HEARTBEAT = 0x01
+MSG_HEARTBEAT_ACK = 0x02
+MSG_IMAGE_DATA = 0x03
+MSG_REGISTER = 0x04
+MSG_REGISTER_ACK = 0x05
+MSG_HEARTBEAT_DATAGRAM = 0x06  # 仅用于 UDP 心跳数据报
+
+HEADER_FORMAT = '!BBHI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
+
+DEVICE_NAME_SIZE = 32
+LOCATION_SIZE = 64
+REGISTER_SIZE = DEVICE_NAME_SIZE + LOCATION_SIZE
+
+# 协议版本（消息头的保留字段，v1 设备发送 0）
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_VERSION = PROTOCOL_V2  # 本端支持的最高版本
+
+# v2 扩展头：帧序号、时间戳（微秒）
+EXTENSION_FORMAT = '!IQ'
+EXTENSION_SIZE = struct.calcsize(EXTENSION_FORMAT)
+EXTENSION_STRUCT = struct.Struct(EXTENSION_FORMAT)
+
+# v2 心跳响应数据：累计确认的帧序号、回显时间戳（微秒）
+ACK_FORMAT = '!IQ'
+ACK_SIZE = struct.calcsize(ACK_FORMAT)
+ACK_STRUCT = struct.Struct(ACK_FORMAT)
+
+# v2 中带扩展头的消息类型
+EXTENDED_TYPES = frozenset((MSG_HEARTBEAT, MSG_IMAGE_DATA))
+
+# UDP 心跳数据报：类型、协议版本、设备ID、心跳序号
+DATAGRAM_FORMAT = '!BBHI'
+DATAGRAM_SIZE = struct.calcsize(DATAGRAM_FORMAT)
+DATAGRAM_STRUCT = struct.Struct(DATAGRAM_FORMAT)
+
+# 未收到心跳时，每收到多少帧图像发送一次累计确认
+ACK_EVERY_FRAMES = 16
+
+# 各端可以接收的消息类型
+SERVER_MESSAGE_TYPES = frozenset((MSG_HEARTBEAT, MSG_IMAGE_DATA, MSG_REGISTER))
+CLIENT_MESSAGE_TYPES = frozenset((MSG_HEARTBEAT_ACK, MSG_REGISTER_ACK))
+
+# 固定长度的消息：类型 -> 数据长度
+FIXED_LENGTHS = {
+    MSG_HEARTBEAT: 0,
+    MSG_HEARTBEAT_ACK: 0,
+    MSG_REGISTER_ACK: 0,
+    MSG_REGISTER: REGISTER_SIZE,
+}
+
+# v2 中固定长度的消息（数据长度包含扩展头）
+FIXED_LENGTHS_V2 = {
+    MSG_HEARTBEAT: EXTENSION_SIZE,
+    MSG_HEARTBEAT_ACK: ACK_SIZE,
+    MSG_REGISTER_ACK: 0,
+    MSG_REGISTER: REGISTER_SIZE,
+}
+
+DEFAULT_MAX_PAYLOAD = 8 * 1024 * 1024
+
+# 每次读取的暂存区大小；放不进暂存区的消息直接接收到独立缓冲区
+READ_CHUNK_SIZE = 64 * 1024
+
+class ProtocolError(Exception):
+    """收到格式错误的消息，连接应当关闭"""
+
+    def __init__(self, message, device_id=None):
+        super().__init__(message)
+        self.device_id = device_id
+
+class Message:
+    """一条完整的消息
+
+    payload 为数据视图；buffer 为数据所在的缓冲区（由 allocate 分配），
+    调用方可以直接持有 buffer 而不必复制数据；未通过准入控制而丢弃的图像 payload 为 None
+    """
+    __slots__ = ('msg_type', 'reserved', 'device_id', 'payload', 'buffer', 'started', 'seq', 'timestamp')
+
+    def __init__(self, msg_type, reserved, device_id, payload, buffer=None, started=None,
+                 seq=None, timestamp=None):
+        self.msg_type = msg_type
+        self.reserved = reserved  # 协议版本，REGISTER 中为设备支持的最高版本
+        self.device_id = device_id
+        self.payload = payload    # 不含 v2 扩展头
+        self.buffer = buffer
+        self.started = started  # 解析出消息头时的 time.perf_counter()，用于统计接收耗时
+        self.seq = seq              # v2 扩展头，v1 消息为 None
+        self.timestamp = timestamp
+
+    @property
+    def length(self):
+        return len(self.payload)
+
+class MessageParser:
+    """增量消息解析器
+
+    用法一（recv_into，图像数据零复制）:
+        view = parser.get_buffer()
+        count = sock.recv_into(view)
+        for message in parser.buffer_updated(count): ...
+
+    用法二（已有数据块，如 asyncio StreamReader.read()）:
+        for message in parser.feed(data): ...
+    """
+
+    def __init__(self, accepted_types=SERVER_MESSAGE_TYPES, max_payload=DEFAULT_MAX_PAYLOAD,
+                 allocate=bytearray, chunk_size=READ_CHUNK_SIZE, admit=None):
+        self.accepted_types = accepted_types
+        self.max_payload = max_payload
+        self.allocate = allocate  # allocate(size) -> 至少 size 字节的可写缓冲区
+        self.admit = admit        # admit(device_id, length) -> 是否接收该图像，每条图像消息只调用一次
+
+        # 暂存区：未被解析的数据位于 chunk[start:end]
+        self.chunk = bytearray(chunk_size)
+        self.chunk_view = memoryview(self.chunk)
+        self.start = 0
+        self.end = 0
+
+        # 正在直接接收的大消息
+        self.header = None         # (类型, 版本, 设备ID, 长度, 开始时间, 序号, 时间戳)
+        self.payload_buffer = None
+        self.payload_view = None
+        self.filled = 0
+        self.discarding = 0        # 正在丢弃的图像剩余的字节数
+
+    def get_buffer(self):
+        """返回下一次读取应写入的可写视图"""
+        if self.payload_view is not None:
+            return self.payload_view[self.filled:]
+        if self.discarding:
+            # 丢弃的数据读入（此时为空的）暂存区，不超过该消息的剩余长度
+            return self.chunk_view[:self.discarding]
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start and len(self.chunk) - self.end < len(self.chunk) // 4:
+            # 暂存区末尾空间不足，把剩余的不完整消息移到开头
+            remaining = self.end - self.start
+            self.chunk_view[:remaining] = self.chunk_view[self.start:self.end]
+            self.start, self.end = 0, remaining
+        return self.chunk_view[self.end:]
+
+    def buffer_updated(self, count):
+        """通知解析器上一次 get_buffer() 的视图中写入了 count 字节，返回完整的消息列表"""
+        messages = []
+        if self.payload_view is not None:
+            self.filled += count
+            if self.filled < len(self.payload_view):
+                return messages
+            messages.append(self.finish_payload())
+        elif self.discarding:
+            self.discarding -= count
+            if self.discarding:
+                return messages
+            messages.append(self.finish_discard())
+        else:
+            self.end += count
+        self.parse_chunk(messages)
+        return messages
+
+    def feed(self, data):
+        """送入任意长度的数据块，返回完整的消息列表"""
+        messages = []
+        data = memoryview(data)
+        while data:
+            view = self.get_buffer()
+            count = min(len(view), len(data))
+            view[:count] = data[:count]
+            data = data[count:]
+            messages.extend(self.buffer_updated(count))
+        return messages
+
+    def parse_chunk(self, messages):
+        """从暂存区中解析尽可能多的消息"""
+        chunk = self.chunk
+        while self.end - self.start >= HEADER_SIZE:
+            msg_type, reserved, device_id, length = HEADER_STRUCT.unpack_from(chunk, self.start)
+            try:
+                self.validate(msg_type, reserved, device_id, length)
+            except ProtocolError:
+                if messages:
+                    # 先返回之前已解析（可能已通过准入）的消息，下一次读取时再报告错误
+                    return
+                raise
+            started = time.perf_counter()
+            header_size = HEADER_SIZE
+            seq = timestamp = None
+            if reserved == PROTOCOL_V2 and msg_type in EXTENDED_TYPES:
+                # 扩展头与消息头一起在暂存区中解析，数据缓冲区只保存图像本身
+                header_size += EXTENSION_SIZE
+                if self.end - self.start < header_size:
+                    return
+                seq, timestamp = EXTENSION_STRUCT.unpack_from(chunk, self.start + HEADER_SIZE)
+                length -= EXTENSION_SIZE
+            body_start = self.start + header_size
+            available = self.end - body_start
+
+            in_chunk = header_size + length <= len(chunk)
+            if in_chunk and length <= available:
+                # 数据已完整在暂存区中
+                data = self.chunk_view[body_start:body_start + length]
+                if msg_type == MSG_IMAGE_DATA and not self.admitted(device_id, length):
+                    buffer = payload = None
+                elif msg_type in FIXED_LENGTHS:
+                    # 控制消息很短，直接复制
+                    buffer = None
+                    payload = bytes(data)
+                else:
+                    buffer = self.allocate(length)
+                    payload = memoryview(buffer)[:length]
+                    payload[:] = data
+                messages.append(Message(msg_type, reserved, device_id, payload, buffer, started,
+                                        seq, timestamp))
+                self.start = body_start + length
+                continue
+
+            if in_chunk:
+                # 消息尚未收全，等待更多数据
+                return
+
+            if msg_type == MSG_IMAGE_DATA and not self.admitted(device_id, length):
+                # 丢弃的大消息：跳过已收到的部分，剩余部分由 get_buffer() 读入暂存区后丢弃
+                self.discarding = length - available
+                self.header = (msg_type, reserved, device_id, length, started, seq, timestamp)
+                self.start = self.end = 0
+                return
+
+            # 大消息：已收到的部分复制到独立缓冲区，剩余部分由 get_buffer() 直接接收
+            self.payload_buffer = self.allocate(length)
+            self.payload_view = memoryview(self.payload_buffer)[:length]
+            self.payload_view[:available] = self.chunk_view[body_start:self.end]
+            self.filled = available
+            self.header = (msg_type, reserved, device_id, length, started, seq, timestamp)
+            self.start = self.end = 0
+            return
+
+    def finish_payload(self):
+        msg_type, reserved, device_id, length, started, seq, timestamp = self.header
+        message = Message(msg_type, reserved, device_id, self.payload_view, self.payload_buffer, started,
+                          seq, timestamp)
+        self.header = None
+        self.payload_buffer = None
+        self.payload_view = None
+        self.filled = 0
+        return message
+
+    def finish_discard(self):
+        msg_type, reserved, device_id, _, started, seq, timestamp = self.header
+        self.header = None
+        return Message(msg_type, reserved, device_id, None, None, started, seq, timestamp)
+
+    def admitted(self, device_id, length):
+        return self.admit is None or self.admit(device_id, length)
+
+    def validate(self, msg_type, reserved, device_id, length):
+        if msg_type not in self.accepted_types:
+            raise ProtocolError(f"未知消息类型: {msg_type}", device_id)
+        if msg_type == MSG_REGISTER:
+            # 注册消息的版本字段是设备的提议，任何值都可以接受
+            fixed_lengths = FIXED_LENGTHS
+        elif reserved == PROTOCOL_V2:
+            fixed_lengths = FIXED_LENGTHS_V2
+            if msg_type in EXTENDED_TYPES and length < EXTENSION_SIZE:
+                raise ProtocolError(f"消息长度错误: v2 消息缺少扩展头（{length}字节）", device_id)
+        elif reserved in (0, PROTOCOL_V1):
+            fixed_lengths = FIXED_LENGTHS
+        else:
+            raise ProtocolError(f"不支持的协议版本: {reserved}", device_id)
+        expected = fixed_lengths.get(msg_type)
+        if expected is not None and length != expected:
+            raise ProtocolError(f"消息长度错误: 类型{msg_type}应为{expected}字节，实际{length}字节", device_id)
+        if length > self.max_payload:
+            raise ProtocolError(f"消息长度异常: {length} 字节 (上限 {self.max_payload} 字节)", device_id)
+
+    @property
+    def pending(self):
+        """是否有未解析完的数据（连接关闭时用于判断消息是否被截断）"""
+        return self.payload_view is not None or self.discarding > 0 or self.end > self.start
+
+def pack_header(msg_type, device_id, length=0, reserved=0):
+    return HEADER_STRUCT.pack(msg_type, reserved, device_id, length)
+
+def pack_message(msg_type, device_id, payload=b'', reserved=0):
+    return HEADER_STRUCT.pack(msg_type, reserved, device_id, len(payload)) + payload
+
+def pack_extended_header(msg_type, device_id, seq, timestamp, length=0):
+    """构造 v2 消息头和扩展头，length 为扩展头之后的数据长度"""
+    return (HEADER_STRUCT.pack(msg_type, PROTOCOL_V2, device_id, EXTENSION_SIZE + length) +
+            EXTENSION_STRUCT.pack(seq, timestamp))
+
+def pack_ack(device_id, ack_seq, echo_timestamp):
+    """构造 v2 累计确认（HEARTBEAT_ACK）"""
+    return (HEADER_STRUCT.pack(MSG_HEARTBEAT_ACK, PROTOCOL_V2, device_id, ACK_SIZE) +
+            ACK_STRUCT.pack(ack_seq, echo_timestamp))
+
+def parse_ack(payload):
+    """解析 v2 累计确认，返回 (帧序号, 回显时间戳)"""
+    return ACK_STRUCT.unpack(bytes(payload))
+
+def pack_heartbeat_datagram(device_id, seq):
+    """构造 UDP 心跳数据报"""
+    return DATAGRAM_STRUCT.pack(MSG_HEARTBEAT_DATAGRAM, PROTOCOL_VERSION, device_id, seq & 0xFFFFFFFF)
+
+def parse_heartbeat_datagram(data):
+    """解析 UDP 心跳数据报，返回 (设备ID, 序号)，格式错误时返回 None"""
+    if len(data) != DATAGRAM_SIZE:
+        return None
+    msg_type, _, device_id, seq = DATAGRAM_STRUCT.unpack(data)
+    if msg_type != MSG_HEARTBEAT_DATAGRAM:
+        return None
+    return device_id, seq
+
+def pack_register(device_id, device_name, location, version=0):
+    """构造 REGISTER 消息（名称和位置超长时截断），version 为设备支持的最高协议版本"""
+    payload = (device_name.encode('utf-8')[:DEVICE_NAME_SIZE].ljust(DEVICE_NAME_SIZE, b'\x00') +
+               location.encode('utf-8')[:LOCATION_SIZE].ljust(LOCATION_SIZE, b'\x00'))
+    return pack_message(MSG_REGISTER, device_id, payload, version)
+
+def parse_register(payload):
+    """解析 REGISTER 数据，返回 (设备名称, 位置)"""
+    payload = bytes(payload)
+    device_name = payload[:DEVICE_NAME_SIZE].decode('utf-8', errors='replace').strip('\x00')
+    location = payload[DEVICE_NAME_SIZE:REGISTER_SIZE].decode('utf-8', errors='replace').strip('\x00')
+    return device_name, location
+
+def negotiate_version(offered):
+    """根据设备在 REGISTER 中提议的版本选择协议版本（填在 REGISTER_ACK 的版本字段中）
+
+    旧设备提议 0，回复 0，与 v1 服务器的响应完全相同
+    """
+    if offered == 0:
+        return 0
+    return min(offered, PROTOCOL_VERSION)
+
+class AckTracker:
+    """v2 连接的累计确认（每个连接一个，不做I/O）
+
+    每处理完一次读取中的消息后调用 take()，需要确认时返回要发送的数据
+    """
+    __slots__ = ('device_id', 'highest', 'echo', 'unacked', 'requested', 'every')
+
+    def __init__(self, every=ACK_EVERY_FRAMES):
+        self.device_id = None
+        self.highest = None   # 本连接上收到的最大帧序号
+        self.echo = 0
+        self.unacked = 0      # 上次确认后收到的帧数
+        self.requested = False
+        self.every = every
+
+    def received(self, message):
+        if message.seq is None:
+            return
+        self.device_id = message.device_id
+        self.echo = message.timestamp
+        if message.msg_type == MSG_IMAGE_DATA:
+            if self.highest is None or (message.seq - self.highest) % (1 << 32) < (1 << 31):
+                self.highest = message.seq
+            self.unacked += 1
+        else:
+            self.requested = True
+
+    def take(self):
+        """返回需要发送的确认消息，不需要确认时返回 None"""
+        if not self.requested and self.unacked < self.every:
+            return None
+        self.requested = False
+        self.unacked = 0
+        return pack_ack(self.device_id, self.highest or 0, self.echo)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储配额与保留期限
+按总容量、每个设备的容量和保存天数删除最旧的数据，不依赖定时遍历目录。
+
+- 每次写入时更新占用统计（每个设备一个按时间排序的队列，追加一项或累加到当前段）
+- 已有的存档只扫描一次：启动时在后台逐个扫描设备目录（多进程模式下只扫描本进程写入的设备），
+  设备目录扫描完成前不删除该设备的数据，避免尚未统计的旧数据使新数据被误删
+- 后台线程每次从队列头部选出一批最旧的数据，先从统计中扣除，再在锁外删除文件，
+  批次之间短暂休眠，删除大量文件时也不会占满磁盘I/O、拖慢接收
+- 每个设备最新的一项不删除（分段存储中可能正在写入）
+- 设置了状态快照（state_store.StateStore）时，已有的存档从快照加载而不再扫描目录；
+  上次未正常退出时只列出目录核对文件名（不逐个 stat），补上快照之后写入的文件、去掉已不存在的项
+
+一项数据可以是一个JPEG文件、一个段文件（.dat + .idx）或一个视频片段（视频 + 代表帧）
+"""
+
+import heapq
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from event_clips import CLIP_NAME_PATTERN
+from segment_store import DEVICE_DIR_PATTERN, SEGMENT_PATTERN, to_microseconds
+from state_store import NAME_SEPARATOR, StorageChange
+
+FILE_PATTERN = re.compile(r'^motion_.*\.jpg$')
+
+SECONDS_PER_DAY = 86400
+
+class RetentionItem:
+    """一项可删除的数据"""
+    __slots__ = ('start_us', 'end_us', 'size', 'paths', 'seq')
+
+    def __init__(self, start_us, end_us, size, paths, seq=0):
+        self.start_us = start_us
+        self.end_us = end_us
+        self.size = size
+        self.paths = paths
+        self.seq = seq   # 在状态快照中的序号，与队列顺序一致
+
+class DeviceUsage:
+    """一个设备的占用统计"""
+    __slots__ = ('items', 'bytes', 'scanned', 'evicted', 'evicted_bytes', 'next_seq', 'saved_last', 'rewrite',
+                 'dirty')
+
+    def __init__(self, next_seq=0):
+        self.items = deque()   # 按时间排序的 RetentionItem
+        self.bytes = 0
+        self.scanned = False   # 已有的存档是否已计入
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.next_seq = next_seq  # 下一项的序号
+        self.saved_last = 0       # 上次快照时最新一项的序号（之后只写入序号不小于它的项）
+        self.rewrite = False      # 下次快照重写该设备的全部项
+        self.dirty = False        # 上次快照之后有变化
+
+def parse_device_limits(text):
+    """解析每个设备单独的限制 '设备ID:MB:天, ...'（0 表示沿用默认值），格式错误的项忽略"""
+    limits = {}
+    for part in (text or '').split(','):
+        fields = part.strip().split(':')
+        if len(fields) != 3:
+            continue
+        try:
+            device_id, max_mb, max_days = int(fields[0]), float(fields[1]), float(fields[2])
+        except ValueError:
+            continue
+        limits[device_id] = (int(max_mb * 1024 * 1024) if max_mb > 0 else None,
+                             max_days * SECONDS_PER_DAY if max_days > 0 else None)
+    return limits
+
+def scan_device_dir(device_dir, skip=()):
+    """扫描一个设备目录中的已有数据，返回按时间排序的 RetentionItem 列表；skip 中的文件名不扫描"""
+    items = []
+    try:
+        entries = list(os.scandir(device_dir))
+    except OSError:
+        return items
+    names = {entry.name for entry in entries}
+    for entry in entries:
+        name = entry.name
+        if name in skip:
+            continue
+        try:
+            if FILE_PATTERN.match(name):
+                stat = entry.stat()
+                timestamp_us = to_microseconds(stat.st_mtime)
+                items.append(RetentionItem(timestamp_us, timestamp_us, stat.st_size, (entry.path,)))
+                continue
+            match = SEGMENT_PATTERN.match(name) or CLIP_NAME_PATTERN.match(name)
+            if not match:
+                continue
+            paths = [entry.path]
+            size = entry.stat().st_size
+            # 段文件的索引、视频片段的代表帧与主文件一起删除
+            companion = f"segment_{match.group(1)}.idx" if name.endswith('.dat') else f"event_{match.group(1)}.jpg"
+            if companion in names:
+                paths.append(os.path.join(device_dir, companion))
+                size += os.path.getsize(paths[-1])
+            end_us = to_microseconds(entry.stat().st_mtime)
+            items.append(RetentionItem(int(match.group(1)), max(end_us, int(match.group(1))), size, tuple(paths)))
+        except OSError:
+            continue
+    items.sort(key=lambda item: item.start_us)
+    return items
+
+def reconcile_device_dir(device_dir, items):
+    """核对从快照加载的项与目录中的实际文件，返回 (核对后的项, 是否有变化)
+
+    只列出文件名：去掉文件已不存在的项，重新统计最新一项（可能在快照之后继续写入），
+    扫描快照中没有的文件
+    """
+    try:
+        names = set(os.listdir(device_dir))
+    except OSError:
+        return [], bool(items)
+    kept = [item for item in items if item.paths[0].rpartition(os.sep)[2] in names]
+    changed = len(kept) != len(items)
+    if kept:
+        last = kept[-1]
+        try:
+            size = sum(os.path.getsize(path) for path in last.paths)
+            end_us = max(last.end_us, to_microseconds(os.path.getmtime(last.paths[0])))
+        except OSError:
+            size, end_us = last.size, last.end_us
+        if (size, end_us) != (last.size, last.end_us):
+            last.size, last.end_us = size, end_us
+            changed = True
+    known = {path.rpartition(os.sep)[2] for item in kept for path in item.paths}
+    added = scan_device_dir(device_dir, skip=known) if len(names) > len(known) else []
+    if added:
+        kept.extend(added)
+        kept.sort(key=lambda item: item.start_us)
+        changed = True
+    return kept, changed
+
+class RetentionManager:
+    """存储占用统计和后台删除"""
+
+    def __init__(self, root_dir, max_bytes=None, device_max_bytes=None, max_age=None, device_limits=None,
+                 interval=10.0, batch_size=1000, pause=0.05, scan_all=True, on_evict=None, state=None,
+                 verify_state=True, log=None):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes                  # 总容量上限（字节），None 表示不限
+        self.device_max_bytes = device_max_bytes    # 每个设备的容量上限
+        self.max_age = max_age                      # 保存时间上限（秒）
+        self.device_limits = device_limits or {}    # device_id -> (容量上限, 保存时间上限)，覆盖默认值
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.scan_all = scan_all   # 启动时扫描所有设备目录；False 时只扫描写入过的设备
+        self.on_evict = on_evict   # on_evict(device_id, [RetentionItem]) 在文件删除后调用
+        self.state = state         # StateStore，None 表示不使用快照
+        self.verify_state = verify_state  # 从快照加载后核对目录（快照之后可能有未记录的变化）
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.devices = {}          # device_id -> DeviceUsage
+        self.total_bytes = 0
+        self.pending_scans = deque()  # 待扫描的设备
+        self.scanned = not scan_all   # 启动时的扫描是否完成，完成前不按总容量删除
+        self.saved_devices = {}       # 快照中有存储索引的设备 -> 下一项的序号
+        self.loaded_devices = 0       # 从快照加载的设备数
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()  # 批次之间的休眠只被停止打断，不被新的写入通知打断
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.state is not None:
+            try:
+                self.saved_devices = self.state.load_storage_devices()
+            except sqlite3.Error as e:
+                self.state = None
+                if self.log:
+                    self.log.warning('retention', f"读取状态快照失败，扫描存档: {e}")
+        self.running = True
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='retention', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    def configure(self, max_bytes=None, device_max_bytes=None, max_age=None, device_limits=None, interval=10.0,
+                  batch_size=1000):
+        """修改各项限制（重新加载设置时调用），立即按新的限制检查一次"""
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.device_max_bytes = device_max_bytes
+            self.max_age = max_age
+            self.device_limits = device_limits or {}
+            self.interval = interval
+            self.batch_size = batch_size
+        self.wakeup.set()
+
+    def device_dir(self, device_id):
+        return os.path.join(self.root_dir, f"device_{device_id}")
+
+    def usage(self, device_id):
+        """在 self.lock 内调用，首次出现的设备加入扫描队列（并唤醒后台线程立即扫描）"""
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = DeviceUsage(self.saved_devices.get(device_id, 0))
+            self.pending_scans.append(device_id)
+            self.wakeup.set()
+        return device
+
+    def forget(self, device_id):
+        """不再管理该设备（多进程模式下设备转到其他进程写入）"""
+        with self.lock:
+            device = self.devices.pop(device_id, None)
+            if device is not None:
+                self.total_bytes -= device.bytes
+
+    def limits(self, device_id):
+        """返回设备的 (容量上限, 保存时间上限)"""
+        max_bytes, max_age = self.device_limits.get(device_id, (None, None))
+        return (max_bytes or self.device_max_bytes), (max_age or self.max_age)
+
+    def record(self, device_id, path, size, timestamp=None, paths=None, start=None):
+        """记录一次写入（接收线程调用，只做常数时间的统计更新）
+
+        同一路径连续写入（段文件追加）累加到同一项；paths 为与 path 一起删除的全部文件，
+        start 为该项的起始时间（视频片段），默认与 timestamp 相同
+        """
+        timestamp_us = to_microseconds(time.time() if timestamp is None else timestamp)
+        with self.lock:
+            device = self.usage(device_id)
+            last = device.items[-1] if device.items else None
+            if last is not None and last.paths[0] == path:
+                last.size += size
+                last.end_us = max(last.end_us, timestamp_us)
+            else:
+                start_us = timestamp_us if start is None else to_microseconds(start)
+                device.items.append(RetentionItem(start_us, timestamp_us, size, paths or (path,), device.next_seq))
+                device.next_seq += 1
+            device.bytes += size
+            device.dirty = True
+            self.total_bytes += size
+            max_bytes = self.limits(device_id)[0]
+            over = ((self.max_bytes is not None and self.total_bytes > self.max_bytes) or
+                    (max_bytes is not None and device.bytes > max_bytes))
+        if over:
+            self.wakeup.set()
+
+    def load_saved(self, device_id):
+        """从快照加载设备的项，返回 (项列表, 是否需要重写快照)；快照中没有该设备时扫描目录"""
+        device_dir = self.device_dir(device_id)
+        if self.state is None or device_id not in self.saved_devices:
+            return scan_device_dir(device_dir), True
+        try:
+            rows = self.state.load_items(device_id)
+        except sqlite3.Error as e:
+            if self.log:
+                self.log.warning('retention', f"读取状态快照失败，扫描目录: {e}", device_id)
+            return scan_device_dir(device_dir), True
+        # 逐项 os.path.join 的开销与读取快照相当，直接拼接前缀
+        prefix = os.path.join(device_dir, '')
+        items = [RetentionItem(start_us, end_us, size,
+                               (prefix + names,) if NAME_SEPARATOR not in names else
+                               tuple(prefix + name for name in names.split(NAME_SEPARATOR)), seq)
+                 for seq, start_us, end_us, size, names in rows]
+        self.loaded_devices += 1
+        if self.verify_state:
+            return reconcile_device_dir(device_dir, items)
+        return items, False
+
+    def scan_device(self, device_id):
+        """扫描设备目录（或从快照加载）已有的数据，与扫描期间新写入的记录合并"""
+        items, rewrite = self.load_saved(device_id)
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                return 0
+            # 扫描之后写入的数据已由 record() 记录，且都比扫描到的数据新
+            recorded = {item.paths[0] for item in device.items}
+        older = [item for item in items if item.paths[0] not in recorded]
+        added = sum(item.size for item in older)
+        with self.lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                return 0
+            device.items.extendleft(reversed(older))
+            device.bytes += added
+            device.scanned = True
+            self.total_bytes += added
+            if older:
+                # 扫描前记录的项的序号取自启动时读取的快照，可能已与后来写入快照的项重复
+                if len(device.items) > len(older) and device.items[len(older)].seq <= older[-1].seq:
+                    rewrite = True
+                device.next_seq = max(device.next_seq, older[-1].seq + 1)
+            if rewrite or len(older) != len(items):
+                # 快照中的序号与队列不再一致（或没有快照）：下次快照重写该设备
+                device.rewrite = device.dirty = True
+            elif older:
+                device.saved_last = older[-1].seq
+        return len(older)
+
+    def scan_pending(self):
+        """扫描队列中的设备，返回扫描到的项数"""
+        count = 0
+        while self.running:
+            with self.lock:
+                if not self.pending_scans:
+                    break
+                device_id = self.pending_scans.popleft()
+            try:
+                count += self.scan_device(device_id)
+            except OSError as e:
+                if self.log:
+                    self.log.error('retention', f"存档扫描失败: {e}", device_id)
+        return count
+
+    def run(self):
+        if self.scan_all:
+            started = time.monotonic()
+            with self.lock:
+                if os.path.isdir(self.root_dir):
+                    for entry in os.scandir(self.root_dir):
+                        match = DEVICE_DIR_PATTERN.match(entry.name)
+                        if match and entry.is_dir():
+                            self.usage(int(match.group(1)))
+            count = self.scan_pending()
+            self.scanned = True
+            if self.log:
+                loaded = f"（{self.loaded_devices}个从快照加载）" if self.loaded_devices else ""
+                self.log.info('retention', f"存档扫描完成: {len(self.devices)}个设备{loaded}, {count}项, "
+                              f"{self.total_bytes / 1024 / 1024:.1f} MB, 耗时{time.monotonic() - started:.1f}秒",
+                              items=count, bytes=self.total_bytes, loaded_devices=self.loaded_devices)
+        while self.running:
+            # 先清除唤醒标志，本轮开始后的通知（新设备、超出容量）让下面的等待立即返回
+            self.wakeup.clear()
+            self.scan_pending()
+            if self.evict_batch():
+                # 还有待删除的数据：休眠 pause 后继续下一批，超出容量时每次写入都会通知，不能用 wakeup 等待
+                self.stopped.wait(self.pause)
+            else:
+                self.wakeup.wait(self.interval)
+
+    def select(self, now_us=None):
+        """选出下一批要删除的数据并从统计中扣除，返回 {device_id: [RetentionItem]}"""
+        now_us = to_microseconds(time.time()) if now_us is None else now_us
+        selected = {}
+        count = 0
+
+        def take(device_id, device):
+            item = device.items.popleft()
+            device.bytes -= item.size
+            device.evicted += 1
+            device.evicted_bytes += item.size
+            device.dirty = True
+            self.total_bytes -= item.size
+            selected.setdefault(device_id, []).append(item)
+
+        with self.lock:
+            # 保存时间和每个设备的容量
+            for device_id, device in self.devices.items():
+                if not device.scanned:
+                    continue
+                max_bytes, max_age = self.limits(device_id)
+                cutoff_us = now_us - int(max_age * 1_000_000) if max_age else None
+                while count < self.batch_size and len(device.items) > 1 and (
+                        (cutoff_us is not None and device.items[0].end_us < cutoff_us) or
+                        (max_bytes is not None and device.bytes > max_bytes)):
+                    take(device_id, device)
+                    count += 1
+            # 总容量：按各设备最旧一项的时间依次删除
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                heap = [(device.items[0].start_us, device_id) for device_id, device in self.devices.items()
+                        if device.scanned and len(device.items) > 1]
+                heapq.heapify(heap)
+                while heap and count < self.batch_size and self.total_bytes > self.max_bytes:
+                    _, device_id = heapq.heappop(heap)
+                    device = self.devices[device_id]
+                    take(device_id, device)
+                    count += 1
+                    if len(device.items) > 1:
+                        heapq.heappush(heap, (device.items[0].start_us, device_id))
+        return selected
+
+    def evict_batch(self, now_us=None):
+        """删除一批最旧的数据，返回删除的项数"""
+        if not self.scanned:
+            return 0
+        selected = self.select(now_us)
+        count = 0
+        freed = 0
+        for device_id, items in selected.items():
+            for item in items:
+                for path in item.paths:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        if self.log:
+                            self.log.warning('retention', f"删除失败: {path}: {e}", device_id)
+                count += 1
+                freed += item.size
+            if self.on_evict:
+                self.on_evict(device_id, items)
+        if count and self.log:
+            self.log.debug('retention', f"已删除{count}项, 释放 {freed / 1024 / 1024:.1f} MB",
+                           count=count, bytes=freed)
+        return count
+
+    def collect_state(self):
+        """收集上次快照之后有变化的设备，返回 [StorageChange]（状态快照线程调用）
+
+        只包含新增的项（以及可能继续写入的上次最新一项）和已删除项的范围，
+        加载或核对后序号不连续的设备重写全部项
+        """
+        changes = []
+        with self.lock:
+            for device_id, device in self.devices.items():
+                if not device.scanned or not device.dirty:
+                    continue
+                items = device.items
+                if device.rewrite:
+                    for seq, item in enumerate(items):
+                        item.seq = seq
+                    device.next_seq = len(items)
+                    changed = items
+                else:
+                    changed = []
+                    for item in reversed(items):
+                        if item.seq < device.saved_last:
+                            break
+                        changed.append(item)
+                    changed.reverse()
+                rows = [(item.seq, item.start_us, item.end_us, item.size,
+                         NAME_SEPARATOR.join(path.rpartition(os.sep)[2] for path in item.paths)) for item in changed]
+                changes.append(StorageChange(device_id, device.next_seq, device.rewrite,
+                                             items[0].seq if items else device.next_seq, rows))
+                device.saved_last = items[-1].seq if items else device.next_seq
+                device.rewrite = device.dirty = False
+        return changes
+
+    def state_failed(self, changes):
+        """快照写入失败：这些设备下次重写全部项"""
+        with self.lock:
+            for change in changes:
+                device = self.devices.get(change.device_id)
+                if device is not None:
+                    device.rewrite = device.dirty = True
+
+    def get_stats(self):
+        """返回每个设备的占用字节数、删除项数和删除字节数"""
+        with self.lock:
+            return {device_id: {'bytes': device.bytes, 'items': len(device.items), 'evicted': device.evicted,
+                                'evicted_bytes': device.evicted_bytes}
+                    for device_id, device in self.devices.items()}
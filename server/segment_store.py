@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段存储
+每个设备的图像追加写入滚动的段文件（segment_<起始时间>.dat），
+同时写入定长二进制索引（segment_<起始时间>.idx），
+索引可直接内存映射，按时间查找时无需遍历目录
+
+目录结构:
+    <save_dir>/device_<id>/segment_<起始微秒时间戳>.dat   JPEG数据，依次追加
+    <save_dir>/device_<id>/segment_<起始微秒时间戳>.idx   索引记录
+"""
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+# 索引记录：时间戳(微秒, int64)、数据偏移(uint64)、数据长度(uint32)，小端，共20字节
+INDEX_DTYPE = np.dtype([('timestamp', '<i8'), ('offset', '<u8'), ('length', '<u4')])
+INDEX_RECORD_SIZE = INDEX_DTYPE.itemsize
+
+SEGMENT_PATTERN = re.compile(r'^segment_(\d+)\.dat$')
+DEVICE_DIR_PATTERN = re.compile(r'^device_(\d+)$')
+
+def to_microseconds(timestamp):
+    """秒级浮点时间戳转换为整数微秒"""
+    return int(round(timestamp * 1_000_000))
+
+class Segment:
+    """一个段文件及其索引"""
+
+    def __init__(self, device_dir, start_us):
+        self.start_us = start_us
+        self.data_path = os.path.join(device_dir, f"segment_{start_us}.dat")
+        self.index_path = os.path.join(device_dir, f"segment_{start_us}.idx")
+        self._index = None
+        self._index_size = -1
+
+    def load_index(self):
+        """内存映射索引文件，文件增长后重新映射"""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        # 只映射完整的记录，忽略写入中断留下的半条记录
+        count = size // INDEX_RECORD_SIZE
+        if count == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        if count != self._index_size:
+            self._index = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+            self._index_size = count
+        return self._index
+
+    def read(self, offset, length):
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+class SegmentWriter:
+    """单个设备当前正在写入的段"""
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.data_file = open(segment.data_path, 'ab')
+        self.index_file = open(segment.index_path, 'ab')
+        self.size = self.data_file.tell()
+        self.last_us = segment.start_us
+
+    def append(self, data, timestamp_us):
+        offset = self.size
+        self.data_file.write(data)
+        self.data_file.flush()
+        # 先写数据再写索引，索引中的记录总是指向完整的数据
+        record = np.array([(timestamp_us, offset, len(data))], dtype=INDEX_DTYPE)
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.size += len(data)
+        self.last_us = timestamp_us
+        return offset
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+class SegmentStore:
+    """按设备追加写入的分段存储"""
+
+    def __init__(self, root_dir, max_segment_bytes=256 * 1024 * 1024, max_segment_seconds=3600):
+        self.root_dir = root_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_us = max_segment_seconds * 1_000_000
+        self.writers = {}         # device_id -> SegmentWriter
+        self.device_locks = {}    # device_id -> Lock
+        self.segment_cache = {}   # device_id -> [Segment]，按起始时间排序
+        self.lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def device_dir(self, device_id):
+        return os.path.join(self.root_dir, f"device_{device_id}")
+
+    def device_lock(self, device_id):
+        lock = self.device_locks.get(device_id)
+        if lock is None:
+            with self.lock:
+                lock = self.device_locks.setdefault(device_id, threading.Lock())
+        return lock
+
+    def append(self, device_id, data, timestamp=None):
+        """追加一帧JPEG数据，返回 (段文件路径, 偏移)"""
+        timestamp_us = to_microseconds(time.time() if timestamp is None else timestamp)
+
+        with self.device_lock(device_id):
+            writer = self.writers.get(device_id)
+            if writer is not None:
+                # 保证同一设备的时间戳单调递增，系统时间回拨时不破坏索引有序性
+                timestamp_us = max(timestamp_us, writer.last_us)
+                if (writer.size >= self.max_segment_bytes or
+                        timestamp_us - writer.segment.start_us >= self.max_segment_us):
+                    writer.close()
+                    writer = None
+
+            if writer is None:
+                writer = self.open_segment(device_id, timestamp_us)
+                self.writers[device_id] = writer
+
+            offset = writer.append(data, timestamp_us)
+            return writer.segment.data_path, offset
+
+    def open_segment(self, device_id, start_us):
+        device_dir = self.device_dir(device_id)
+        os.makedirs(device_dir, exist_ok=True)
+
+        segments = self.segments(device_id)
+        # 新段的起始时间必须晚于已有的段
+        if segments and start_us <= segments[-1].start_us:
+            start_us = segments[-1].start_us + 1
+
+        segment = Segment(device_dir, start_us)
+        segments.append(segment)
+        return SegmentWriter(segment)
+
+    def release(self, device_id):
+        """关闭设备当前的段并丢弃缓存的段列表
+
+        多进程模式下设备转到其他进程写入后调用，之后再写入该设备时重新扫描目录
+        """
+        with self.device_lock(device_id):
+            writer = self.writers.pop(device_id, None)
+            if writer is not None:
+                writer.close()
+            self.segment_cache.pop(device_id, None)
+
+    def discard(self, device_id, data_paths):
+        """段文件已被删除（保留策略）后从缓存的段列表中移除"""
+        data_paths = set(data_paths)
+        with self.device_lock(device_id):
+            segments = self.segment_cache.get(device_id)
+            if segments is not None:
+                segments[:] = [segment for segment in segments if segment.data_path not in data_paths]
+
+    def segments(self, device_id):
+        """返回设备的所有段（按起始时间排序），首次访问时扫描一次设备目录"""
+        segments = self.segment_cache.get(device_id)
+        if segments is None:
+            device_dir = self.device_dir(device_id)
+            segments = []
+            if os.path.isdir(device_dir):
+                for name in os.listdir(device_dir):
+                    match = SEGMENT_PATTERN.match(name)
+                    if match:
+                        segments.append(Segment(device_dir, int(match.group(1))))
+            segments.sort(key=lambda segment: segment.start_us)
+            self.segment_cache[device_id] = segments
+        return segments
+
+    def list_devices(self):
+        """返回存储中所有设备ID"""
+        device_ids = set(self.writers)
+        if os.path.isdir(self.root_dir):
+            for name in os.listdir(self.root_dir):
+                match = DEVICE_DIR_PATTERN.match(name)
+                if match:
+                    device_ids.add(int(match.group(1)))
+        return sorted(device_ids)
+
+    def find(self, device_id, start=None, end=None):
+        """按时间范围查找，依次返回 (段, 索引记录数组)
+
+        start/end 为秒级时间戳，包含 start，不包含 end；
+        只读取与时间范围重叠的段的索引，并用二分查找定位
+        """
+        start_us = None if start is None else to_microseconds(start)
+        end_us = None if end is None else to_microseconds(end)
+        segments = self.segments(device_id)
+
+        for position, segment in enumerate(segments):
+            if end_us is not None and segment.start_us >= end_us:
+                break
+            # 下一个段在 start 之前开始，说明当前段不可能包含 start 之后的帧
+            if (start_us is not None and position + 1 < len(segments) and
+                    segments[position + 1].start_us <= start_us):
+                continue
+
+            index = segment.load_index()
+            timestamps = index['timestamp']
+            low = 0 if start_us is None else int(np.searchsorted(timestamps, start_us, 'left'))
+            high = len(index) if end_us is None else int(np.searchsorted(timestamps, end_us, 'left'))
+            if low < high:
+                yield segment, index[low:high]
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+v2 设备的传输统计：端到端延迟、丢帧和乱序
+帧序号由设备为每一帧采集的图像分配（包括设备本地丢弃的帧），
+心跳携带设备最近一帧的序号，用于发现末尾的丢帧。
+
+- 丢帧：序号出现跳跃，跳过的帧计为丢失；之后迟到的帧从丢失中扣除
+- 乱序：序号小于已收到的最大序号（迟到的帧）
+- 序号大幅回退（超过 REORDER_WINDOW）或心跳序号回退，视为设备重启，重新开始计数
+- 延迟：服务器收到消息头的时间减去设备的采集时间，依赖两端时钟同步（NTP）
+"""
+
+import threading
+
+SEQUENCE_MODULUS = 1 << 32
+SEQUENCE_HALF = 1 << 31
+
+# 回退不超过该帧数时视为迟到的帧，否则视为设备重启
+REORDER_WINDOW = 1024
+
+# 延迟滑动平均的权重
+LATENCY_EWMA_ALPHA = 0.1
+
+def sequence_distance(seq, expected):
+    """seq 相对 expected 的距离（考虑32位回绕），正数为超前，负数为落后"""
+    diff = (seq - expected) % SEQUENCE_MODULUS
+    return diff if diff < SEQUENCE_HALF else diff - SEQUENCE_MODULUS
+
+class SequenceStats:
+    """一个设备的传输统计（由连接线程更新，查询状态时读取）"""
+    __slots__ = ('lock', 'expected', 'frames', 'lost', 'reordered', 'resets',
+                 'latency_ewma', 'latency_max', 'latency_last')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.expected = None   # 下一帧的期望序号，None 表示尚未收到带序号的消息
+        self.frames = 0
+        self.lost = 0
+        self.reordered = 0
+        self.resets = 0
+        self.latency_ewma = None
+        self.latency_max = 0.0
+        self.latency_last = None
+
+    def frame(self, seq, latency):
+        """收到一帧图像，返回 (新发现的丢帧数, 是否迟到)"""
+        with self.lock:
+            self.frames += 1
+            self.latency_last = latency
+            self.latency_max = max(self.latency_max, latency)
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+
+            if self.expected is None:
+                self.expected = (seq + 1) % SEQUENCE_MODULUS
+                return 0, False
+            distance = sequence_distance(seq, self.expected)
+            if distance >= 0:
+                self.lost += distance
+                self.expected = (seq + 1) % SEQUENCE_MODULUS
+                return distance, False
+            if -distance <= REORDER_WINDOW:
+                # 之前被计为丢失的帧迟到了
+                self.reordered += 1
+                self.lost = max(self.lost - 1, 0)
+                return 0, True
+            self.reset(seq)
+            return 0, False
+
+    def sync(self, last_seq):
+        """收到心跳，last_seq 为设备最近一帧的序号，返回新发现的丢帧数"""
+        with self.lock:
+            if self.expected is None:
+                self.expected = (last_seq + 1) % SEQUENCE_MODULUS
+                return 0
+            distance = sequence_distance((last_seq + 1) % SEQUENCE_MODULUS, self.expected)
+            if distance > 0:
+                self.lost += distance
+                self.expected = (last_seq + 1) % SEQUENCE_MODULUS
+                return distance
+            if distance < 0:
+                self.reset(last_seq)
+            return 0
+
+    def reset(self, seq):
+        self.resets += 1
+        self.expected = (seq + 1) % SEQUENCE_MODULUS
+
+    def get_status(self):
+        """状态字典中的传输统计字段"""
+        with self.lock:
+            return {
+                'frames_lost': self.lost,
+                'frames_reordered': self.reordered,
+                'sequence_resets': self.resets,
+                'latency_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+                'latency_max_ms': round(self.latency_max * 1000, 1),
+            }
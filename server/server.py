@@ -1,126 +1,779 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import signal
 import socket
-import struct
 import cv2
-import numpy as np
 import configparser
 import os
+import sqlite3
 import sys
 from datetime import datetime, timedelta
 import threading
 import time
 from collections import defaultdict
-
-# 消息类型定义
-MSG_HEARTBEAT = 0x01
-MSG_HEARTBEAT_ACK = 0x02
-MSG_IMAGE_DATA = 0x03
-MSG_REGISTER = 0x04
-MSG_REGISTER_ACK = 0x05
+from concurrent.futures import ProcessPoolExecutor
+
+from frame_pipeline import BufferPool, FramePipeline, decode_and_save, DROP_POLICY_BLOCK, PIPELINE_EXECUTOR_PROCESS
+from jpeg_utils import is_valid_jpeg, read_jpeg_shape
+from jpeg_decoder import DecodedFrame, create_decoder
+from frame_dedup import DEDUP_DECODE_COLOR, DEDUP_DECODE_SCALE, FrameDeduplicator
+from segment_store import INDEX_RECORD_SIZE, SegmentStore
+from event_clips import EventClipBuilder
+from retention import RetentionManager, parse_device_limits, SECONDS_PER_DAY
+from admission import AdmissionControl, REASONS
+from state_store import StateStore
+from udp_heartbeat import UdpHeartbeatListener
+from settings import (
+    LIVE_FIELDS, load_settings,
+    SAVE_MODE_PASSTHROUGH, SERVER_MODE_ASYNCIO, STORAGE_BACKEND_CLIPS, STORAGE_BACKEND_FILES, STORAGE_BACKEND_SEGMENTS
+)
+from deadline_index import DeadlineIndex
+from metrics import Metrics, MetricsServer, StageTimer
+from status_report import StatusReporter, StatusSnapshot, format_device_status, format_offline_report
+from event_log import EventLog, parse_level
+from worker_pool import Supervisor, WorkerChannel, reuse_port_supported
+from display import DISPLAY_WINDOW_NAME, MosaicDisplay, display_available, parse_tile_size
+from preview import PreviewHub, PreviewServer
+from sequence_stats import SequenceStats
+from protocol import (
+    AckTracker, MessageParser, ProtocolError, negotiate_version, pack_header, parse_register,
+    MSG_HEARTBEAT, MSG_HEARTBEAT_ACK, MSG_IMAGE_DATA, MSG_REGISTER, MSG_REGISTER_ACK,
+    PROTOCOL_V1, PROTOCOL_V2, READ_CHUNK_SIZE, SERVER_MESSAGE_TYPES
+)
+
+# 连接数达到上限时，拒绝连接的日志最短输出间隔（秒）
+REJECT_LOG_INTERVAL = 10
+
+# 设备监控线程每轮最短的等待时间（秒），检查间隔设置为 0 时也不会空转
+MIN_MONITOR_WAIT = 0.1
+
+def clock_reference():
+    """同一时刻的 (单调时钟, 本地时间)，用于把单调时钟时间换算为本地时间"""
+    return time.monotonic(), datetime.now()
+
+def monotonic_to_datetime(monotonic_time, reference=None):
+    """将单调时钟时间换算为本地时间（仅在需要显示时调用）"""
+    monotonic_now, wall_now = reference or clock_reference()
+    return wall_now - timedelta(seconds=monotonic_now - monotonic_time)
 
 class DeviceInfo:
-    """设备信息类"""
+    """设备信息类
+
+    只保存单调时钟时间戳和计数，心跳处理不分配 datetime 对象，
+    本地时间和字符串仅在查询状态时才计算
+    """
+    __slots__ = ('device_id', 'device_name', 'location', 'address', 'connected', 'session_open',
+                 'image_count', 'heartbeat_count', 'last_heartbeat_monotonic', 'register_time_monotonic',
+                 'protocol_version', 'sequence')
+
     def __init__(self, device_id, device_name, location, address):
         self.device_id = device_id
         self.device_name = device_name
         self.location = location
         self.address = address
-        self.last_heartbeat = datetime.now()
-        self.connected = True
+        self.connected = True      # 在线（心跳未超时）
+        self.session_open = True   # TCP 连接未断开（与心跳超时无关）
         self.image_count = 0
-        self.register_time = datetime.now()
+        self.heartbeat_count = 0
+        now = time.monotonic()
+        self.last_heartbeat_monotonic = now  # 用于超时判断，不受系统时间调整影响
+        self.register_time_monotonic = now
+        self.protocol_version = PROTOCOL_V1
+        self.sequence = SequenceStats()  # v2 设备的延迟、丢帧和乱序统计
+
+    @property
+    def last_heartbeat(self):
+        return monotonic_to_datetime(self.last_heartbeat_monotonic)
+
+    @property
+    def register_time(self):
+        return monotonic_to_datetime(self.register_time_monotonic)
 
     def update_heartbeat(self):
         """更新心跳时间"""
-        self.last_heartbeat = datetime.now()
+        self.last_heartbeat_monotonic = time.monotonic()
         self.connected = True
 
+    def seconds_since_heartbeat(self):
+        return time.monotonic() - self.last_heartbeat_monotonic
+
     def is_alive(self, timeout_seconds):
         """检查设备是否在线"""
-        elapsed = (datetime.now() - self.last_heartbeat).total_seconds()
-        return elapsed < timeout_seconds
+        return self.seconds_since_heartbeat() < timeout_seconds
+
+    def get_status(self, reference=None):
+        """获取设备状态信息
 
-    def get_status(self):
-        """获取设备状态信息"""
-        elapsed = (datetime.now() - self.last_heartbeat).total_seconds()
-        return {
+        批量查询时可传入同一个 clock_reference()，避免每台设备重复读取时钟
+        """
+        reference = reference or clock_reference()
+        elapsed = reference[0] - self.last_heartbeat_monotonic
+        status = {
             'device_id': self.device_id,
             'device_name': self.device_name,
             'location': self.location,
             'address': self.address,
             'connected': self.connected,
-            'last_heartbeat': self.last_heartbeat.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_heartbeat': monotonic_to_datetime(self.last_heartbeat_monotonic, reference).strftime('%Y-%m-%d %H:%M:%S'),
             'elapsed_seconds': int(elapsed),
             'image_count': self.image_count,
-            'register_time': self.register_time.strftime('%Y-%m-%d %H:%M:%S')
+            'heartbeat_count': self.heartbeat_count,
+            'register_time': monotonic_to_datetime(self.register_time_monotonic, reference).strftime('%Y-%m-%d %H:%M:%S'),
+            'protocol_version': self.protocol_version
         }
+        if self.protocol_version >= PROTOCOL_V2:
+            status.update(self.sequence.get_status())
+        return status
+
+    def to_row(self, reference):
+        """状态快照中的一行（时间换算为 Unix 时间戳），reference 为同一时刻的 (单调时钟, Unix 时间)"""
+        offset = reference[1] - reference[0]
+        address = self.address if isinstance(self.address, str) else ':'.join(map(str, self.address or ()))
+        return (self.device_id, self.device_name, self.location, address, self.protocol_version,
+                self.image_count, self.heartbeat_count, round(self.register_time_monotonic + offset, 1),
+                round(self.last_heartbeat_monotonic + offset, 1))
+
+    @classmethod
+    def from_row(cls, row, reference):
+        """从状态快照恢复（离线状态），reference 同 to_row()"""
+        device_id, name, location, address, version, image_count, heartbeat_count, register_time, last_seen = row
+        offset = reference[1] - reference[0]
+        device = cls(device_id, name, location, address)
+        device.connected = False
+        device.session_open = False
+        device.protocol_version = version
+        device.image_count = image_count
+        device.heartbeat_count = heartbeat_count
+        device.register_time_monotonic = register_time - offset
+        device.last_heartbeat_monotonic = last_seen - offset
+        return device
+
+def create_event_log(settings, source=None):
+    """根据设置创建并启动事件日志（后台线程写出），并输出设置校验时发现的问题"""
+    # 行缓冲：多个工作进程追加写同一个文件时，每行一次写入，不会互相截断
+    stream = open(settings.log_file, 'a', encoding='utf-8', buffering=1) if settings.log_file else None
+
+    log = EventLog(
+        level=parse_level(settings.log_level),
+        log_format=settings.log_format,
+        stream=stream,
+        queue_size=settings.log_queue_size,
+        summary_interval=settings.log_summary_interval,
+        device_rate=settings.log_device_rate,
+        source=source
+    )
+    log.start()
+    for warning in settings.warnings:
+        log.warning('config', warning)
+    return log, stream
 
 class ImageServer:
-    def __init__(self, config_file='config/server_config.ini'):
-        self.config = self.load_config(config_file)
+    def __init__(self, config_file='config/server_config.ini', worker=None):
+        # worker 为 WorkerChannel 时作为多进程模式下的工作进程运行
+        self.worker = worker
+        self.config_file = config_file
+        # 类型化的只读设置，收到 SIGHUP 时整体替换（见 reload_settings）
+        self.settings = settings = load_settings(config_file, verbose=worker is None)
+        self.log, self.log_stream = create_event_log(settings, f"worker-{worker.index}" if worker else None)
         self.server_socket = None
         self.running = False
-        self.save_images = self.config.getboolean('server', 'save_images', fallback=True)
-        self.save_dir = self.config.get('server', 'save_dir', fallback='received_images')
-        self.heartbeat_timeout = self.config.getint('server', 'heartbeat_timeout', fallback=90)
-        self.check_interval = self.config.getint('server', 'check_interval', fallback=10)
+        self.decoder, warning = create_decoder(settings.jpeg_decoder)
+        if warning:
+            self.log.warning('config', warning)
+        self.status_reporter = StatusReporter(settings.status_report_interval)
+        self.reload_event = threading.Event()
+        self.reload_thread = None
 
         # 设备管理
+        # devices 采用写时复制：新增设备时替换为新字典，读取方无需加锁即可遍历
         self.devices = {}  # device_id -> DeviceInfo
-        self.device_lock = threading.Lock()
-
-        if self.save_images and not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
+        self.device_lock = threading.Lock()  # 串行化写入方
+        self.registry_version = 0            # 设备注册/上下线时递增
+        self.deadline_index = DeadlineIndex(settings.heartbeat_timeout)  # 心跳超时截止时间
+
+        # 状态快照：设备注册表和存储占用索引，重启后从快照恢复
+        self.state_store = self.open_state_store()
+        self.state_rows = {}   # device_id -> 上次写入快照的行，只写入有变化的设备
+        self.state_wakeup = threading.Event()
+        self.state_thread = None
+        if self.state_store is not None and not self.worker:
+            # 多进程模式下设备分散在各工作进程中，注册时再从快照恢复
+            self.restore_devices()
+
+        # 存储（save_images 关闭时不创建，重新加载设置打开后再创建）
+        self.known_dirs = set()  # 已创建的设备目录，避免每帧检查
+        self.segment_store = None
+        self.event_builder = None
+        self.retention = None
+        self.deduplicator = None  # 相似帧检测：与最近保留的帧几乎相同的图像不保存
+        self.setup_storage()
+
+        # 接收准入控制：同时连接数上限、每个设备的限速、全局在途内存预算
+        self.max_clients = self.worker_share(settings.max_clients)
+        self.connection_lock = threading.Lock()
+        self.connections = 0
+        self.connections_rejected = 0
+        self.rejects_logged = (0.0, 0)  # 上次输出拒绝连接日志的时间和当时的拒绝数
+        # 始终统计在途内存，重新加载设置时可以随时开启或修改限制
+        self.admission = AdmissionControl(log=self.log, **self.admission_limits())
+
+        # 图像处理流水线（pipeline_workers = 0 时在连接线程中直接处理）
+        self.pipeline = None
+        self.buffer_pool = None
+        self.process_pool = None
+        self.setup_pipeline()
+
+        self.monitor_thread = None
+
+        # 运行指标（始终记录，metrics_port > 0 时通过HTTP输出）
+        self.metrics = Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+        self.metrics_server = None
+
+        # 实时预览：各设备最新的JPEG原样转发给浏览器（preview_port > 0 时启动）
+        self.preview_hub = PreviewHub(is_registered=self.is_registered)
+        self.preview_server = None
+
+        # UDP 心跳通道（udp_heartbeat_port > 0 时启动，仅单进程模式）
+        self.udp_listener = None
+
+        # 图像显示：所有设备拼接在一个窗口中，由独立的显示线程刷新
+        self.display = self.create_display()
+
+        if self.worker:
+            self.worker.start(self.handle_supervisor_command)
+
+    def worker_share(self, value):
+        """多进程模式下每个工作进程分得的份额（向上取整）"""
+        return max(1, -(-value // self.settings.server_workers)) if self.worker else value
+
+    def setup_storage(self):
+        """按设置创建存储后端、保留策略和相似帧检测（已创建的不重复创建）"""
+        settings = self.settings
+        if not settings.save_images:
+            return
+        os.makedirs(settings.save_dir, exist_ok=True)
+        if settings.storage_backend == STORAGE_BACKEND_SEGMENTS and self.segment_store is None:
+            self.segment_store = SegmentStore(
+                settings.save_dir,
+                max_segment_bytes=settings.segment_max_mb * 1024 * 1024,
+                max_segment_seconds=settings.segment_max_seconds
+            )
+        if settings.storage_backend == STORAGE_BACKEND_CLIPS and self.event_builder is None:
+            self.event_builder = EventClipBuilder(
+                settings.save_dir,
+                gap=settings.clip_gap_seconds,
+                max_seconds=settings.clip_max_seconds,
+                codec=settings.clip_codec,
+                fps=settings.clip_fps,
+                workers=settings.clip_workers,
+                max_pending_frames=settings.clip_max_pending_frames,
+                decoder=self.decoder,
+                on_encode=lambda seconds: self.metrics.observe('clip_encode', seconds),
+                on_clip=self.record_clip,
+                log=self.log
+            )
+            if self.running:
+                self.event_builder.start()
+        if self.retention is None:
+            self.retention = self.create_retention()
+            if self.retention is not None and self.running:
+                self.retention.start()
+        if settings.dedup_enabled and self.deduplicator is None:
+            self.deduplicator = FrameDeduplicator(
+                threshold=settings.dedup_threshold,
+                history=settings.dedup_history,
+                keep_interval=settings.dedup_keep_interval
+            )
+
+    def create_display(self):
+        """按设置创建图像显示，display_images 关闭或没有图形界面时返回 None"""
+        settings = self.settings
+        if not settings.display_images:
+            return None
+        if not display_available():
+            self.log.warning('config', "未检测到图形界面（DISPLAY），不显示图像")
+            return None
+        return MosaicDisplay(
+            max_fps=settings.display_fps,
+            tile_size=parse_tile_size(settings.display_tile_size),
+            max_tiles=settings.display_max_tiles,
+            stale_seconds=max(settings.heartbeat_timeout, 5),
+            window_name=f"{DISPLAY_WINDOW_NAME} - worker {self.worker.index}" if self.worker else DISPLAY_WINDOW_NAME,
+            decoder=self.decoder,
+            on_render=lambda seconds: self.metrics.observe('display', seconds),
+            log=self.log
+        )
+
+    def open_state_store(self):
+        """打开状态快照数据库，未设置 state_file 或打开失败时返回 None"""
+        path = self.settings.state_file
+        if not path:
+            return None
+        store = StateStore(path, f"worker-{self.worker.index}" if self.worker else 'main')
+        try:
+            store.open(self.settings.save_dir if self.settings.save_images else None)
+        except (sqlite3.Error, OSError) as e:
+            self.log.warning('state', f"状态快照不可用 ({path}): {e}")
+            return None
+        return store
+
+    def restore_devices(self):
+        """从状态快照恢复设备注册表（均为离线状态，重新连接后上线）"""
+        try:
+            rows = self.state_store.load_devices()
+        except sqlite3.Error as e:
+            self.log.warning('state', f"读取状态快照失败: {e}")
+            return
+        reference = (time.monotonic(), time.time())
+        devices = {}
+        for row in rows:
+            device = DeviceInfo.from_row(row, reference)
+            devices[device.device_id] = device
+            self.state_rows[device.device_id] = row
+        with self.device_lock:
+            self.devices = devices
+            self.registry_version += 1
+        if devices:
+            self.log.info('state', f"从状态快照恢复{len(devices)}个设备"
+                          f"{'' if self.state_store.clean else '（上次未正常退出）'}",
+                          devices=len(devices), clean=self.state_store.clean)
+
+    def save_state(self):
+        """写入一次状态快照：有变化的设备注册信息和存储索引"""
+        store = self.state_store
+        if store is None:
+            return
+        started = time.perf_counter()
+        reference = (time.monotonic(), time.time())
+        rows = [row for row in (device.to_row(reference) for device in self.devices.values())
+                if self.state_rows.get(row[0]) != row]
+        storage = self.retention.collect_state() if self.retention is not None else []
+        try:
+            store.save(rows, storage)
+        except sqlite3.Error as e:
+            if self.retention is not None:
+                self.retention.state_failed(storage)
+            self.log.warning('state', f"状态快照写入失败: {e}")
+            return
+        for row in rows:
+            self.state_rows[row[0]] = row
+        self.metrics.observe('state_snapshot', time.perf_counter() - started)
+
+    def run_state_snapshots(self):
+        """定期写入状态快照"""
+        while not self.state_wakeup.wait(self.settings.state_snapshot_interval):
+            self.save_state()
+
+    def admission_limits(self):
+        """按设置计算准入控制的各项限制（0 表示不限制，对应 None）"""
+        settings = self.settings
+        max_inflight_mb = settings.admission_max_inflight_mb
+        if self.worker:
+            # 每个设备只连接到一个工作进程，在途内存预算按进程数平分
+            max_inflight_mb /= settings.server_workers
+        return dict(
+            max_fps=settings.admission_max_fps or None,
+            max_bytes_per_second=settings.admission_max_kb_per_second * 1024 or None,
+            burst_seconds=settings.admission_burst_seconds,
+            max_inflight_bytes=int(max_inflight_mb * 1024 * 1024) or None
+        )
+
+    def retention_limits(self):
+        """按设置计算存储配额的各项限制，未设置任何限制时返回 None"""
+        settings = self.settings
+        max_mb = settings.retention_max_mb
+        device_limits = parse_device_limits(settings.retention_device_limits)
+        if not (max_mb or settings.retention_device_max_mb or settings.retention_max_days or device_limits):
+            return None
+        if self.worker:
+            # 多进程模式下每个工作进程只管理自己写入的设备，总容量按进程数平分
+            max_mb /= settings.server_workers
+        return dict(
+            max_bytes=int(max_mb * 1024 * 1024) or None,
+            device_max_bytes=int(settings.retention_device_max_mb * 1024 * 1024) or None,
+            max_age=settings.retention_max_days * SECONDS_PER_DAY or None,
+            device_limits=device_limits,
+            interval=settings.retention_interval,
+            batch_size=settings.retention_batch_size
+        )
+
+    def create_retention(self):
+        """根据设置创建存储配额管理，未设置任何限制时返回 None"""
+        limits = self.retention_limits()
+        if limits is None:
+            return None
+        return RetentionManager(
+            self.settings.save_dir,
+            scan_all=self.worker is None,
+            on_evict=self.handle_evicted,
+            state=self.state_store,
+            # 上次未正常退出时核对目录；多进程模式下设备可能曾由其他工作进程写入，总是核对
+            verify_state=self.worker is not None or self.state_store is None or not self.state_store.clean,
+            log=self.log,
+            **limits
+        )
+
+    def record_clip(self, event, size):
+        """视频片段编码完成（后台线程）：计入存储占用"""
+        if self.retention is not None:
+            self.retention.record(event.device_id, event.clip_path, size, timestamp=event.last_us / 1_000_000,
+                                  paths=(event.clip_path, event.keyframe_path), start=event.start_us / 1_000_000)
+
+    def handle_evicted(self, device_id, items):
+        """保留策略删除文件后，更新分段存储的段列表和视频片段的事件索引"""
+        paths = [item.paths[0] for item in items]
+        if self.segment_store is not None:
+            self.segment_store.discard(device_id, paths)
+        if self.event_builder is not None:
+            self.event_builder.prune_index(device_id, paths)
+
+    def setup_pipeline(self):
+        """根据配置创建解码/保存流水线"""
+        workers = self.settings.pipeline_workers
+        if workers <= 0:
+            return
 
-        # 启动设备监控线程
-        self.monitor_thread = threading.Thread(target=self.monitor_devices, daemon=True)
-        self.monitor_thread.start()
+        executor = self.settings.pipeline_executor
+        drop_policy = self.settings.pipeline_drop_policy
+        queue_size = self.settings.pipeline_queue_size
+        device_queue_size = self.settings.pipeline_device_queue_size
 
-    def load_config(self, config_file):
-        config = configparser.ConfigParser()
-
-        # 默认配置
-        config['server'] = {
-            'host': '0.0.0.0',
-            'port': '8888',
-            'save_images': 'true',
-            'save_dir': 'received_images',
-            'display_images': 'true',
-            'max_clients': '10',
-            'heartbeat_timeout': '90',
-            'check_interval': '10'
-        }
+        if executor == PIPELINE_EXECUTOR_PROCESS:
+            self.process_pool = ProcessPoolExecutor(max_workers=workers)
+            handler = self.process_job_in_process
+        else:
+            handler = self.process_job
+
+        self.buffer_pool = BufferPool(queue_size + workers)
+        self.pipeline = FramePipeline(
+            handler,
+            workers=workers,
+            queue_size=queue_size,
+            device_queue_size=device_queue_size,
+            drop_policy=drop_policy,
+            buffer_pool=self.buffer_pool,
+            on_release=self.release_inflight,
+            log=self.log
+        )
+        self.pipeline.start()
+        self.log.info('pipeline', f"图像处理流水线: {workers}个{executor}工作者, 队列上限{queue_size}帧, 策略: {drop_policy}",
+                      workers=workers, executor=executor, queue_size=queue_size, drop_policy=drop_policy)
 
-        if os.path.exists(config_file):
-            config.read(config_file, encoding='utf-8')
-            print(f"配置文件加载成功: {config_file}")
+    def start(self):
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self.request_reload)
+        if self.settings.server_mode == SERVER_MODE_ASYNCIO:
+            self.start_asyncio()
         else:
-            print(f"配置文件不存在，使用默认配置")
+            self.start_threaded()
 
-        return config
+    def start_monitor(self):
+        """启动设备监控线程（需在 running 置位之后调用）"""
+        self.monitor_thread = threading.Thread(target=self.monitor_devices, daemon=True)
+        self.monitor_thread.start()
+        if self.display is not None:
+            self.display.start()
+        if self.event_builder is not None:
+            self.event_builder.start()
+        if self.retention is not None:
+            self.retention.start()
+        if self.state_store is not None and self.settings.state_snapshot_interval > 0:
+            self.state_thread = threading.Thread(target=self.run_state_snapshots, name='state', daemon=True)
+            self.state_thread.start()
+        self.reload_thread = threading.Thread(target=self.run_reload, name='reload', daemon=True)
+        self.reload_thread.start()
+        self.start_metrics_server()
+        self.start_preview_server()
+        self.start_udp_heartbeat()
+
+    def request_reload(self, signum=None, frame=None):
+        """SIGHUP 处理函数：只唤醒重新加载线程，不在信号处理中获取其他锁"""
+        self.reload_event.set()
+
+    def run_reload(self):
+        """重新加载线程：收到 SIGHUP 后重新读取配置文件"""
+        while True:
+            self.reload_event.wait()
+            self.reload_event.clear()
+            if not self.running:
+                return
+            self.reload_settings()
 
-    def start(self):
-        host = self.config.get('server', 'host')
-        port = self.config.getint('server', 'port')
+    def reload_settings(self):
+        """重新读取配置文件，立即应用 LIVE_FIELDS 中的设置（不断开设备连接），返回修改的设置项
+
+        新设置对象整体替换旧对象；需要重启才能生效的项保持当前值并输出提示
+        """
+        try:
+            settings = load_settings(self.config_file, verbose=False)
+        except configparser.Error as e:
+            self.log.error('reload', f"配置文件读取失败，保持当前设置: {e}")
+            return []
+        old = self.settings
+        for warning in settings.warnings:
+            self.log.warning('config', warning)
+        changed = settings.changed(old)
+        restart = [name for name in changed if name not in LIVE_FIELDS]
+        if restart:
+            self.log.warning('reload', f"以下设置需要重启服务器才能生效: {', '.join(restart)}", fields=restart)
+            settings = settings.replace(**{name: getattr(old, name) for name in restart})
+        live = [name for name in changed if name in LIVE_FIELDS]
+        self.settings = settings
+        self.apply_settings(settings, set(live))
+        self.log.info('reload', f"设置已重新加载{': ' + ', '.join(live) if live else '，没有可立即生效的修改'}",
+                      changed=live)
+        return live
+
+    def apply_settings(self, settings, changed):
+        """把修改后的设置应用到运行中的组件（处理代码每次直接读取的项无需处理）"""
+        if 'heartbeat_timeout' in changed:
+            self.deadline_index.set_timeout(settings.heartbeat_timeout)
+        if 'status_report_interval' in changed:
+            self.status_reporter.min_interval = settings.status_report_interval
+        if 'max_clients' in changed:
+            self.max_clients = self.worker_share(settings.max_clients)
+        if any(name.startswith('admission_') for name in changed):
+            self.admission.configure(**self.admission_limits())
+        if 'log_level' in changed:
+            self.log.level = parse_level(settings.log_level)
+        if 'log_device_rate' in changed:
+            self.log.device_rate = settings.log_device_rate
+        if any(name.startswith('retention_') for name in changed) and self.retention is not None:
+            self.retention.configure(**(self.retention_limits() or {}))
+        # 开启保存或新设置了保留策略时创建相应组件
+        self.setup_storage()
+        if 'display_images' in changed:
+            if settings.display_images and self.display is None:
+                display = self.create_display()
+                if display is not None:
+                    display.start()
+                    self.display = display
+            elif not settings.display_images and self.display is not None:
+                # 处理线程先读出 self.display 再使用，置为 None 后停止的显示不会再收到新帧
+                display, self.display = self.display, None
+                display.stop()
+
+    def start_metrics_server(self):
+        """启动指标HTTP服务（metrics_port 为 0 时不启动）"""
+        host = self.settings.metrics_host
+        port = self.settings.metrics_port
+        if port <= 0:
+            return
+        if self.worker:
+            # 多进程模式下第 i 个工作进程使用 metrics_port + i
+            port += self.worker.index
+        try:
+            self.metrics_server = MetricsServer(self.metrics, host, port)
+            self.metrics_server.start()
+            self.log.info('metrics', f"指标服务: http://{host}:{port}/metrics")
+        except OSError as e:
+            self.metrics_server = None
+            self.log.error('metrics', f"指标服务启动失败 ({host}:{port}): {e}")
+
+    def start_udp_heartbeat(self):
+        """启动 UDP 心跳接收（udp_heartbeat_port 为 0 时不启动）
+
+        多进程模式下不启动：SO_REUSEPORT 按来源地址分配数据报，无法送到负责该设备的工作进程
+        """
+        port = self.settings.udp_heartbeat_port
+        if port <= 0 or self.worker:
+            return
+        host = self.settings.host
+        try:
+            self.udp_listener = UdpHeartbeatListener(host, port, self.handle_udp_heartbeats,
+                                                     batch_size=self.settings.udp_heartbeat_batch_size,
+                                                     log=self.log)
+            self.udp_listener.start()
+            self.log.info('udp_heartbeat', f"UDP 心跳: {host}:{port}")
+        except OSError as e:
+            self.udp_listener = None
+            self.log.error('udp_heartbeat', f"UDP 心跳端口绑定失败 ({host}:{port}): {e}")
+
+    def handle_udp_heartbeats(self, batch):
+        """一批 UDP 心跳（接收线程）：一次加锁更新所有设备，返回被接受的 (device_id, 来源IP) 集合
+
+        只接受 TCP 连接未断开、来源IP与 TCP 连接相同的设备；心跳超时离线的设备收到心跳后重新上线
+        """
+        now = time.monotonic()
+        accepted = set()
+        counts = {}
+        online = 0
+        with self.device_lock:
+            devices = self.devices
+            for key, count in batch.items():
+                device = devices.get(key[0])
+                if device is None or not device.session_open or device.address[0] != key[1]:
+                    continue
+                accepted.add(key)
+                if not count:
+                    continue
+                if not device.connected:
+                    device.connected = True
+                    online += 1
+                device.last_heartbeat_monotonic = now
+                device.heartbeat_count += count
+                counts[key[0]] = count
+            if online:
+                self.registry_version += 1
+        if counts:
+            self.deadline_index.touch_many(counts, now)
+            self.metrics.inc_many('heartbeats_total', counts)
+        return accepted
+
+    def start_preview_server(self):
+        """启动实时预览HTTP服务（preview_port 为 0 时不启动）"""
+        host = self.settings.preview_host
+        port = self.settings.preview_port
+        if port <= 0:
+            return
+        if self.worker:
+            # 与指标端口相同：第 i 个工作进程使用 preview_port + i，只能看到连接到本进程的设备
+            port += self.worker.index
+        try:
+            self.preview_server = PreviewServer(
+                self.preview_hub, host, port, self.list_preview_devices,
+                max_fps=self.settings.preview_max_fps
+            )
+            self.preview_server.start()
+            self.log.info('preview', f"实时预览: http://{host}:{port}/")
+        except OSError as e:
+            self.preview_server = None
+            self.log.error('preview', f"实时预览服务启动失败 ({host}:{port}): {e}")
+
+    def is_registered(self, device_id):
+        return device_id in self.devices
+    def list_preview_devices(self):
+        return [(device_id, device.device_name) for device_id, device in sorted(self.devices.items())
+                if device.connected]
+
+    def collect_metrics(self):
+        """导出指标时采集的即时值"""
+        devices = self.devices
+        online = sum(1 for device in devices.values() if device.connected)
+        samples = [
+            ('devices', 'gauge', "已注册设备数", [({'state': 'online'}, online),
+                                                  ({'state': 'offline'}, len(devices) - online)]),
+        ]
+        pipeline_stats = self.get_pipeline_stats()
+        if pipeline_stats:
+            samples.append(('pipeline_queue_depth', 'gauge', "处理队列中等待的帧数",
+                            [({'device': device_id}, stats['queue_depth'])
+                             for device_id, stats in sorted(pipeline_stats.items())]))
+            samples.append(('pipeline_dropped_total', 'counter', "处理队列丢弃的帧数",
+                            [({'device': device_id}, stats['dropped'])
+                             for device_id, stats in sorted(pipeline_stats.items())]))
+        sequence_stats = [(device_id, device.sequence.get_status()) for device_id, device in sorted(devices.items())
+                          if device.protocol_version >= PROTOCOL_V2]
+        if sequence_stats:
+            samples.append(('device_frames_lost', 'gauge', "v2 设备按帧序号统计的丢帧数（迟到的帧会被扣除）",
+                            [({'device': device_id}, stats['frames_lost']) for device_id, stats in sequence_stats]))
+            samples.append(('device_latency_seconds', 'gauge', "v2 设备采集到服务器收到的延迟（滑动平均）",
+                            [({'device': device_id}, stats['latency_ms'] / 1000)
+                             for device_id, stats in sequence_stats if stats['latency_ms'] is not None]))
+        display = self.display
+        if display is not None:
+            display_stats = sorted(display.get_stats().items())
+            samples.append(('display_skipped_total', 'counter', "未显示就被新帧覆盖的帧数",
+                            [({'device': device_id}, stats['skipped']) for device_id, stats in display_stats]))
+        if self.event_builder is not None:
+            clip_stats = sorted(self.event_builder.get_stats().items())
+            samples.append(('events_total', 'counter', "已编码为视频片段的运动事件数",
+                            [({'device': device_id}, stats['events']) for device_id, stats in clip_stats]))
+            samples.append(('clip_dropped_total', 'counter', "视频编码积压而丢弃的帧数",
+                            [({'device': device_id}, stats['clip_dropped']) for device_id, stats in clip_stats]))
+            samples.append(('clip_pending_frames', 'gauge', "等待后台编码的帧数",
+                            [({}, self.event_builder.pending_frames)]))
+        if self.retention is not None:
+            retention_stats = sorted(self.retention.get_stats().items())
+            samples.append(('storage_bytes', 'gauge', "设备已保存数据占用的字节数",
+                            [({'device': device_id}, stats['bytes']) for device_id, stats in retention_stats]))
+            samples.append(('retention_evicted_total', 'counter', "保留策略删除的文件（段、视频片段）数",
+                            [({'device': device_id}, stats['evicted']) for device_id, stats in retention_stats]))
+            samples.append(('retention_evicted_bytes_total', 'counter', "保留策略删除的字节数",
+                            [({'device': device_id}, stats['evicted_bytes'])
+                             for device_id, stats in retention_stats]))
+            samples.append(('retention_index_ready', 'gauge', "已有存档的占用统计是否已加载完成（扫描或从快照加载）",
+                            [({}, int(self.retention.scanned))]))
+        if self.deduplicator is not None:
+            dedup_stats = sorted(self.deduplicator.get_stats().items())
+            samples.append(('dedup_dropped_total', 'counter', "与最近保留的帧相似而未保存的帧数",
+                            [({'device': device_id}, stats['dedup_dropped']) for device_id, stats in dedup_stats]))
+            samples.append(('dedup_bytes_saved_total', 'counter', "相似帧未保存而节省的字节数",
+                            [({'device': device_id}, stats['dedup_bytes_saved'])
+                             for device_id, stats in dedup_stats]))
+        if self.preview_server is not None:
+            preview_stats = sorted(self.preview_hub.get_stats().items())
+            samples.append(('preview_viewers', 'gauge', "实时预览的观看者数",
+                            [({'device': device_id}, stats['viewers']) for device_id, stats in preview_stats]))
+            samples.append(('preview_skipped_total', 'counter', "观看者网络较慢而跳过的帧数",
+                            [({'device': device_id}, stats['skipped']) for device_id, stats in preview_stats]))
+        samples.append(('connections', 'gauge', "当前连接数", [({}, self.connections)]))
+        samples.append(('connections_rejected_total', 'counter', "连接数达到 max_clients 而拒绝的连接数",
+                        [({}, self.connections_rejected)]))
+        if self.admission.enabled:
+            admission_stats = sorted(self.admission.get_stats().items())
+            samples.append(('admission_dropped_total', 'counter', "超出准入限制而丢弃的帧数（按原因）",
+                            [({'device': device_id, 'reason': reason}, stats['dropped'][reason])
+                             for device_id, stats in admission_stats for reason in REASONS]))
+            samples.append(('admission_dropped_bytes_total', 'counter', "超出准入限制而丢弃的字节数",
+                            [({'device': device_id}, stats['dropped_bytes']) for device_id, stats in admission_stats]))
+            samples.append(('inflight_bytes', 'gauge', "已接收但尚未处理完的图像字节数",
+                            [({}, self.admission.inflight_bytes)]))
+        if self.udp_listener is not None:
+            udp_stats = self.udp_listener.get_stats()
+            samples.append(('udp_heartbeat_datagrams_total', 'counter', "收到的 UDP 心跳数据报（按结果）",
+                            [({'result': 'accepted'}, udp_stats['received'] - udp_stats['malformed']
+                              - udp_stats['duplicates'] - udp_stats['rejected']),
+                             ({'result': 'rejected'}, udp_stats['rejected']),
+                             ({'result': 'malformed'}, udp_stats['malformed']),
+                             ({'result': 'duplicate'}, udp_stats['duplicates'])]))
+            samples.append(('udp_heartbeats_lost_total', 'counter', "按序号统计的丢失的 UDP 心跳数",
+                            [({}, udp_stats['lost'])]))
+            samples.append(('udp_heartbeat_batches_total', 'counter', "UDP 心跳的处理批数",
+                            [({}, udp_stats['batches'])]))
+        samples.append(('log_dropped_total', 'counter', "日志队列已满时丢弃的日志条数",
+                        [({}, self.log.dropped)]))
+        return samples
+
+    def print_startup_info(self, host, port):
+        """打印启动信息"""
+        self.log.info('startup', "\n".join([
+            f"服务器启动成功，监听 {host}:{port}",
+            f"运行模式: {self.settings.server_mode}",
+            f"心跳超时设置: {self.settings.heartbeat_timeout}秒",
+            f"设备检查间隔: {self.settings.check_interval}秒",
+            *([f"UDP 心跳端口: {self.udp_listener.port}"] if self.udp_listener is not None else []),
+            "=" * 60
+        ]), host=host, port=port, server_mode=self.settings.server_mode)
+
+    def start_threaded(self):
+        """线程模式：每个客户端连接一个线程"""
+        host = self.settings.host
+        port = self.settings.port
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.worker:
+            # 多个工作进程绑定同一端口，由内核分配连接
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         try:
             self.server_socket.bind((host, port))
-            self.server_socket.listen(self.config.getint('server', 'max_clients'))
+            self.server_socket.listen(self.settings.max_clients)
             self.running = True
-            print(f"服务器启动成功，监听 {host}:{port}")
-            print(f"心跳超时设置: {self.heartbeat_timeout}秒")
-            print(f"设备检查间隔: {self.check_interval}秒")
-            print("=" * 60)
+            self.start_monitor()
+            self.print_startup_info(host, port)
 
             while self.running:
                 try:
                     client_socket, client_address = self.server_socket.accept()
-                    print(f"\n新客户端连接: {client_address}")
+                    if not self.open_connection(client_address):
+                        client_socket.close()
+                        continue
+                    self.log.debug('connect', f"新客户端连接: {client_address}", address=client_address)
 
                     # 为每个客户端创建新线程
                     client_thread = threading.Thread(
@@ -131,225 +784,701 @@ class ImageServer:
                     client_thread.start()
 
                 except KeyboardInterrupt:
-                    print("\n接收到中断信号，正在关闭服务器...")
+                    self.log.info('shutdown', "接收到中断信号，正在关闭服务器...")
                     break
                 except Exception as e:
                     if self.running:
-                        print(f"接受连接时出错: {e}")
+                        self.log.error('accept', f"接受连接时出错: {e}")
 
         finally:
             self.stop()
 
-    def handle_client(self, client_socket, client_address):
-        """处理单个客户端连接"""
+    def start_asyncio(self):
+        """异步模式：单个事件循环处理所有客户端连接"""
+        try:
+            asyncio.run(self.serve_asyncio())
+        finally:
+            self.stop()
+
+    async def serve_asyncio(self):
+        host = self.settings.host
+        port = self.settings.port
+
+        server = await asyncio.start_server(
+            self.handle_client_async, host, port,
+            backlog=self.settings.max_clients,
+            reuse_address=True,
+            reuse_port=self.worker is not None
+        )
+        self.running = True
+        self.start_monitor()
+        self.print_startup_info(host, port)
+
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client_async(self, reader, writer):
+        """异步处理单个客户端连接，消息格式与线程模式完全相同"""
+        client_address = writer.get_extra_info('peername')
+        if not self.open_connection(client_address):
+            writer.close()
+            return
+        self.log.debug('connect', f"新客户端连接: {client_address}", address=client_address)
+        loop = asyncio.get_running_loop()
+        parser = self.create_parser()
+        acks = AckTracker()
         device_id = None
         try:
             while self.running:
-                # 接收消息头（8字节）
-                header_data = self.recv_all(client_socket, 8)
-                if not header_data:
+                data = await reader.read(READ_CHUNK_SIZE)
+                if not data:
                     break
 
-                msg_type, reserved, dev_id, data_length = struct.unpack('!BBHI', header_data)
-                device_id = dev_id
+                for message in parser.feed(data):
+                    device_id = message.device_id
+                    self.record_sequence(message, acks)
+                    if message.payload is None:
+                        # 未通过准入控制，数据已丢弃
+                        continue
+                    if message.msg_type != MSG_IMAGE_DATA:
+                        self.handle_message(writer.write, message, client_address)
+                    elif self.pipeline is None:
+                        # 解码和保存是阻塞操作，放到线程池中执行，避免阻塞事件循环
+                        self.record_received(message)
+                        try:
+                            await loop.run_in_executor(
+                                None, self.process_image_data, message.payload, device_id, client_address
+                            )
+                        finally:
+                            self.release_inflight(message.length)
+                    elif self.pipeline.drop_policy == DROP_POLICY_BLOCK:
+                        # 阻塞策略下等待队列空位，不能占用事件循环
+                        self.record_received(message)
+                        await loop.run_in_executor(
+                            None, self.pipeline.submit, device_id, client_address, message.buffer, message.length
+                        )
+                    else:
+                        self.handle_image_data(message, client_address)
+                # 一次读取中的多条消息的响应合并发送
+                ack = acks.take()
+                if ack:
+                    writer.write(ack)
+                await writer.drain()
+
+        except ProtocolError as e:
+            self.log.warning('protocol', f"{e}，断开连接", e.device_id)
+        except Exception as e:
+            self.log.error('client_error', f"处理客户端时出错: {e}", device_id)
 
-                # 处理不同类型的消息
-                if msg_type == MSG_REGISTER:
-                    self.handle_register(client_socket, device_id, data_length, client_address)
+        finally:
+            writer.close()
+            self.release_parser(parser)
+            self.close_connection()
+            self.mark_disconnected(device_id)
 
-                elif msg_type == MSG_HEARTBEAT:
-                    self.handle_heartbeat(client_socket, device_id)
+    def handle_client(self, client_socket, client_address):
+        """处理单个客户端连接"""
+        parser = self.create_parser()
+        acks = AckTracker()
+        device_id = None
+        try:
+            while self.running:
+                # 一次读取可能包含多条消息，也可能只是一条消息的一部分
+                count = client_socket.recv_into(parser.get_buffer())
+                if not count:
+                    break
 
-                elif msg_type == MSG_IMAGE_DATA:
-                    self.handle_image_data(client_socket, device_id, data_length, client_address)
+                for message in parser.buffer_updated(count):
+                    device_id = message.device_id
+                    self.record_sequence(message, acks)
+                    if message.payload is not None:
+                        self.handle_message(client_socket.sendall, message, client_address)
 
-                else:
-                    print(f"[设备{device_id}] 未知消息类型: {msg_type}")
-                    break
+                # v2 设备的心跳和图像在一次读取后合并确认
+                ack = acks.take()
+                if ack:
+                    client_socket.sendall(ack)
 
+        except ProtocolError as e:
+            self.log.warning('protocol', f"{e}，断开连接", e.device_id)
         except Exception as e:
-            print(f"[设备{device_id}] 处理客户端时出错: {e}")
+            self.log.error('client_error', f"处理客户端时出错: {e}", device_id)
 
         finally:
             client_socket.close()
-            if device_id:
-                with self.device_lock:
-                    if device_id in self.devices:
-                        self.devices[device_id].connected = False
-                print(f"[设备{device_id}] 客户端断开连接")
+            self.release_parser(parser)
+            self.close_connection()
+            self.mark_disconnected(device_id)
+
+    def open_connection(self, client_address):
+        """接受新连接前检查同时连接数上限，返回 False 时应立即关闭连接"""
+        with self.connection_lock:
+            if self.connections < self.max_clients:
+                self.connections += 1
+                return True
+            self.connections_rejected += 1
+            # 连接风暴时每 REJECT_LOG_INTERVAL 秒只输出一条
+            now = time.monotonic()
+            logged_at, logged_count = self.rejects_logged
+            if now - logged_at < REJECT_LOG_INTERVAL:
+                return False
+            self.rejects_logged = (now, self.connections_rejected)
+            count = self.connections_rejected - logged_count
+        self.log.warning('connect_rejected', f"连接数已达上限 {self.max_clients}，拒绝连接: {client_address}"
+                         f"（上次提示后共拒绝{count}个）", address=client_address, max_clients=self.max_clients,
+                         rejected=count)
+        return False
+
+    def close_connection(self):
+        with self.connection_lock:
+            self.connections -= 1
+
+    def create_parser(self):
+        """为连接创建消息解析器
+
+        启用流水线时图像直接接收到缓冲池的缓冲区，连同所有权一起交给流水线；
+        收到图像消息头后由准入控制判断是否接收
+        """
+        allocate = self.buffer_pool.acquire if self.pipeline is not None else bytearray
+        return MessageParser(SERVER_MESSAGE_TYPES, self.settings.max_message_size, allocate,
+                             admit=self.admission.admit)
+
+    def release_parser(self, parser):
+        """连接关闭时归还未接收完的图像缓冲区"""
+        if parser.payload_buffer is None:
+            return
+        if self.buffer_pool is not None:
+            self.buffer_pool.release(parser.payload_buffer)
+        if parser.header[0] == MSG_IMAGE_DATA:
+            self.release_inflight(len(parser.payload_view))
+
+    def release_inflight(self, length):
+        """一帧已接收的图像处理完成或被丢弃，归还准入控制的在途内存"""
+        self.admission.release(length)
+
+    def handle_message(self, send, message, client_address):
+        """处理一条完整的消息，send 用于发送响应"""
+        if message.msg_type == MSG_REGISTER:
+            self.handle_register(send, message, client_address)
 
-    def handle_register(self, client_socket, device_id, data_length, client_address):
+        elif message.msg_type == MSG_HEARTBEAT:
+            self.handle_heartbeat(send, message)
+
+        elif message.msg_type == MSG_IMAGE_DATA:
+            self.handle_image_data(message, client_address)
+
+    def mark_disconnected(self, device_id):
+        """连接关闭后将设备标记为断开"""
+        if device_id:
+            with self.device_lock:
+                if device_id in self.devices:
+                    device = self.devices[device_id]
+                    device.connected = False
+                    device.session_open = False
+                    self.registry_version += 1
+            self.log.info('disconnect', "客户端断开连接", device_id)
+
+    def handle_register(self, send, message, client_address):
         """处理设备注册"""
-        # 接收设备信息
-        device_data = self.recv_all(client_socket, data_length)
-        if not device_data:
-            return
+        device_id = message.device_id
+        version = negotiate_version(message.reserved)
+        self.register_device(device_id, message.payload, client_address, version)
+
+        # 发送注册响应，版本字段为协商的协议版本
+        send(pack_header(MSG_REGISTER_ACK, device_id, reserved=version))
 
+        # 显示当前在线设备
+        self.print_device_status()
+
+    def register_device(self, device_id, device_data, client_address, version=0):
+        """根据注册数据登记设备（与传输方式无关），version 为协商的协议版本"""
         # 解析设备名称和位置
-        device_name = device_data[:32].decode('utf-8').strip('\x00')
-        location = device_data[32:96].decode('utf-8').strip('\x00')
+        device_name, location = parse_register(device_data)
+        saved = self.load_saved_device(device_id) if self.worker and device_id not in self.devices else None
 
         # 注册设备
         with self.device_lock:
-            if device_id in self.devices:
+            reconnect = device_id in self.devices
+            if reconnect:
                 # 设备重新连接
                 device = self.devices[device_id]
                 device.address = client_address
                 device.connected = True
+                device.session_open = True
+                device.protocol_version = max(version, PROTOCOL_V1)
                 device.update_heartbeat()
-                print(f"[设备{device_id}] 重新连接: {device_name} ({location})")
             else:
-                # 新设备注册
+                # 新设备注册（多进程模式下沿用状态快照中的计数和注册时间）
                 device = DeviceInfo(device_id, device_name, location, client_address)
-                self.devices[device_id] = device
-                print(f"[设备{device_id}] 新设备注册: {device_name} ({location})")
+                if saved is not None:
+                    device.image_count, device.heartbeat_count = saved.image_count, saved.heartbeat_count
+                    device.register_time_monotonic = saved.register_time_monotonic
+                device.protocol_version = max(version, PROTOCOL_V1)
+                devices = dict(self.devices)
+                devices[device_id] = device
+                self.devices = devices
+            self.registry_version += 1
+
+        self.deadline_index.touch(device_id)
+        if self.udp_listener is not None:
+            self.udp_listener.forget(device_id)
+        if self.worker:
+            self.worker.send('register', device_id)
+        self.log.info('register', f"{'重新连接' if reconnect else '新设备注册'}: {device_name} ({location})"
+                      f"{', 协议v2' if version >= PROTOCOL_V2 else ''}",
+                      device_id, name=device_name, location=location, reconnect=reconnect,
+                      protocol_version=max(version, PROTOCOL_V1))
+
+    def load_saved_device(self, device_id):
+        """多进程模式：从状态快照读取设备之前的注册信息，没有时返回 None"""
+        if self.state_store is None:
+            return None
+        try:
+            rows = self.state_store.load_devices(device_id)
+        except sqlite3.Error as e:
+            self.log.warning('state', f"读取状态快照失败: {e}", device_id)
+            return None
+        return DeviceInfo.from_row(rows[0], (time.monotonic(), time.time())) if rows else None
+
+    def handle_supervisor_command(self, command, *args):
+        """处理监督进程发来的命令（多进程模式）"""
+        if command == 'release':
+            self.release_device(args[0])
+
+    def release_device(self, device_id):
+        """设备已重连到其他工作进程：不再检测其心跳超时，关闭其段文件"""
+        with self.device_lock:
+            if device_id not in self.devices:
+                return
+            devices = dict(self.devices)
+            del devices[device_id]
+            self.devices = devices
+            self.registry_version += 1
+        self.deadline_index.remove(device_id)
+        if self.segment_store is not None:
+            self.segment_store.release(device_id)
+        if self.event_builder is not None:
+            self.event_builder.release(device_id)
+        if self.retention is not None:
+            self.retention.forget(device_id)
+        self.log.info('release', "已由其他工作进程接管", device_id)
+
+    def handle_heartbeat(self, send, message):
+        """处理心跳消息"""
+        self.update_device_heartbeat(message.device_id)
 
-        # 发送注册响应
-        ack_header = struct.pack('!BBHI', MSG_REGISTER_ACK, 0, device_id, 0)
-        client_socket.send(ack_header)
+        # 发送心跳响应（v2 心跳由 AckTracker 合并确认）
+        if message.seq is None:
+            send(pack_header(MSG_HEARTBEAT_ACK, message.device_id))
 
-        # 显示当前在线设备
-        self.print_device_status()
+    def record_sequence(self, message, acks):
+        """v2 消息：记入连接的累计确认，统计设备的延迟、丢帧和乱序"""
+        if message.seq is None:
+            return
+        acks.received(message)
+        device = self.devices.get(message.device_id)
+        if device is None:
+            return
+        device_id = message.device_id
+
+        if message.msg_type == MSG_IMAGE_DATA:
+            # 收到消息头时的本地时间 - 设备采集时间
+            received_at = time.time() - (time.perf_counter() - message.started)
+            latency = received_at - message.timestamp / 1e6
+            self.metrics.observe('latency', max(latency, 0.0))
+            lost, late = device.sequence.frame(message.seq, latency)
+            if late:
+                self.metrics.inc('frames_reordered_total', device_id)
+        else:
+            lost = device.sequence.sync(message.seq)
+        if lost:
+            self.log.warning('frames_lost', f"检测到丢帧: {lost}帧 (当前序号 {message.seq})", device_id,
+                             lost=lost, seq=message.seq)
 
-    def handle_heartbeat(self, client_socket, device_id):
-        """处理心跳消息"""
+    def update_device_heartbeat(self, device_id):
+        """更新设备心跳时间"""
         with self.device_lock:
-            if device_id in self.devices:
-                self.devices[device_id].update_heartbeat()
-                # print(f"[设备{device_id}] 收到心跳")  # 可选：减少日志输出
-
-        # 发送心跳响应
-        ack_header = struct.pack('!BBHI', MSG_HEARTBEAT_ACK, 0, device_id, 0)
-        client_socket.send(ack_header)
+            if device_id not in self.devices:
+                return
+            device = self.devices[device_id]
+            device.update_heartbeat()
+            device.heartbeat_count += 1
+        self.deadline_index.touch(device_id)
+        self.metrics.inc('heartbeats_total', device_id)
 
-    def handle_image_data(self, client_socket, device_id, data_length, client_address):
+    def handle_image_data(self, message, client_address):
         """处理图像数据"""
-        # 接收图像数据
-        image_data = self.recv_all(client_socket, data_length)
-        if not image_data:
+        device_id = message.device_id
+        self.record_received(message)
+        if self.pipeline is not None:
+            # 缓冲区连同所有权一起交给流水线，连接线程立即返回
+            self.pipeline.submit(device_id, client_address, message.buffer, message.length)
+            return
+
+        try:
+            self.process_image_data(message.payload, device_id, client_address)
+        finally:
+            self.release_inflight(message.length)
+
+    def record_received(self, message):
+        """记录一帧图像的接收指标，并把原始JPEG交给实时预览"""
+        device_id = message.device_id
+        self.metrics.observe('receive', time.perf_counter() - message.started)
+        self.metrics.inc('frames_total', device_id)
+        self.metrics.inc('bytes_total', device_id, message.length)
+        self.preview_hub.publish(device_id, message.payload)
+
+    def process_job(self, job):
+        """流水线工作线程：处理一帧图像"""
+        self.metrics.observe('queue_wait', time.monotonic() - job.enqueue_time)
+        self.process_image_data(job.data, job.device_id, job.client_address)
+
+    def process_job_in_process(self, job):
+        """流水线工作线程：将解码和保存交给工作进程"""
+        if self.settings.save_mode == SAVE_MODE_PASSTHROUGH:
+            # 直存模式下保存无需解码，在线程中直接完成
+            self.process_job(job)
             return
 
-        # 解码图像
-        nparr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        self.metrics.observe('queue_wait', time.monotonic() - job.enqueue_time)
+        device_id = job.device_id
+        if self.is_duplicate(DecodedFrame(job.data, self.decoder), device_id):
+            # 相似帧不交给工作进程，省去完整解码和保存
+            self.record_image(device_id)
+            self.skip_duplicate(job.data, device_id, job.client_address)
+            return
+        # 分段存储和视频片段需要工作进程返回重新编码的JPEG
+        save_images = self.settings.save_images
+        return_encoded = save_images and self.settings.storage_backend != STORAGE_BACKEND_FILES
+        filename = self.make_save_path(device_id) if save_images and not return_encoded else None
+
+        # 解码后的图像不传回：显示线程自行缩小解码原始JPEG
+        shape, _, encoded = self.process_pool.submit(
+            decode_and_save, bytes(job.data), filename, False, return_encoded, self.decoder.name
+        ).result()
+
+        if shape is None:
+            self.metrics.inc('decode_failures_total', device_id)
+            self.log.warning('decode_failed', "图像解码失败", device_id)
+            return
 
-        if frame is not None:
-            print(f"[设备{device_id}] 成功接收图像: {frame.shape}, 大小: {data_length} 字节")
+        self.record_image(device_id)
+        if encoded is not None:
+            filename = self.save_jpeg(device_id, encoded)
+        elif filename is not None:
+            self.record_saved_file(device_id, filename)
+        self.log.frame(device_id, shape, job.length, filename)
+        display = self.display
+        if display is not None:
+            display.post_jpeg(device_id, job.data, job.client_address[0])
+
+    def process_image_data(self, image_data, device_id, client_address):
+        """解码并处理一帧图像数据"""
+        if self.settings.save_mode == SAVE_MODE_PASSTHROUGH:
+            self.process_jpeg_passthrough(image_data, device_id, client_address)
+            return
 
-            # 更新设备信息
-            with self.device_lock:
-                if device_id in self.devices:
-                    self.devices[device_id].image_count += 1
-                    self.devices[device_id].update_heartbeat()
+        data_length = len(image_data)
+
+        # 解码图像（同一帧的其他使用方通过 decoded 共享解码结果）
+        decoded = DecodedFrame(image_data, self.decoder)
+        if self.is_duplicate(decoded, device_id):
+            # 相似帧不保存，也不需要完整解码
+            self.record_image(device_id)
+            self.skip_duplicate(image_data, device_id, client_address)
+            return
+        with StageTimer(self.metrics, 'decode'):
+            frame = decoded.get()
 
-            self.process_frame(frame, device_id, client_address)
+        if frame is not None:
+            self.record_image(device_id)
+            self.process_frame(frame, device_id, client_address, data_length)
         else:
-            print(f"[设备{device_id}] 图像解码失败")
-
-    def recv_all(self, sock, size):
-        """接收指定大小的数据"""
-        data = b''
-        while len(data) < size:
-            packet = sock.recv(size - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
-
-    def process_frame(self, frame, device_id, client_address):
-        """处理接收到的图像"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            self.metrics.inc('decode_failures_total', device_id)
+            self.log.warning('decode_failed', "图像解码失败", device_id)
+
+    def process_jpeg_passthrough(self, image_data, device_id, client_address):
+        """直存模式：原样保存设备发送的JPEG，只有显示时才解码"""
+        data_length = len(image_data)
+
+        if self.settings.jpeg_validate:
+            with StageTimer(self.metrics, 'validate'):
+                valid = is_valid_jpeg(image_data)
+            if not valid:
+                self.metrics.inc('decode_failures_total', device_id)
+                self.log.warning('invalid_jpeg', f"图像校验失败（不是完整的JPEG）, 大小: {data_length} 字节",
+                                 device_id, bytes=data_length)
+                return
 
-        # 保存图像
-        if self.save_images:
-            device_dir = f"{self.save_dir}/device_{device_id}"
-            if not os.path.exists(device_dir):
-                os.makedirs(device_dir)
+        shape = read_jpeg_shape(image_data)
+        self.record_image(device_id)
+
+        filename = None
+        if self.settings.save_images and not self.is_duplicate(DecodedFrame(image_data, self.decoder), device_id):
+            with StageTimer(self.metrics, 'save'):
+                filename = self.save_jpeg(device_id, image_data)
+        self.log.frame(device_id, shape, data_length, filename)
+
+        # 显示线程只解码最终显示的帧
+        display = self.display
+        if display is not None:
+            display.post_jpeg(device_id, image_data, client_address[0])
+
+    def is_duplicate(self, decoded, device_id):
+        """相似帧检测：与该设备最近保留的帧几乎相同时返回 True（只需要 1/8 灰度解码）"""
+        if self.deduplicator is None or not self.settings.save_images:
+            return False
+        with StageTimer(self.metrics, 'dedup'):
+            gray = decoded.get(DEDUP_DECODE_SCALE, DEDUP_DECODE_COLOR)
+            # 无法解码的帧交给后续处理计为解码失败
+            return gray is not None and not self.deduplicator.check(device_id, gray, len(decoded.data))
+
+    def skip_duplicate(self, image_data, device_id, client_address):
+        """相似帧：照常记录和显示，但不保存"""
+        self.log.frame(device_id, read_jpeg_shape(image_data), len(image_data))
+        display = self.display
+        if display is not None:
+            display.post_jpeg(device_id, image_data, client_address[0])
+
+    def record_image(self, device_id):
+        """更新设备信息"""
+        with self.device_lock:
+            if device_id not in self.devices:
+                return
+            self.devices[device_id].image_count += 1
+            self.devices[device_id].update_heartbeat()
+        self.deadline_index.touch(device_id)
 
-            filename = f"{device_dir}/motion_{timestamp}.jpg"
-            cv2.imwrite(filename, frame)
-            print(f"[设备{device_id}] 图像已保存: {filename}")
+    def make_save_path(self, device_id):
+        """生成图像保存路径，首次使用时创建设备目录"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        device_dir = f"{self.settings.save_dir}/device_{device_id}"
+        if device_dir not in self.known_dirs:
+            os.makedirs(device_dir, exist_ok=True)
+            self.known_dirs.add(device_dir)
+        return f"{device_dir}/motion_{timestamp}.jpg"
+
+    def save_jpeg(self, device_id, jpeg_data):
+        """保存JPEG数据，返回保存位置"""
+        if self.segment_store is not None:
+            path, offset = self.segment_store.append(device_id, jpeg_data)
+            if self.retention is not None:
+                self.retention.record(device_id, path, len(jpeg_data) + INDEX_RECORD_SIZE,
+                                      paths=(path, os.path.splitext(path)[0] + '.idx'))
+            return f"{path}@{offset}"
+        if self.event_builder is not None:
+            # 只是加入事件的待编码批次，视频由后台线程编码
+            location = self.event_builder.add(device_id, jpeg_data)
+            return f"{location[0]}#{location[1]}" if location else None
+
+        filename = self.make_save_path(device_id)
+        with open(filename, 'wb') as f:
+            f.write(jpeg_data)
+        self.record_saved_file(device_id, filename, len(jpeg_data))
+        return filename
+
+    def record_saved_file(self, device_id, filename, size=None):
+        """单个JPEG文件写入后计入存储占用（size 未知时读取文件大小）"""
+        if self.retention is not None:
+            self.retention.record(device_id, filename, os.path.getsize(filename) if size is None else size)
+
+    def process_frame(self, frame, device_id, client_address, data_length):
+        """处理接收到的图像"""
+        # 保存图像
+        filename = None
+        if self.settings.save_images:
+            with StageTimer(self.metrics, 'save'):
+                if self.settings.storage_backend != STORAGE_BACKEND_FILES:
+                    filename = self.save_jpeg(device_id, cv2.imencode('.jpg', frame)[1].tobytes())
+                else:
+                    filename = self.make_save_path(device_id)
+                    cv2.imwrite(filename, frame)
+                    self.record_saved_file(device_id, filename)
+        self.log.frame(device_id, frame.shape, data_length, filename)
 
         # 显示图像
-        if self.config.getboolean('server', 'display_images', fallback=True):
-            window_name = f'设备{device_id} - {client_address[0]}'
-            cv2.imshow(window_name, frame)
-            cv2.waitKey(1)
+        display = self.display
+        if display is not None:
+            display.post_frame(device_id, frame, client_address[0])
+
+    def get_pipeline_stats(self):
+        """返回每个设备的流水线队列统计，未启用流水线时返回空字典"""
+        if self.pipeline is None:
+            return {}
+        return self.pipeline.get_stats()
 
     def monitor_devices(self):
         """监控设备状态"""
-        print("设备监控线程启动")
+        self.log.debug('monitor', "设备监控线程启动")
 
         while self.running:
-            time.sleep(self.check_interval)
+            # 阻塞到最早的截止时间（最长 check_interval 秒），只处理已过期的设备
+            max_wait = max(min(self.settings.check_interval, self.status_reporter.min_interval), MIN_MONITOR_WAIT)
+            expired = self.deadline_index.wait_expired(max_wait, lambda: not self.running)
 
-            with self.device_lock:
-                offline_devices = []
+            if self.worker:
+                # 定期向监督进程上报本进程的设备状态
+                self.report_status(False)
+            # 输出之前因频率限制被推迟的状态列表
+            elif self.status_reporter.acquire_pending():
+                self.print_device_status(force=True)
 
-                for device_id, device in self.devices.items():
-                    if not device.is_alive(self.heartbeat_timeout):
-                        if device.connected:
-                            device.connected = False
-                            offline_devices.append(device_id)
+            if not expired:
+                continue
 
-                # 报告离线设备
+            offline_devices = []
+            with self.device_lock:
+                for device_id, _ in expired:
+                    device = self.devices.get(device_id)
+                    # 弹出后又收到心跳的设备会由心跳处理重新加入索引
+                    if device is None or device.is_alive(self.settings.heartbeat_timeout):
+                        continue
+                    if device.connected:
+                        device.connected = False
+                        offline_devices.append((device_id, device.device_name, device.location,
+                                                device.seconds_since_heartbeat()))
                 if offline_devices:
-                    print("\n" + "=" * 60)
-                    print("⚠️  检测到设备离线:")
-                    for device_id in offline_devices:
-                        device = self.devices[device_id]
-                        elapsed = (datetime.now() - device.last_heartbeat).total_seconds()
-                        print(f"  - 设备{device_id} ({device.device_name})")
-                        print(f"    位置: {device.location}")
-                        print(f"    最后心跳: {int(elapsed)}秒前")
-                    print("=" * 60)
-
-                    # 显示当前设备状态
-                    self.print_device_status()
-
-    def print_device_status(self):
-        """打印设备状态"""
-        with self.device_lock:
-            if not self.devices:
-                print("\n当前无设备连接")
-                return
-
-            print("\n" + "=" * 60)
-            print("设备状态列表:")
-            print("-" * 60)
-
-            online_count = 0
-            offline_count = 0
-
-            for device_id, device in sorted(self.devices.items()):
-                status = device.get_status()
-                status_icon = "✓" if status['connected'] else "✗"
-                status_text = "在线" if status['connected'] else "离线"
-
-                if status['connected']:
-                    online_count += 1
-                else:
-                    offline_count += 1
-
-                print(f"{status_icon} 设备{device_id}: {status['device_name']}")
-                print(f"  位置: {status['location']}")
-                print(f"  状态: {status_text}")
-                print(f"  地址: {status['address']}")
-                print(f"  最后心跳: {status['last_heartbeat']} ({status['elapsed_seconds']}秒前)")
-                print(f"  接收图像: {status['image_count']}张")
-                print(f"  注册时间: {status['register_time']}")
-                print("-" * 60)
-
-            print(f"总计: {len(self.devices)}台设备 (在线: {online_count}, 离线: {offline_count})")
-            print("=" * 60 + "\n")
+                    self.registry_version += 1
+
+            # 报告离线设备
+            if offline_devices:
+                self.log.warning('devices_offline', format_offline_report(offline_devices, self.settings.status_detail_limit),
+                                 count=len(offline_devices),
+                                 devices=[device_id for device_id, _, _, _ in offline_devices])
+
+                # 显示当前设备状态
+                self.print_device_status()
+
+    def get_status_snapshot(self):
+        """生成设备状态快照，不获取 device_lock，不阻塞心跳和图像处理"""
+        devices = self.devices  # 写时复制，引用本身即是一致的设备集合
+        version = self.registry_version
+        pipeline_stats = self.get_pipeline_stats()
+        dedup_stats = self.deduplicator.get_stats() if self.deduplicator is not None else {}
+        admission_stats = self.admission.get_stats()
+        reference = clock_reference()
+
+        rows = []
+        for device_id, device in sorted(devices.items()):
+            status = device.get_status(reference)
+            if device_id in pipeline_stats:
+                status.update(pipeline_stats[device_id])
+            if device_id in dedup_stats:
+                status.update(dedup_stats[device_id])
+            if device_id in admission_stats:
+                stats = admission_stats[device_id]
+                status['admission_dropped'] = sum(stats['dropped'].values())
+                status['admission_dropped_bytes'] = stats['dropped_bytes']
+            rows.append(status)
+        return StatusSnapshot(version, reference[1], rows)
+
+    def report_status(self, report):
+        """向监督进程上报设备状态，report 为 True 时请求其输出汇总的状态列表"""
+        self.worker.send('snapshot', list(self.get_status_snapshot().devices), report)
+
+    def print_device_status(self, force=False):
+        """打印设备状态（受 status_report_interval 频率限制，force 为 True 时忽略）"""
+        if self.worker:
+            # 多进程模式下由监督进程汇总输出
+            self.report_status(True)
+            return
+        if not force and not self.status_reporter.acquire():
+            return
+        snapshot = self.get_status_snapshot()
+        self.log.info('device_status', format_device_status(snapshot, self.settings.status_detail_limit),
+                      total=len(snapshot.devices), online=snapshot.online_count, offline=snapshot.offline_count)
 
     def stop(self):
         """停止服务器"""
         self.running = False
+        self.deadline_index.wake()
+        self.reload_event.set()
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if self.preview_server:
+            self.preview_server.stop()
+            self.preview_server = None
+        if self.udp_listener:
+            self.udp_listener.stop()
+            self.udp_listener = None
         if self.server_socket:
             self.server_socket.close()
-        cv2.destroyAllWindows()
-        print("服务器已关闭")
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        if self.segment_store:
+            self.segment_store.close()
+        if self.event_builder:
+            # 结束进行中的事件并等待编码完成
+            self.event_builder.stop()
+        if self.retention:
+            self.retention.stop()
+        if self.state_store is not None:
+            # 写入最后一次快照并记录正常退出
+            self.state_wakeup.set()
+            if self.state_thread is not None:
+                self.state_thread.join(timeout=10)
+                self.state_thread = None
+            self.save_state()
+            try:
+                self.state_store.close()
+            except sqlite3.Error as e:
+                self.log.warning('state', f"状态快照关闭失败: {e}")
+            self.state_store = None
+        if self.display:
+            self.display.stop()
+        if self.log.thread is not None:
+            self.log.info('shutdown', "服务器已关闭")
+            self.log.stop()
+            if self.log_stream:
+                self.log_stream.close()
+                self.log_stream = None
+
+def run_worker(config_file, index, events, commands):
+    """多进程模式下工作进程的入口"""
+    server = ImageServer(config_file, worker=WorkerChannel(index, events, commands))
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        # 监督进程退出时不再读取事件队列，不等待未发送完的事件
+        events.cancel_join_thread()
+
+def run_supervisor(config_file, workers):
+    """多进程模式：启动 workers 个工作进程共同监听同一端口"""
+    settings = load_settings(config_file)
+    log, log_stream = create_event_log(settings, 'supervisor')
+    log.info('startup', f"多进程模式: {workers}个工作进程 (SO_REUSEPORT)", workers=workers)
+    if settings.udp_heartbeat_port > 0:
+        log.warning('config', "多进程模式下不支持 UDP 心跳，设备需通过 TCP 发送心跳")
+
+    def reload_supervisor(supervisor):
+        try:
+            settings = load_settings(config_file, verbose=False)
+        except configparser.Error as e:
+            log.error('reload', f"配置文件读取失败，保持当前设置: {e}")
+            return
+        log.level = parse_level(settings.log_level)
+        supervisor.status_reporter.min_interval = settings.status_report_interval
+        supervisor.detail_limit = settings.status_detail_limit
+        log.info('reload', "已通知工作进程重新加载设置")
+
+    supervisor = Supervisor(
+        config_file, workers, run_worker, log,
+        status_interval=settings.status_report_interval,
+        detail_limit=settings.status_detail_limit,
+        on_reload=reload_supervisor
+    )
+    try:
+        supervisor.run()
+    finally:
+        log.stop()
+        if log_stream:
+            log_stream.close()
 
 def main():
     config_file = 'config/server_config.ini'
@@ -357,6 +1486,13 @@ def main():
     if len(sys.argv) > 1:
         config_file = sys.argv[1]
 
+    workers = load_settings(config_file, verbose=False).server_workers
+    if workers > 1:
+        if reuse_port_supported():
+            run_supervisor(config_file, workers)
+            return
+        print("当前系统不支持 SO_REUSEPORT，使用单进程模式")
+
     server = ImageServer(config_file)
 
     try:
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器设置
+启动时（以及收到 SIGHUP 重新加载时）从 server_config.ini 读取一次，校验并转换为类型化的只读对象，
+处理代码直接读取属性，不再在每帧的处理中查询 configparser 并解析字符串。
+
+- 每个设置项的类型和默认值见 FIELDS，取值范围有限的项见 CHOICES，有最小值的项见 MINIMUMS
+- 格式错误、为负数、小于最小值或不在可选范围内的值使用默认值，并在 warnings 中给出提示
+- 重新加载时整体替换设置对象（读取方看到的要么全是旧值，要么全是新值）；
+  LIVE_FIELDS 中的项立即生效，其余项需要重启服务器
+"""
+
+import configparser
+import math
+import os
+
+from event_clips import DEFAULT_CODEC
+from event_log import LEVELS, LOG_FORMAT_JSON, LOG_FORMAT_TEXT
+from frame_pipeline import DROP_POLICY_BLOCK, DROP_POLICY_DROP_OLDEST, PIPELINE_EXECUTOR_PROCESS, PIPELINE_EXECUTOR_THREAD
+from jpeg_decoder import DECODER_AUTO
+from udp_heartbeat import DEFAULT_BATCH_SIZE as UDP_HEARTBEAT_BATCH_SIZE
+
+# 服务器运行模式
+SERVER_MODE_THREADED = 'threaded'   # 每个连接一个线程
+SERVER_MODE_ASYNCIO = 'asyncio'     # 单事件循环处理所有连接
+
+# 图像保存方式
+SAVE_MODE_PASSTHROUGH = 'passthrough'  # 直接写入设备发送的JPEG数据
+SAVE_MODE_REENCODE = 'reencode'        # 解码后用cv2.imwrite重新编码
+
+# 图像存储后端
+STORAGE_BACKEND_FILES = 'files'        # 每帧一个JPEG文件
+STORAGE_BACKEND_SEGMENTS = 'segments'  # 按设备追加写入段文件 + 时间索引
+STORAGE_BACKEND_CLIPS = 'clips'        # 按运动事件编码为视频片段 + 事件索引
+
+# 设置项: 名称 -> (类型, 默认值)
+FIELDS = {
+    'host': (str, '0.0.0.0'),
+    'port': (int, 8888),
+    'save_images': (bool, True),
+    'save_dir': (str, 'received_images'),
+    'save_mode': (str, SAVE_MODE_PASSTHROUGH),
+    'jpeg_validate': (bool, True),
+    'jpeg_decoder': (str, DECODER_AUTO),
+    'dedup_enabled': (bool, False),
+    'dedup_threshold': (int, 2),
+    'dedup_history': (int, 8),
+    'dedup_keep_interval': (float, 10.0),
+    'storage_backend': (str, STORAGE_BACKEND_FILES),
+    'segment_max_mb': (int, 256),
+    'segment_max_seconds': (int, 3600),
+    'clip_gap_seconds': (float, 2.0),
+    'clip_max_seconds': (int, 300),
+    'clip_codec': (str, DEFAULT_CODEC),
+    'clip_fps': (float, 0.0),
+    'clip_workers': (int, 2),
+    'clip_max_pending_frames': (int, 1000),
+    'retention_max_mb': (float, 0.0),
+    'retention_device_max_mb': (float, 0.0),
+    'retention_max_days': (float, 0.0),
+    'retention_device_limits': (str, ''),
+    'retention_interval': (float, 10.0),
+    'retention_batch_size': (int, 1000),
+    'state_file': (str, ''),
+    'state_snapshot_interval': (float, 30.0),
+    'display_images': (bool, True),
+    'display_fps': (int, 10),
+    'display_tile_size': (str, '320x240'),
+    'display_max_tiles': (int, 16),
+    'max_clients': (int, 10),
+    'admission_max_fps': (float, 0.0),
+    'admission_max_kb_per_second': (float, 0.0),
+    'admission_burst_seconds': (float, 2.0),
+    'admission_max_inflight_mb': (float, 0.0),
+    'heartbeat_timeout': (int, 90),
+    'check_interval': (int, 10),
+    'udp_heartbeat_port': (int, 0),
+    'udp_heartbeat_batch_size': (int, UDP_HEARTBEAT_BATCH_SIZE),
+    'status_report_interval': (int, 10),
+    'status_detail_limit': (int, 20),
+    'metrics_host': (str, '127.0.0.1'),
+    'metrics_port': (int, 8889),
+    'preview_host': (str, '127.0.0.1'),
+    'preview_port': (int, 0),
+    'preview_max_fps': (int, 10),
+    'max_message_size': (int, 8 * 1024 * 1024),
+    'pipeline_workers': (int, 2),
+    'pipeline_executor': (str, PIPELINE_EXECUTOR_THREAD),
+    'pipeline_queue_size': (int, 64),
+    'pipeline_device_queue_size': (int, 8),
+    'pipeline_drop_policy': (str, DROP_POLICY_DROP_OLDEST),
+    'server_mode': (str, SERVER_MODE_THREADED),
+    'server_workers': (int, 1),
+    'log_level': (str, 'info'),
+    'log_format': (str, LOG_FORMAT_TEXT),
+    'log_file': (str, ''),
+    'log_queue_size': (int, 10000),
+    'log_summary_interval': (int, 10),
+    'log_device_rate': (int, 5),
+}
+
+# 取值范围有限的设置项: 名称 -> (说明, 可选值)，比较时忽略大小写
+CHOICES = {
+    'save_mode': ("保存方式", (SAVE_MODE_PASSTHROUGH, SAVE_MODE_REENCODE)),
+    'storage_backend': ("存储后端", (STORAGE_BACKEND_FILES, STORAGE_BACKEND_SEGMENTS, STORAGE_BACKEND_CLIPS)),
+    'server_mode': ("服务器模式", (SERVER_MODE_THREADED, SERVER_MODE_ASYNCIO)),
+    'pipeline_executor': ("流水线工作者类型", (PIPELINE_EXECUTOR_THREAD, PIPELINE_EXECUTOR_PROCESS)),
+    'pipeline_drop_policy': ("丢帧策略", (DROP_POLICY_DROP_OLDEST, DROP_POLICY_BLOCK)),
+    'log_level': ("日志级别", tuple(LEVELS)),
+    'log_format': ("日志格式", (LOG_FORMAT_TEXT, LOG_FORMAT_JSON)),
+}
+
+# 有最小值的数值设置项: 名称 -> 最小值，其余数值项只要求不为负数
+# 间隔、超时、队列和批次大小为 0 时会让循环空转、拒绝所有设备或永远等待
+MINIMUMS = {
+    'port': 1,
+    'dedup_history': 1,
+    'segment_max_mb': 1,
+    'segment_max_seconds': 1,
+    'clip_max_seconds': 1,
+    'clip_workers': 1,
+    'clip_max_pending_frames': 1,
+    'retention_interval': 1,
+    'retention_batch_size': 1,
+    'display_fps': 1,
+    'display_max_tiles': 1,
+    'max_clients': 1,
+    'heartbeat_timeout': 1,
+    'check_interval': 1,
+    'udp_heartbeat_batch_size': 1,
+    'status_report_interval': 1,
+    'max_message_size': 1,
+    'pipeline_queue_size': 1,
+    'pipeline_device_queue_size': 1,
+    'server_workers': 1,
+    'log_queue_size': 1,
+}
+
+# 重新加载时立即生效的设置项（不断开设备连接），其余项需要重启
+LIVE_FIELDS = frozenset({
+    'save_images', 'save_mode', 'jpeg_validate', 'display_images',
+    'retention_max_mb', 'retention_device_max_mb', 'retention_max_days', 'retention_device_limits',
+    'retention_interval', 'retention_batch_size',
+    'max_clients', 'admission_max_fps', 'admission_max_kb_per_second', 'admission_burst_seconds',
+    'admission_max_inflight_mb', 'max_message_size',
+    'heartbeat_timeout', 'check_interval', 'status_report_interval', 'status_detail_limit',
+    'log_level', 'log_device_rate',
+})
+
+BOOLEAN_STATES = configparser.ConfigParser.BOOLEAN_STATES
+
+class Settings:
+    """类型化的只读服务器设置，用 Settings.parse() 或 load_settings() 创建"""
+    __slots__ = tuple(FIELDS) + ('warnings',)
+
+    def __init__(self, values, warnings=()):
+        for name in FIELDS:
+            object.__setattr__(self, name, values[name])
+        object.__setattr__(self, 'warnings', tuple(warnings))  # 校验时发现的问题（已改用默认值）
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"设置不可修改: {name}（修改配置文件后重新加载）")
+
+    @classmethod
+    def parse(cls, section):
+        """从配置的 [server] 节（name -> 字符串）校验并转换"""
+        values = {}
+        warnings = []
+        for name, (kind, default) in FIELDS.items():
+            raw = section.get(name)
+            if raw is None:
+                values[name] = default
+                continue
+            value = parse_value(kind, raw)
+            minimum = MINIMUMS.get(name, 0)
+            if value is None or (kind is not str and value < minimum):
+                limit = f"（最小为 {minimum}）" if minimum else ""
+                warnings.append(f"配置项 {name} 的值无效: {raw}{limit}，使用 {default}")
+                value = default
+            elif name in CHOICES:
+                label, choices = CHOICES[name]
+                value = value.strip().lower()
+                if value not in choices:
+                    warnings.append(f"未知的{label}: {value}，使用 {default}")
+                    value = default
+            values[name] = value
+        return cls(values, warnings)
+
+    def replace(self, **values):
+        """返回修改了部分设置项的新对象"""
+        merged = {name: getattr(self, name) for name in FIELDS}
+        merged.update(values)
+        return Settings(merged, self.warnings)
+
+    def changed(self, other):
+        """返回与 other 取值不同的设置项名称"""
+        return [name for name in FIELDS if getattr(self, name) != getattr(other, name)]
+
+def parse_value(kind, raw):
+    """把配置中的字符串转换为 kind 类型，格式错误或不是有限数时返回 None"""
+    if kind is str:
+        return raw.strip()
+    if kind is bool:
+        return BOOLEAN_STATES.get(raw.strip().lower())
+    try:
+        value = kind(raw)
+    except ValueError:
+        return None
+    # nan 与任何数比较都为 False，会绕过取值范围检查；inf 会让等待时间和计算溢出
+    if kind is float and not math.isfinite(value):
+        return None
+    return value
+
+def load_config(config_file, verbose=True):
+    """读取配置文件，未设置的项使用默认值"""
+    config = configparser.ConfigParser()
+
+    # 默认配置
+    config['server'] = {name: str(default).lower() if kind is bool else str(default)
+                        for name, (kind, default) in FIELDS.items()}
+
+    if os.path.exists(config_file):
+        config.read(config_file, encoding='utf-8')
+        if verbose:
+            print(f"配置文件加载成功: {config_file}")
+    elif verbose:
+        print(f"配置文件不存在，使用默认配置")
+
+    return config
+
+def load_settings(config_file, verbose=True):
+    """读取配置文件并校验，配置文件格式错误时抛出 configparser.Error"""
+    return Settings.parse(load_config(config_file, verbose)['server'])
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行状态快照（热重启）
+设备注册表和存储占用索引定期写入 SQLite 数据库，服务器重启后从快照恢复，不再从零开始：
+
+- 写入：后台线程每隔一段时间写入一次，每次一个事务；注册表只写入有变化的设备，
+  存储索引只写入新增的项和已删除项的范围（见 retention.RetentionManager.collect_state）
+- 崩溃安全：数据库使用 WAL 模式，进程崩溃或断电后停留在最后一次提交的快照，不会损坏
+- 正常退出时写入最后一次快照并记录"已正常退出"；启动时据此判断快照之后是否可能有未记录的文件
+- 快照中记录保存目录，保存目录改变后存储索引作废
+
+表结构:
+    devices           设备注册表，每个设备一行（时间为 Unix 时间戳）
+    storage_devices   每个设备下一项的序号
+    storage_items     存储索引：设备ID、序号、起止时间（微秒）、字节数、文件名（'/' 分隔）
+"""
+
+import os
+import sqlite3
+import threading
+
+SCHEMA_VERSION = 1
+
+# 文件名之间的分隔符（文件名中不会出现）
+NAME_SEPARATOR = '/'
+
+DEVICE_COLUMNS = ('device_id', 'name', 'location', 'address', 'protocol_version', 'image_count',
+                  'heartbeat_count', 'register_time', 'last_seen')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS devices (
+    device_id INTEGER PRIMARY KEY, name TEXT, location TEXT, address TEXT, protocol_version INTEGER,
+    image_count INTEGER, heartbeat_count INTEGER, register_time REAL, last_seen REAL);
+CREATE TABLE IF NOT EXISTS storage_devices (device_id INTEGER PRIMARY KEY, next_seq INTEGER);
+CREATE TABLE IF NOT EXISTS storage_items (
+    device_id INTEGER, seq INTEGER, start_us INTEGER, end_us INTEGER, size INTEGER, names TEXT,
+    PRIMARY KEY (device_id, seq)) WITHOUT ROWID;
+"""
+
+class StorageChange:
+    """一个设备的存储索引自上次快照以来的变化"""
+    __slots__ = ('device_id', 'next_seq', 'rewrite', 'delete_before', 'rows')
+
+    def __init__(self, device_id, next_seq, rewrite, delete_before, rows):
+        self.device_id = device_id
+        self.next_seq = next_seq
+        self.rewrite = rewrite              # True 时删除该设备的全部旧记录
+        self.delete_before = delete_before  # 删除序号小于此值的记录（已被保留策略删除）
+        self.rows = rows                    # [(序号, 起始微秒, 结束微秒, 字节数, 文件名)]，新增或有变化的项
+
+class StateStore:
+    """SQLite 状态快照，可在多个线程中使用（内部加锁）"""
+
+    def __init__(self, path, source='main'):
+        self.path = path
+        self.source = source  # 多进程模式下每个工作进程分别记录是否正常退出
+        self.lock = threading.Lock()
+        self.connection = None
+        self.clean = False    # 之前的运行是否都已正常退出（快照之后没有未记录的变化）
+
+    def open(self, save_dir=None):
+        """打开（或创建）数据库；save_dir 与快照中记录的不同时清空存储索引"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version not in (0, SCHEMA_VERSION):
+                # 格式不兼容的旧快照直接丢弃
+                connection.executescript("DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS devices; "
+                                         "DROP TABLE IF EXISTS storage_devices; DROP TABLE IF EXISTS storage_items;")
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+            meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+            running_key = f"running:{self.source}"
+            self.clean = not any(key.startswith('running:') and value == '1' for key, value in meta.items())
+            connection.execute("BEGIN IMMEDIATE")
+            if save_dir is not None:
+                save_dir = os.path.abspath(save_dir)
+                if meta.get('save_dir') not in (None, save_dir):
+                    connection.execute("DELETE FROM storage_devices")
+                    connection.execute("DELETE FROM storage_items")
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('save_dir', ?)", (save_dir,))
+            connection.execute("INSERT OR REPLACE INTO meta VALUES (?, '1')", (running_key,))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.close()
+            raise
+        self.connection = connection
+
+    def close(self):
+        """记录正常退出并关闭数据库（应在写入最后一次快照之后调用）"""
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, '0')", (f"running:{self.source}",))
+            finally:
+                self.connection.close()
+                self.connection = None
+
+    def load_devices(self, device_id=None):
+        """返回注册表中的设备 [(DEVICE_COLUMNS 对应的值)]，device_id 不为 None 时只查询该设备"""
+        query = f"SELECT {', '.join(DEVICE_COLUMNS)} FROM devices"
+        with self.lock:
+            if device_id is None:
+                return self.connection.execute(query).fetchall()
+            return self.connection.execute(query + " WHERE device_id = ?", (device_id,)).fetchall()
+
+    def load_storage_devices(self):
+        """返回有存储索引的设备 {device_id: 下一项的序号}"""
+        with self.lock:
+            return dict(self.connection.execute("SELECT device_id, next_seq FROM storage_devices").fetchall())
+
+    def load_items(self, device_id):
+        """返回设备的存储索引 [(序号, 起始微秒, 结束微秒, 字节数, 文件名)]，按序号排序"""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT seq, start_us, end_us, size, names FROM storage_items WHERE device_id = ? ORDER BY seq",
+                (device_id,)).fetchall()
+
+    def save(self, devices=(), storage=()):
+        """在一个事务中写入有变化的设备注册信息和存储索引"""
+        with self.lock:
+            connection = self.connection
+            if connection is None:
+                return
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if devices:
+                    connection.executemany(
+                        f"INSERT OR REPLACE INTO devices ({', '.join(DEVICE_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(DEVICE_COLUMNS))})", devices)
+                for change in storage:
+                    if change.rewrite:
+                        connection.execute("DELETE FROM storage_items WHERE device_id = ?", (change.device_id,))
+                    else:
+                        connection.execute("DELETE FROM storage_items WHERE device_id = ? AND seq < ?",
+                                           (change.device_id, change.delete_before))
+                    connection.executemany("INSERT OR REPLACE INTO storage_items VALUES (?, ?, ?, ?, ?, ?)",
+                                           [(change.device_id,) + row for row in change.rows])
+                    connection.execute("INSERT OR REPLACE INTO storage_devices VALUES (?, ?)",
+                                       (change.device_id, change.next_seq))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
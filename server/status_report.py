@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备状态报告
+状态快照在不持有 device_lock 的情况下生成，格式化和输出都在锁外完成；
+设备较多时输出汇总信息，并限制完整状态列表的输出频率
+"""
+
+import threading
+import time
+
+class StatusSnapshot:
+    """某一时刻的设备状态（只读）"""
+    __slots__ = ('version', 'taken_at', 'devices', 'online_count', 'offline_count')
+
+    def __init__(self, version, taken_at, devices):
+        self.version = version
+        self.taken_at = taken_at
+        self.devices = tuple(devices)  # 按设备ID排序的状态字典
+        self.online_count = sum(1 for status in self.devices if status['connected'])
+        self.offline_count = len(self.devices) - self.online_count
+
+class StatusReporter:
+    """限制状态列表的输出频率
+
+    请求在 min_interval 内已输出过时只记为待输出，
+    由监控线程在间隔到期后合并成一次输出
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.last_report = None
+        self.pending = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """返回 True 表示现在可以输出"""
+        now = time.monotonic()
+        with self.lock:
+            if self.last_report is None or now - self.last_report >= self.min_interval:
+                self.last_report = now
+                self.pending = False
+                return True
+            self.pending = True
+            return False
+
+    def acquire_pending(self):
+        """有被推迟的请求且已到期时返回 True"""
+        with self.lock:
+            if not self.pending:
+                return False
+        return self.acquire()
+
+def format_id_list(device_ids, limit=30):
+    """将设备ID列表压缩为区间形式，如 1-5, 8, 10-12"""
+    ranges = []
+    for device_id in sorted(device_ids):
+        if ranges and device_id == ranges[-1][1] + 1:
+            ranges[-1][1] = device_id
+        else:
+            ranges.append([device_id, device_id])
+    parts = [str(a) if a == b else f"{a}-{b}" for a, b in ranges[:limit]]
+    if len(ranges) > limit:
+        parts.append(f"...(另{len(ranges) - limit}段)")
+    return ", ".join(parts)
+
+def format_device_status(snapshot, detail_limit):
+    """设备数不超过 detail_limit 时输出逐台详情，否则输出汇总"""
+    if not snapshot.devices:
+        return "\n当前无设备连接"
+
+    lines = ["", "=" * 60]
+    if len(snapshot.devices) <= detail_limit:
+        lines.append("设备状态列表:")
+        lines.append("-" * 60)
+        for status in snapshot.devices:
+            status_icon = "✓" if status['connected'] else "✗"
+            status_text = "在线" if status['connected'] else "离线"
+            lines.append(f"{status_icon} 设备{status['device_id']}: {status['device_name']}")
+            lines.append(f"  位置: {status['location']}")
+            lines.append(f"  状态: {status_text}")
+            lines.append(f"  地址: {status['address']}")
+            if 'worker' in status:
+                lines.append(f"  工作进程: {status['worker']}")
+            lines.append(f"  最后心跳: {status['last_heartbeat']} ({status['elapsed_seconds']}秒前)")
+            lines.append(f"  接收图像: {status['image_count']}张")
+            if 'queue_depth' in status:
+                lines.append(f"  处理队列: {status['queue_depth']}帧排队, 已丢弃{status['dropped']}帧")
+            if 'dedup_dropped' in status:
+                lines.append(f"  相似帧: 未保存{status['dedup_dropped']}帧, "
+                             f"节省{status['dedup_bytes_saved'] / 1024 / 1024:.1f}MB")
+            if status.get('admission_dropped'):
+                lines.append(f"  准入限制: 丢弃{status['admission_dropped']}帧, "
+                             f"{status['admission_dropped_bytes'] / 1024 / 1024:.1f}MB")
+            if 'frames_lost' in status:
+                latency = f"{status['latency_ms']}ms" if status['latency_ms'] is not None else "-"
+                lines.append(f"  传输(v2): 延迟{latency} (最大{status['latency_max_ms']}ms), "
+                             f"丢失{status['frames_lost']}帧, 乱序{status['frames_reordered']}帧")
+            lines.append(f"  注册时间: {status['register_time']}")
+            lines.append("-" * 60)
+    else:
+        lines.append(f"设备状态汇总 ({snapshot.taken_at.strftime('%Y-%m-%d %H:%M:%S')}):")
+        lines.append("-" * 60)
+        offline_ids = [status['device_id'] for status in snapshot.devices if not status['connected']]
+        if offline_ids:
+            lines.append(f"离线设备: {format_id_list(offline_ids)}")
+        total_images = sum(status['image_count'] for status in snapshot.devices)
+        lines.append(f"接收图像: 共{total_images}张")
+        busiest = sorted(snapshot.devices, key=lambda status: status['image_count'], reverse=True)[:5]
+        busiest = [status for status in busiest if status['image_count'] > 0]
+        if busiest:
+            lines.append("图像最多: " + ", ".join(
+                f"设备{status['device_id']}({status['image_count']}张)" for status in busiest))
+        dropped = sum(status.get('dropped', 0) for status in snapshot.devices)
+        if dropped:
+            lines.append(f"处理队列丢弃: 共{dropped}帧")
+        deduplicated = sum(status.get('dedup_dropped', 0) for status in snapshot.devices)
+        if deduplicated:
+            saved = sum(status['dedup_bytes_saved'] for status in snapshot.devices if 'dedup_dropped' in status)
+            lines.append(f"相似帧未保存: 共{deduplicated}帧, 节省{saved / 1024 / 1024:.1f}MB")
+        limited = [status for status in snapshot.devices if status.get('admission_dropped')]
+        if limited:
+            top = sorted(limited, key=lambda status: status['admission_dropped'], reverse=True)[:5]
+            lines.append(f"超出准入限制丢弃: 共{sum(status['admission_dropped'] for status in limited)}帧, " +
+                         ", ".join(f"设备{status['device_id']}({status['admission_dropped']}帧)" for status in top))
+        v2_devices = [status for status in snapshot.devices if 'frames_lost' in status]
+        if v2_devices:
+            lost = sum(status['frames_lost'] for status in v2_devices)
+            reordered = sum(status['frames_reordered'] for status in v2_devices)
+            lines.append(f"v2设备: {len(v2_devices)}台, 丢失{lost}帧, 乱序{reordered}帧")
+            slowest = sorted((status for status in v2_devices if status['latency_ms'] is not None),
+                             key=lambda status: status['latency_ms'], reverse=True)[:5]
+            if slowest:
+                lines.append("延迟最高: " + ", ".join(
+                    f"设备{status['device_id']}({status['latency_ms']}ms)" for status in slowest))
+        lines.append("-" * 60)
+
+    lines.append(f"总计: {len(snapshot.devices)}台设备 "
+                 f"(在线: {snapshot.online_count}, 离线: {snapshot.offline_count})")
+    lines.append("=" * 60 + "\n")
+    return "\n".join(lines)
+
+def format_offline_report(offline_devices, detail_limit):
+    """offline_devices: [(device_id, device_name, location, 距最后心跳秒数)]"""
+    lines = ["", "=" * 60, "⚠️  检测到设备离线:"]
+    if len(offline_devices) <= detail_limit:
+        for device_id, device_name, location, elapsed in offline_devices:
+            lines.append(f"  - 设备{device_id} ({device_name})")
+            lines.append(f"    位置: {location}")
+            lines.append(f"    最后心跳: {int(elapsed)}秒前")
+    else:
+        lines.append(f"  共{len(offline_devices)}台: "
+                     f"{format_id_list(device_id for device_id, _, _, _ in offline_devices)}")
+    lines.append("=" * 60)
+    return "\n".join(lines)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UDP 心跳通道
+设备通过 TCP 注册后，可改为向 UDP 端口发送 8 字节的心跳数据报（格式见 protocol.py），
+TCP 连接只传输图像，心跳不再占用连接线程，也不需要逐条回复。
+
+- 一个线程、一个套接字接收所有设备的心跳：每次唤醒后以非阻塞方式连续读取，
+  最多 batch_size 个数据报合并为一批（Python 没有 recvmmsg，用循环 recvfrom 代替）
+- 每批按设备和来源IP合并后调用一次 on_batch，由服务器在一次加锁中批量核对来源并更新在线状态
+- 按序号统计丢失的心跳，重复和迟到的数据报不计入；只有被服务器接受的数据报才更新序号，
+  伪造来源的数据报不会影响设备的重复和丢失统计
+"""
+
+import select
+import socket
+import threading
+
+from protocol import DATAGRAM_SIZE, parse_heartbeat_datagram
+
+# 每次唤醒最多连续读取的数据报数
+DEFAULT_BATCH_SIZE = 256
+
+# 接收缓冲区大小，心跳集中到达时由内核暂存
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# 等待数据报的最长时间（秒），超时后检查是否已停止
+WAIT_TIMEOUT = 0.5
+
+# 序号比已收到的小不超过此值时视为迟到的数据报；相差更多时视为设备重启后序号从头开始
+REORDER_WINDOW = 64
+
+class UdpHeartbeatListener:
+    """在后台线程中接收 UDP 心跳数据报
+
+    on_batch({(device_id, 来源IP): 心跳数}) 在接收线程中调用，返回被接受的键的集合
+    （未注册、TCP 连接已断开或来源IP与 TCP 连接不一致的设备被拒绝）；
+    心跳数为去掉重复和迟到的数据报后的数量，可能为 0
+    """
+
+    def __init__(self, host, port, on_batch, batch_size=DEFAULT_BATCH_SIZE, log=None):
+        self.host = host
+        self.port = port
+        self.on_batch = on_batch
+        self.batch_size = max(1, batch_size)
+        self.log = log
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.last_seq = {}  # device_id -> 最近收到的序号
+
+        # 统计（只在接收线程中修改）
+        self.received = 0
+        self.malformed = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.rejected = 0
+        self.batches = 0
+
+    def start(self):
+        """绑定端口并启动接收线程，端口被占用时抛出 OSError"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            sock.bind((self.host, self.port))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.port = sock.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='udp-heartbeat', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=WAIT_TIMEOUT * 2)
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def forget(self, device_id):
+        """设备重新注册：序号重新开始"""
+        self.last_seq.pop(device_id, None)
+
+    def run(self):
+        sock = self.sock
+        while self.running:
+            try:
+                readable, _, _ = select.select([sock], [], [], WAIT_TIMEOUT)
+            except (OSError, ValueError):
+                return
+            if not readable:
+                continue
+            datagrams = self.drain(sock)
+            if datagrams:
+                self.batches += 1
+                try:
+                    self.process(datagrams)
+                except Exception as e:
+                    if self.log is not None:
+                        self.log.error('udp_heartbeat', f"处理心跳失败: {e}")
+
+    def drain(self, sock):
+        """连续读取已到达的数据报（最多 batch_size 个），返回 {(device_id, 来源IP): [序号, ...]}"""
+        datagrams = {}
+        recvfrom = sock.recvfrom
+        for _ in range(self.batch_size):
+            try:
+                data, address = recvfrom(DATAGRAM_SIZE + 1)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break
+            self.received += 1
+            parsed = parse_heartbeat_datagram(data)
+            if parsed is None:
+                self.malformed += 1
+                continue
+            key = (parsed[0], address[0])
+            seqs = datagrams.get(key)
+            if seqs is None:
+                datagrams[key] = [parsed[1]]
+            else:
+                seqs.append(parsed[1])
+        return datagrams
+
+    def process(self, datagrams):
+        """按序号去掉重复的数据报后交给 on_batch，被接受后才提交序号和统计
+
+        返回被接受的 {(device_id, 来源IP): 心跳数}；on_batch 为 None 时全部接受
+        """
+        checked = {key: self.check_sequence(self.last_seq.get(key[0]), seqs) for key, seqs in datagrams.items()}
+        counts = {key: result[0] for key, result in checked.items()}
+        accepted = counts.keys() if self.on_batch is None else self.on_batch(counts)
+        for key, seqs in datagrams.items():
+            if key not in accepted:
+                self.rejected += len(seqs)
+                continue
+            count, last, duplicates, lost = checked[key]
+            self.last_seq[key[0]] = last
+            self.duplicates += duplicates
+            self.lost += lost
+        return {key: counts[key] for key in accepted}
+
+    @staticmethod
+    def check_sequence(previous, seqs):
+        """返回 (有效心跳数, 最新序号, 重复数, 丢失数)，previous 为已接受的最新序号（None 表示没有）"""
+        count = duplicates = lost = 0
+        for seq in seqs:
+            if previous is not None:
+                step = (seq - previous) % (1 << 32)
+                if step == 0 or step >= (1 << 32) - REORDER_WINDOW:
+                    # 重复或迟到的数据报
+                    duplicates += 1
+                    continue
+                if step < (1 << 31):
+                    lost += step - 1
+            previous = seq
+            count += 1
+        return count, previous, duplicates, lost
+
+    def get_stats(self):
+        return {
+            'received': self.received,
+            'malformed': self.malformed,
+            'duplicates': self.duplicates,
+            'lost': self.lost,
+            'rejected': self.rejected,
+            'batches': self.batches,
+        }
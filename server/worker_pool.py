@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程工作模式
+N 个工作进程各自运行一个完整的 ImageServer，用 SO_REUSEPORT 绑定同一端口，
+由内核把新连接分配到各进程，解码和保存不再受单个进程GIL的限制。
+
+监督进程不处理连接，只负责：
+- 启动工作进程，意外退出时重新启动
+- 汇总各工作进程上报的设备状态，统一输出状态列表（受 status_report_interval 限制）
+- 记录每个设备当前所属的工作进程；设备重连到另一个工作进程时，
+  通知原进程释放该设备（停止超时检测、关闭段文件），保证同一时刻只有一个进程
+  负责该设备的心跳超时和存储写入
+
+工作进程 -> 监督进程（共享事件队列）:
+    ('register', index, device_id)          设备在该进程注册
+    ('snapshot', index, rows, report)       该进程的设备状态行，report 为 True 时请求输出状态列表
+监督进程 -> 工作进程（每个进程一个命令队列）:
+    ('release', device_id)                  设备已由其他进程接管
+"""
+
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+
+from status_report import StatusReporter, StatusSnapshot, format_device_status
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+class WorkerChannel:
+    """工作进程与监督进程之间的通信通道（在工作进程中使用）"""
+
+    def __init__(self, index, events, commands):
+        self.index = index
+        self.events = events
+        self.commands = commands
+        self.thread = None
+
+    def send(self, kind, *args):
+        """发送事件，不等待监督进程处理"""
+        self.events.put((kind, self.index) + args)
+
+    def start(self, handler):
+        """在后台线程中接收监督进程的命令，handler(命令, 参数...)"""
+        def receive_loop():
+            while True:
+                handler(*self.commands.get())
+
+        self.thread = threading.Thread(target=receive_loop, daemon=True)
+        self.thread.start()
+
+class Supervisor:
+    """启动并监督工作进程，汇总设备注册表"""
+
+    def __init__(self, config_file, workers, target, log, status_interval=10, detail_limit=20, on_reload=None):
+        self.config_file = config_file
+        self.workers = workers
+        self.target = target  # 工作进程入口 target(config_file, index, events, commands)
+        self.log = log
+        self.detail_limit = detail_limit
+        self.status_reporter = StatusReporter(status_interval)
+        self.on_reload = on_reload  # 收到 SIGHUP 时调用 on_reload(supervisor)，重新加载监督进程自己的设置
+        self.reload_requested = False
+
+        self.context = multiprocessing.get_context('spawn')
+        self.events = None
+        self.processes = {}  # index -> Process
+        self.commands = {}   # index -> Queue
+
+        # 汇总的设备注册表
+        self.owners = {}     # device_id -> 工作进程序号
+        self.rows = {}       # 工作进程序号 -> {device_id: 状态字典}
+        self.version = 0
+        self.running = False
+
+    def start_worker(self, index):
+        commands = self.context.Queue()
+        process = self.context.Process(
+            target=self.target,
+            args=(self.config_file, index, self.events, commands),
+            name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.commands[index] = commands
+        self.log.info('worker', f"工作进程{index}已启动 (pid {process.pid})", worker=index, pid=process.pid)
+
+    def run(self):
+        self.events = self.context.Queue()
+        self.running = True
+        previous_handler = signal.signal(signal.SIGTERM, self.handle_sigterm)
+        previous_hup = signal.signal(signal.SIGHUP, self.handle_sighup) if hasattr(signal, 'SIGHUP') else None
+        try:
+            for index in range(self.workers):
+                self.start_worker(index)
+
+            while self.running:
+                try:
+                    event = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    event = None
+                if event is not None:
+                    self.handle_event(event)
+                if self.status_reporter.acquire_pending():
+                    self.print_status()
+                if self.reload_requested:
+                    self.reload()
+                self.check_workers()
+        except KeyboardInterrupt:
+            self.log.info('shutdown', "接收到中断信号，正在关闭工作进程...")
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            if previous_hup is not None:
+                signal.signal(signal.SIGHUP, previous_hup)
+            self.stop_workers()
+
+    def handle_sigterm(self, signum, frame):
+        self.running = False
+
+    def handle_sighup(self, signum, frame):
+        self.reload_requested = True
+
+    def reload(self):
+        """把 SIGHUP 转发给各工作进程（各自重新读取配置文件），并重新加载监督进程的设置"""
+        self.reload_requested = False
+        for process in self.processes.values():
+            if process.is_alive():
+                try:
+                    os.kill(process.pid, signal.SIGHUP)
+                except OSError:
+                    pass
+        if self.on_reload is not None:
+            self.on_reload(self)
+
+    def handle_event(self, event):
+        kind, index = event[0], event[1]
+        if kind == 'register':
+            device_id = event[2]
+            previous = self.owners.get(device_id)
+            self.owners[device_id] = index
+            if previous is not None and previous != index and previous in self.commands:
+                # 设备重连到了另一个工作进程，原进程不再负责该设备
+                self.commands[previous].put(('release', device_id))
+                self.rows.get(previous, {}).pop(device_id, None)
+                self.log.info('handover', f"由工作进程{previous}转到工作进程{index}", device_id,
+                              previous=previous, worker=index)
+            self.version += 1
+        elif kind == 'snapshot':
+            rows, report = event[2], event[3]
+            self.rows[index] = {row['device_id']: row for row in rows}
+            self.version += 1
+            if report and self.status_reporter.acquire():
+                self.print_status()
+
+    def check_workers(self):
+        """重新启动意外退出的工作进程"""
+        if not self.running:
+            return
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            self.log.error('worker', f"工作进程{index}意外退出 (退出码 {process.exitcode})，重新启动",
+                           worker=index, exitcode=process.exitcode)
+            # 该进程上的连接已全部断开
+            for row in self.rows.pop(index, {}).values():
+                row['connected'] = False
+                self.rows.setdefault(None, {})[row['device_id']] = row
+            self.start_worker(index)
+
+    def get_status_snapshot(self):
+        """合并各工作进程的状态行，每个设备取其所属进程上报的状态"""
+        merged = {}
+        for index, rows in self.rows.items():
+            for device_id, row in rows.items():
+                owner = self.owners.get(device_id)
+                if device_id in merged and owner != index:
+                    continue
+                row = dict(row)
+                if index is not None:
+                    row['worker'] = index
+                merged[device_id] = row
+        return StatusSnapshot(self.version, datetime.now(),
+                              [merged[device_id] for device_id in sorted(merged)])
+
+    def print_status(self):
+        snapshot = self.get_status_snapshot()
+        self.log.info('device_status', format_device_status(snapshot, self.detail_limit),
+                      total=len(snapshot.devices), online=snapshot.online_count,
+                      offline=snapshot.offline_count)
+
+    def stop_workers(self, timeout=5.0):
+        """向工作进程发送 SIGINT，走与 Ctrl+C 相同的关闭流程，超时后强制结束"""
+        self.running = False
+        for process in self.processes.values():
+            if process.is_alive():
+                try:
+                    os.kill(process.pid, signal.SIGINT)
+                except OSError:
+                    pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+        self.log.info('shutdown', "所有工作进程已退出")
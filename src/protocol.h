@@ -9,13 +9,22 @@ enum MessageType : uint8_t {
     MSG_HEARTBEAT_ACK = 0x02,  // 心跳响应
     MSG_IMAGE_DATA = 0x03,     // 图像数据
     MSG_REGISTER = 0x04,       // 设备注册
-    MSG_REGISTER_ACK = 0x05    // 注册响应
+    MSG_REGISTER_ACK = 0x05,   // 注册响应
+    MSG_HEARTBEAT_DATAGRAM = 0x06 // UDP 心跳数据报
+};
+
+// 协议版本（消息头的 reserved 字段）
+// 设备在注册消息中填写支持的最高版本，服务器在注册响应中回复协商的版本；
+// 填 0 的旧设备按 v1 处理
+enum ProtocolVersion : uint8_t {
+    PROTOCOL_V1 = 0x01,
+    PROTOCOL_V2 = 0x02         // 帧序号、时间戳、累计确认
 };
 
 // 消息头结构（8字节）
 struct MessageHeader {
     uint8_t type;              // 消息类型
-    uint8_t reserved;          // 保留字段
+    uint8_t reserved;          // 保留字段（协议版本）
     uint16_t device_id;        // 设备ID
     uint32_t data_length;      // 数据长度
 } __attribute__((packed));
@@ -32,4 +41,27 @@ struct RegisterMessage {
     char location[64];         // 设备位置
 } __attribute__((packed));
 
+// v2 扩展头（12字节，网络字节序），紧跟在心跳和图像消息的消息头之后，
+// data_length 包含扩展头
+struct MessageExtension {
+    uint32_t sequence;         // 图像: 该帧的序号; 心跳: 最近一帧的序号
+    uint64_t timestamp_us;     // 图像: 采集时间; 心跳: 发送时间（微秒，Unix时间）
+} __attribute__((packed));
+
+// v2 心跳响应数据（累计确认，服务器可合并多次确认，设备不应同步等待）
+struct AckPayload {
+    uint32_t ack_sequence;     // 本连接上已收到的最大帧序号
+    uint64_t echo_timestamp_us; // 回显最后一条消息的时间戳
+} __attribute__((packed));
+
+// UDP 心跳数据报（8字节，网络字节序，与消息头布局相同）
+// 服务器设置了 udp_heartbeat_port 时，已通过 TCP 注册的设备可改为用 UDP 发送心跳，
+// TCP 连接只传输图像；服务器不回复，按序号统计丢失的心跳
+struct HeartbeatDatagram {
+    uint8_t type;              // MSG_HEARTBEAT_DATAGRAM
+    uint8_t version;           // 协议版本
+    uint16_t device_id;        // 设备ID
+    uint32_t sequence;         // 心跳序号，每次加 1
+} __attribute__((packed));
+
 #endif // PROTOCOL_H